@@ -0,0 +1,167 @@
+"""
+This file contains a regression gate for the benchmark suite.
+Two benchmark result files written by run.py are compared per operation and scale.
+A slowdown is flagged as a regression if the mean time of the candidate run
+is more than the threshold slower than the baseline,
+and if Welch's t-test finds the times significantly larger.
+If one of the runs has a single repeat, only the threshold is used.
+An increase in peak memory is flagged if it is larger than the memory threshold.
+The gate exits with a non-zero status if there are regressions,
+so it can be used to test masq upgrades before rolling them out.
+
+Example:
+
+    python -m masq.benchmarks.compare baseline.json candidate.json -t 0.1
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import json
+import argparse
+from statistics import mean
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def compare_runs(baseline, candidate, threshold=0.1, memory_threshold=0.1, alpha=0.05):
+    """
+    Compares the results of two benchmark runs.
+
+    :param baseline: Dictionary of benchmark run, as written by run.py
+    :param candidate: Dictionary of benchmark run to compare to the baseline
+    :param threshold: Relative increase in mean time that counts as a regression
+    :param memory_threshold: Relative increase in peak memory that counts as a regression
+    :param alpha: Significance level of the t-test
+    :return: List of dictionaries with comparisons per operation, scale and metric
+    """
+    reference = {(x['operation'], x['scale']): x for x in baseline['results']}
+    comparisons = list()
+    for result in candidate['results']:
+        key = (result['operation'], result['scale'])
+        if key not in reference:
+            logger.warning("No baseline for " + key[0] + " at scale " + key[1] + ".")
+            continue
+        base = reference.pop(key)
+        comparison = {'operation': key[0], 'scale': key[1], 'metric': 'time',
+                      'baseline': mean(base['times']), 'candidate': mean(result['times']),
+                      'pvalue': _welch_test(base['times'], result['times'])}
+        comparison['change'] = _change(comparison['baseline'], comparison['candidate'])
+        comparison['regression'] = comparison['change'] > threshold and \
+            (comparison['pvalue'] is None or comparison['pvalue'] < alpha)
+        comparisons.append(comparison)
+        if 'peak_memory' in base and 'peak_memory' in result:
+            comparison = {'operation': key[0], 'scale': key[1], 'metric': 'peak_memory',
+                          'baseline': base['peak_memory'], 'candidate': result['peak_memory'],
+                          'pvalue': None}
+            comparison['change'] = _change(comparison['baseline'], comparison['candidate'])
+            comparison['regression'] = comparison['change'] > memory_threshold
+            comparisons.append(comparison)
+    for key in reference:
+        logger.warning("No candidate result for " + key[0] + " at scale " + key[1] + ".")
+    return comparisons
+
+
+def report(comparisons):
+    """
+    Formats comparisons as a table.
+
+    :param comparisons: List returned by compare_runs
+    :return: String with table
+    """
+    lines = ["{:<28} {:<8} {:<12} {:>14} {:>14} {:>8} {:>8}  {}".format(
+        'operation', 'scale', 'metric', 'baseline', 'candidate', 'change', 'p', '')]
+    for x in comparisons:
+        lines.append("{:<28} {:<8} {:<12} {:>14.4f} {:>14.4f} {:>+7.1%} {:>8}  {}".format(
+            x['operation'], x['scale'], x['metric'], x['baseline'], x['candidate'], x['change'],
+            '-' if x['pvalue'] is None else format(x['pvalue'], '.3f'),
+            'REGRESSION' if x['regression'] else ''))
+    return "\n".join(lines)
+
+
+def _change(baseline, candidate):
+    """
+    Returns the relative change from baseline to candidate.
+
+    :param baseline: Baseline value
+    :param candidate: Candidate value
+    :return: Relative change
+    """
+    if baseline == 0:
+        return 0.0 if candidate == 0 else float('inf')
+    return (candidate - baseline) / baseline
+
+
+def _welch_test(baseline, candidate):
+    """
+    Tests if the candidate times are larger than the baseline times,
+    with a one-sided Welch's t-test.
+
+    :param baseline: List of baseline times
+    :param candidate: List of candidate times
+    :return: P-value, or None if one of the lists has fewer than 2 values
+    """
+    if len(baseline) < 2 or len(candidate) < 2:
+        return None
+    from scipy.stats import ttest_ind
+    if len(set(baseline)) == 1 and len(set(candidate)) == 1:
+        return 0.0 if candidate[0] > baseline[0] else 1.0
+    return float(ttest_ind(candidate, baseline, equal_var=False, alternative='greater').pvalue)
+
+
+compare_parser = argparse.ArgumentParser(description='masq benchmark comparison')
+compare_parser.add_argument('baseline',
+                            help='JSON file with baseline benchmark results. ',
+                            type=str)
+compare_parser.add_argument('candidate',
+                            help='JSON file with benchmark results to compare to the baseline. ',
+                            type=str)
+compare_parser.add_argument('-t', '--threshold',
+                            dest='threshold',
+                            help='Relative increase in time that counts as a regression. ',
+                            default=0.1,
+                            type=float)
+compare_parser.add_argument('-m', '--memory_threshold',
+                            dest='memory_threshold',
+                            help='Relative increase in peak memory that counts as a regression. ',
+                            default=0.1,
+                            type=float)
+compare_parser.add_argument('-a', '--alpha',
+                            dest='alpha',
+                            help='Significance level for the t-test on times. ',
+                            default=0.05,
+                            type=float)
+
+
+def main(args=None):
+    options = compare_parser.parse_args(args)
+    with open(options.baseline, 'r') as file:
+        baseline = json.load(file)
+    with open(options.candidate, 'r') as file:
+        candidate = json.load(file)
+    comparisons = compare_runs(baseline, candidate, threshold=options.threshold,
+                               memory_threshold=options.memory_threshold,
+                               alpha=options.alpha)
+    logger.info("Benchmark comparison: \n" + report(comparisons))
+    regressions = [x for x in comparisons if x['regression']]
+    if regressions:
+        logger.error(str(len(regressions)) + " regressions found.")
+        sys.exit(1)
+    logger.info("No regressions found.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+This file contains functions for generating synthetic data for the benchmarks.
+The BIOM tables have a random sparse count matrix,
+a taxonomy where each genus, family, order etc. contains several taxa,
+so networks can be agglomerated, and a configurable number of sample properties.
+The networks are scale-free association networks between the taxa of a BIOM table.
+Networks generated together share a fraction of their edges,
+so their intersection and difference are not empty.
+All generators accept a seed, so the same data is generated for every run.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import random
+import biom
+import numpy as np
+import networkx as nx
+from scipy import sparse
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# taxonomic levels, with the number of taxa per group at the level below
+_levels = [('k__', 4), ('p__', 4), ('c__', 3), ('o__', 3), ('f__', 3), ('g__', 2), ('s__', 2)]
+
+
+def generate_taxonomy(taxa):
+    """
+    Generates a taxonomy for a number of taxa.
+    Taxa are grouped into species, species into genera and so on,
+    so every level has fewer groups than the level below.
+
+    :param taxa: Number of taxa
+    :return: List of lineages, each a list of 7 strings
+    """
+    lineages = list()
+    for i in range(taxa):
+        lineage = list()
+        group = i
+        groups = list()
+        for prefix, size in reversed(_levels):
+            group = group // size
+            groups.append(prefix + 'taxon' + str(group))
+        lineage.extend(reversed(groups))
+        lineages.append(lineage)
+    return lineages
+
+
+def generate_biom(name, taxa=100, samples=20, sparsity=0.8, metadata=2, seed=0):
+    """
+    Generates a BIOM table with random counts, taxonomy and sample metadata.
+    Half of the sample properties are numeric, the other half are text.
+
+    :param name: Name of the table, used as prefix for the taxon and sample IDs
+    :param taxa: Number of taxa
+    :param samples: Number of samples
+    :param sparsity: Fraction of counts that is zero
+    :param metadata: Number of sample properties
+    :param seed: Random seed
+    :return: BIOM table
+    """
+    rng = np.random.default_rng(seed)
+    matrix = sparse.random(taxa, samples, density=1 - sparsity, format='csr',
+                           random_state=rng, data_rvs=lambda n: rng.integers(1, 1000, n))
+    taxon_ids = [name + '_taxon' + str(i) for i in range(taxa)]
+    sample_ids = [name + '_sample' + str(i) for i in range(samples)]
+    observation_metadata = [{'taxonomy': lineage} for lineage in generate_taxonomy(taxa)]
+    sample_metadata = list()
+    for i in range(samples):
+        properties = dict()
+        for j in range(metadata):
+            if j % 2 == 0:
+                properties['property' + str(j)] = float(rng.random())
+            else:
+                properties['property' + str(j)] = 'value' + str(int(rng.integers(0, 5)))
+        sample_metadata.append(properties)
+    return biom.Table(matrix, observation_ids=taxon_ids, sample_ids=sample_ids,
+                      observation_metadata=observation_metadata,
+                      sample_metadata=sample_metadata if metadata else None,
+                      table_id=name)
+
+
+def generate_networks(nodes, number=3, edges=2, overlap=0.5, seed=0):
+    """
+    Generates scale-free networks with the Barabási-Albert model.
+    A single base network is generated first;
+    each network keeps a fraction of the base edges
+    and gets new preferentially attached edges for the rest.
+    Edge weights are 1 or -1.
+
+    :param nodes: List of node names, usually the taxon IDs of a BIOM table
+    :param number: Number of networks
+    :param edges: Number of edges added for each new node
+    :param overlap: Fraction of edges that each network shares with the base network
+    :param seed: Random seed
+    :return: List of networkx graphs
+    """
+    rng = random.Random(seed)
+    mapping = dict(enumerate(nodes))
+    base = nx.relabel_nodes(nx.barabasi_albert_graph(len(nodes), edges, seed=seed), mapping)
+    networks = list()
+    for i in range(number):
+        extra = nx.relabel_nodes(nx.barabasi_albert_graph(len(nodes), edges, seed=seed + i + 1), mapping)
+        network = nx.Graph()
+        network.add_nodes_from(nodes)
+        for source, target in base.edges:
+            if rng.random() < overlap:
+                network.add_edge(source, target)
+        for source, target in extra.edges:
+            if network.number_of_edges() >= base.number_of_edges():
+                break
+            network.add_edge(source, target)
+        for source, target in network.edges:
+            network[source][target]['weight'] = rng.choice([1.0, -1.0])
+        networks.append(network)
+    return networks
+
+
+def write_dataset(path, name, taxa=100, samples=20, sparsity=0.8, metadata=2,
+                  networks=3, edges=2, overlap=0.5, seed=0):
+    """
+    Writes a BIOM table and networks of its taxa to a folder.
+    The BIOM table is written as name.biom in HDF5 format,
+    the networks as name_1.graphml, name_2.graphml etc. in a networks subfolder.
+
+    :param path: Folder to write files to
+    :param name: Name of the BIOM table
+    :param taxa: Number of taxa
+    :param samples: Number of samples
+    :param sparsity: Fraction of counts that is zero
+    :param metadata: Number of sample properties
+    :param networks: Number of networks
+    :param edges: Number of edges added for each new node
+    :param overlap: Fraction of edges that each network shares with the base network
+    :param seed: Random seed
+    :return: Location of BIOM file, location of network folder
+    """
+    from biom.util import biom_open
+    biomtab = generate_biom(name, taxa=taxa, samples=samples, sparsity=sparsity,
+                            metadata=metadata, seed=seed)
+    biom_path = os.path.join(path, name + '.biom')
+    with biom_open(biom_path, 'w') as file:
+        biomtab.to_hdf5(file, generated_by='masq benchmarks')
+    network_path = os.path.join(path, 'networks')
+    os.makedirs(network_path, exist_ok=True)
+    graphs = generate_networks(list(biomtab.ids(axis='observation')), number=networks,
+                               edges=edges, overlap=overlap, seed=seed)
+    for i, network in enumerate(graphs):
+        nx.write_graphml(network, os.path.join(network_path, name + '_' + str(i + 1) + '.graphml'))
+    logger.info("Generated BIOM table with " + str(taxa) + " taxa and " + str(samples) +
+                " samples, and " + str(networks) + " networks with " +
+                str(graphs[0].number_of_edges()) + " edges.")
+    return biom_path, network_path
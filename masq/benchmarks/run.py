@@ -0,0 +1,224 @@
+"""
+This file contains the benchmark suite of masq.
+For each scale, a synthetic BIOM table and networks are generated,
+and the time taken by import_biom, import_networks,
+extract_sets for each set type and start_metastats is measured.
+Every repeat starts from empty tables.
+Peak memory is measured with tracemalloc in a separate repeat,
+since tracing slows down the operations.
+The benchmarks run on the database in the config file,
+so they can be run against PostgreSQL or an embedded SQLite database.
+WARNING: all masq tables in the database are deleted.
+
+The results are written to a JSON file, so runs can be compared.
+
+Example:
+
+    python -m masq.benchmarks.run -c database.ini -s small medium -r 3 -o results.json
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from time import perf_counter
+from datetime import datetime
+import logging.handlers
+from masq.scripts.utils import ParentConnection
+from masq.scripts.sq4biom import import_biom
+from masq.scripts.io import import_networks
+from masq.scripts.netstats import extract_sets
+from masq.scripts.metastats import start_metastats
+from masq.benchmarks.generators import write_dataset
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+scales = {'small': {'taxa': 100, 'samples': 20, 'networks': 3, 'edges': 2},
+          'medium': {'taxa': 1000, 'samples': 50, 'networks': 3, 'edges': 3},
+          'large': {'taxa': 5000, 'samples': 100, 'networks': 5, 'edges': 3}}
+
+sets = ['intersection', 'difference', 'union']
+
+
+def run_benchmarks(config='database.ini', scale_names=None, repeats=3,
+                   level='Genus', sparsity=0.8, metadata=2, analytic=False,
+                   memory=True):
+    """
+    Runs the benchmarks for several scales.
+
+    :param config: Location of file with database parameters.
+    :param scale_names: List of scales from the scales dictionary, by default small
+    :param repeats: Number of times each benchmark is repeated
+    :param level: Taxonomic level used for start_metastats
+    :param sparsity: Fraction of counts that is zero
+    :param metadata: Number of sample properties
+    :param analytic: If True, sets and agglomeration run on a DuckDB mirror
+    :param memory: If True, the peak memory of each operation is measured in an extra repeat
+    :return: Dictionary with run information and list of results
+    """
+    if not scale_names:
+        scale_names = ['small']
+    conn = ParentConnection(config)
+    run = {'date': datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'backend': conn.backend.name,
+           'version': conn.get_version(),
+           'repeats': repeats,
+           'results': list()}
+    for scale_name in scale_names:
+        scale = scales[scale_name]
+        path = tempfile.mkdtemp()
+        try:
+            biom_path, network_path = write_dataset(path, 'bench', sparsity=sparsity,
+                                                    metadata=metadata, **scale)
+            times = dict()
+            for i in range(repeats):
+                logger.info("Running " + scale_name + " benchmarks, repeat " + str(i + 1) + "...")
+                for operation, seconds in _run_scale(conn, config, biom_path,
+                                                     network_path, level, analytic):
+                    times.setdefault(operation, list()).append(seconds)
+            peaks = dict()
+            if memory:
+                logger.info("Measuring peak memory of " + scale_name + " benchmarks...")
+                tracemalloc.start()
+                try:
+                    for operation, seconds in _run_scale(conn, config, biom_path,
+                                                         network_path, level, analytic):
+                        peaks[operation] = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.reset_peak()
+                finally:
+                    tracemalloc.stop()
+            for operation in times:
+                result = {'operation': operation, 'scale': scale_name,
+                          'times': times[operation]}
+                if operation in peaks:
+                    result['peak_memory'] = peaks[operation]
+                result.update(scale)
+                run['results'].append(result)
+        finally:
+            shutil.rmtree(path)
+    conn.delete_tables()
+    return run
+
+
+def _run_scale(conn, config, biom_path, network_path, level, analytic):
+    """
+    Runs each benchmark once on empty tables.
+
+    :param conn: ParentConnection object
+    :param config: Location of file with database parameters.
+    :param biom_path: Location of BIOM file
+    :param network_path: Folder with network files
+    :param level: Taxonomic level used for start_metastats
+    :param analytic: If True, sets and agglomeration run on a DuckDB mirror
+    :return: Generator of operation names and times in seconds
+    """
+    conn.delete_tables()
+    conn.create_tables()
+    start = perf_counter()
+    import_biom(location=biom_path, config=config)
+    yield 'import_biom', perf_counter() - start
+    files = sorted(os.listdir(network_path))
+    sources = {x.split('.')[0]: 'bench' for x in files}
+    start = perf_counter()
+    for file in files:
+        import_networks(location=os.path.join(network_path, file),
+                        sources=sources, config=config)
+    yield 'import_networks', perf_counter() - start
+    networks = sorted(sources)
+    output = tempfile.mkdtemp()
+    try:
+        for set_type in sets:
+            start = perf_counter()
+            extract_sets(output, set_type, networks=networks,
+                         analytic=analytic, config=config)
+            yield 'extract_sets_' + set_type, perf_counter() - start
+    finally:
+        shutil.rmtree(output)
+    start = perf_counter()
+    start_metastats(level, networks=networks, analytic=analytic, config=config)
+    yield 'start_metastats', perf_counter() - start
+
+
+def write_results(run, path):
+    """
+    Writes benchmark results to a JSON file.
+
+    :param run: Dictionary returned by run_benchmarks
+    :param path: Location of JSON file
+    :return:
+    """
+    with open(path, 'w') as file:
+        json.dump(run, file, indent=2)
+    logger.info("Wrote benchmark results to " + path + ".")
+
+
+bench_parser = argparse.ArgumentParser(description='masq benchmarks')
+bench_parser.add_argument('-c', '--config',
+                          dest='config',
+                          help='Config file with the database to run the benchmarks on. \n'
+                               'WARNING: all masq tables in this database are deleted. ',
+                          default='database.ini',
+                          type=str)
+bench_parser.add_argument('-s', '--scales',
+                          dest='scales',
+                          help='One or more scales to run. ',
+                          nargs='+',
+                          choices=list(scales),
+                          default=['small'])
+bench_parser.add_argument('-r', '--repeats',
+                          dest='repeats',
+                          help='Number of times each benchmark is repeated. ',
+                          default=3,
+                          type=int)
+bench_parser.add_argument('-l', '--level',
+                          dest='level',
+                          help='Taxonomic level used for agglomeration. ',
+                          default='Genus',
+                          type=str)
+bench_parser.add_argument('-a', '--analytic',
+                          dest='analytic',
+                          help='If flagged, sets and agglomeration run on a DuckDB mirror. ',
+                          default=False,
+                          action='store_true')
+bench_parser.add_argument('-nm', '--no_memory',
+                          dest='no_memory',
+                          help='If flagged, peak memory is not measured. ',
+                          default=False,
+                          action='store_true')
+bench_parser.add_argument('-o', '--output',
+                          dest='output',
+                          help='Location of JSON file with results. ',
+                          default='benchmarks.json',
+                          type=str)
+
+
+def main():
+    options = bench_parser.parse_args()
+    run = run_benchmarks(config=options.config, scale_names=options.scales,
+                         repeats=options.repeats, level=options.level,
+                         analytic=options.analytic, memory=not options.no_memory)
+    write_results(run, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,11 +18,12 @@ __license__ = 'Apache 2.0'
 import sys
 import argparse
 from ast import literal_eval
-from pbr.version import VersionInfo
-from masq.scripts.sq4biom import import_biom
-from masq.scripts.io import import_networks
-from masq.scripts.utils import setup_database
 import logging.handlers
+# the subcommand modules import their dependencies lazily,
+# so their parsers can be loaded without slowing down the CLI
+from masq.scripts.server import serve_parser
+from masq.scripts.jobs import worker_parser, submit_parser
+from masq.scripts.manifest import manifest_parser
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -44,7 +45,10 @@ def masq(masq_args):
     :param masq_args: Arguments.
     :return:
     """
+    # the masq scripts and their dependencies are only imported
+    # when a task needs them, so the CLI starts quickly
     if masq_args['version']:
+        from pbr.version import VersionInfo
         info = VersionInfo('anuran')
         logger.info('Version ' + info.version_string())
         sys.exit(0)
@@ -58,6 +62,18 @@ def masq(masq_args):
     host = masq_args['host']
     mapping = masq_args['mapping']
     sources = masq_args['sources']
+    if masq_args['profile']:
+        from masq.scripts.instrument import start_profile
+        start_profile(slow=masq_args['slow'])
+    if masq_args['memory']:
+        from masq.scripts.instrument import start_memory_profile
+        start_memory_profile()
+    if masq_args['trace']:
+        from masq.scripts.tracing import start_tracing
+        start_tracing(path=masq_args['trace'])
+    if masq_args['metrics']:
+        from masq.scripts.metrics import start_metrics
+        start_metrics(path=masq_args['metrics'], format=masq_args['metrics_format'])
     if masq_args['mapping']:
         try:
             with open(masq_args['mapping'], 'r') as file:
@@ -74,31 +90,54 @@ def masq(masq_args):
         except (ValueError, TypeError):
             logger.warning("Source file could not be imported,\n"
                            "and will be ignored. ")
+    if masq_args['create'] or masq_args['delete']:
+        from masq.scripts.utils import setup_database
     if masq_args['create']:
         logger.info('Setting up tables in PostgreSQL database. ')
         setup_database(config=config, create=True,
                        host=host, database=database,
-                       username=username, password=password)
+                       username=username, password=password,
+                       partition=masq_args['partition'])
     elif masq_args['delete']:
         setup_database(config=config, create=False,
                        host=host, database=database,
                        username=username, password=password)
         logger.info("Deleted tables in PostgreSQL database.")
     if masq_args['bioms']:
+        from masq.scripts.sq4biom import import_biom
         logger.info('Importing BIOM files... ')
         for biom in bioms:
             import_biom(location=biom, mapping=mapping,
                         config=config,
                         host=host, database=database,
-                        username=username, password=password)
+                        username=username, password=password,
+                        bulk=masq_args['bulk'])
     if masq_args['networks']:
+        from masq.scripts.io import import_networks
         logger.info('Importing network files...')
         for network in networks:
             import_networks(location=network, mapping=mapping,
                             sources=sources,
                             config=config,
                             host=host, database=database,
-                            username=username, password=password)
+                            username=username, password=password,
+                            bulk=masq_args['bulk'])
+    if masq_args['profile']:
+        from masq.scripts.instrument import stop_profile
+        profile = stop_profile()
+        logger.info('Query profile: \n' + profile.report())
+    if masq_args['memory']:
+        from masq.scripts.instrument import stop_memory_profile
+        memory = stop_memory_profile()
+        logger.info('Memory profile: \n' + memory.report())
+    if masq_args['trace']:
+        from masq.scripts.tracing import stop_tracing
+        stop_tracing()
+        logger.info('Wrote trace to ' + masq_args['trace'] + '.')
+    if masq_args['metrics']:
+        from masq.scripts.metrics import stop_metrics
+        stop_metrics()
+        logger.info('Wrote metrics to ' + masq_args['metrics'] + '.')
     logger.info('Completed tasks! ')
 
 
@@ -138,6 +177,14 @@ masq_parser.add_argument('-cr', '--create',
                          help='If flagged, sets up tables in PostgreSQL database. ',
                          default=False,
                          action='store_true')
+masq_parser.add_argument('-pt', '--partition',
+                         dest='partition',
+                         help='Partition layout for the edges and counts tables. \n'
+                              'With "list", each network and study gets its own partition; \n'
+                              'with "hash", rows are spread over a fixed number of partitions. ',
+                         choices=['list', 'hash'],
+                         default=None,
+                         type=str)
 masq_parser.add_argument('-del', '--delete',
                          dest='delete',
                          help='If flagged, deletes tables in PostgreSQL database. ',
@@ -155,6 +202,12 @@ masq_parser.add_argument('-n', '--networks',
                               'These are imported in the PostgreSQL database. ',
                          default=None,
                          type=list)
+masq_parser.add_argument('-bk', '--bulk',
+                         dest='bulk',
+                         help='If flagged, files are loaded through unlogged staging tables,\n'
+                              'and only moved to the database tables if the complete file is valid. ',
+                         default=False,
+                         action='store_true')
 masq_parser.add_argument('-map', '--mapping',
                          dest='map',
                          help='By default, BIOM and network names are derived from file names.\n'
@@ -171,16 +224,66 @@ masq_parser.add_argument('-ns', '--network_sources',
                               'Example: {"banana": "apple"} matches the graph banana.graphml to apple.biom.',
                          default=None,
                          type=str)
+masq_parser.add_argument('-prof', '--profile',
+                         dest='profile',
+                         help='If flagged, records the wall time and row counts of all queries, \n'
+                              'and reports the most time-consuming queries when masq finishes. ',
+                         default=False,
+                         action='store_true')
+masq_parser.add_argument('-sq', '--slow_query',
+                         dest='slow',
+                         help='With --profile, queries that take longer than this number of seconds \n'
+                              'are logged as slow queries. ',
+                         default=1.0,
+                         type=float)
+masq_parser.add_argument('-mem', '--memory_profile',
+                         dest='memory',
+                         help='If flagged, reports the peak and retained memory \n'
+                              'of each stage of the BIOM and network uploads. \n'
+                              'This slows down masq considerably. ',
+                         default=False,
+                         action='store_true')
+masq_parser.add_argument('-met', '--metrics',
+                         dest='metrics',
+                         help='File that metrics are written to, such as rows per second per table, \n'
+                              'imported files and bytes, queries and connection wait time. \n'
+                              'The file is updated after every imported file. ',
+                         default=None,
+                         type=str)
+masq_parser.add_argument('-mf', '--metrics_format',
+                         dest='metrics_format',
+                         help='Format of the metrics file: a Prometheus textfile, \n'
+                              'or JSON lines that are appended to the file. ',
+                         choices=['prometheus', 'jsonl'],
+                         default='prometheus',
+                         type=str)
+masq_parser.add_argument('-tr', '--trace',
+                         dest='trace',
+                         help='File that trace spans of imports, set extraction and agglomeration \n'
+                              'are appended to, as JSON lines. ',
+                         default=None,
+                         type=str)
 masq_parser.add_argument('-version', '--version',
                          dest='version',
                          required=False,
                          help='Version number.',
                          action='store_true',
                          default=False)
+masq_parser.set_defaults(func=None)
+
+# subcommands keep the options of their own parsers
+subparsers = masq_parser.add_subparsers(title='subcommands')
+for name, parser in (('serve', serve_parser), ('worker', worker_parser),
+                     ('submit', submit_parser), ('manifest', manifest_parser)):
+    subparsers.add_parser(name, parents=[parser], add_help=False,
+                          description=parser.description, help=parser.description)
 
 
-def main():
-    options = masq_parser.parse_args()
+def main(args=None):
+    options = masq_parser.parse_args(args)
+    if options.func:
+        options.func(options)
+        return
     masq(vars(options))
 
 
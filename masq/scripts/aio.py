@@ -0,0 +1,437 @@
+"""
+This file contains asyncio versions of the connection classes.
+The connections are taken from a pool of the async psycopg 3 driver,
+so many uploads and queries can be in flight at once from one process
+without blocking the event loop.
+The async classes run the same queries as their blocking counterparts;
+IN %s placeholders with tuples are rewritten to = ANY(%s) with lists,
+since psycopg 3 does not adapt tuples.
+This requires the optional psycopg and psycopg_pool packages,
+and only supports PostgreSQL.
+
+Example:
+
+    async with AsyncIoConnection(config='database.ini', max_size=8) as conn:
+        await asyncio.gather(*[conn.add_network(g, name, 'study') for name, g in networks.items()])
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import re
+import queue
+import asyncio
+import threading
+from uuid import uuid4
+import logging.handlers
+from masq.scripts.utils import read_config, _partition_query
+from masq.scripts.sq4biom import _biom_rows
+from masq.scripts.io import _network_rows, _convert_edges
+from masq.scripts.netstats import _intersection_query, _difference_query, \
+    _union_query, _convert_network
+try:
+    import psycopg
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class AsyncParentConnection:
+    def __init__(self, config='database.ini',
+                 host=None, database=None,
+                 username=None, password=None,
+                 min_size=1, max_size=10):
+        """
+        Initializes an async driver for accessing the PostgreSQL database,
+        with a pool of connections.
+        The pool is opened with the open method,
+        or by using the object as an async context manager.
+
+        :param config: Location of file with database parameters.
+        :param host: Database address.
+        :param database: Name of PostgreSQL database.
+        :param username: Username for PostgreSQL database.
+        :param password: Password of PostgreSQL database.
+        :param min_size: Number of connections kept open in the pool
+        :param max_size: Maximum number of connections in the pool
+        """
+        if psycopg is None:
+            raise ImportError("Async connections require the psycopg and psycopg_pool packages.")
+        self.config, backend = read_config(config, host, database,
+                                           username, password)
+        if backend != 'postgresql':
+            raise ValueError("Async connections require a PostgreSQL database.")
+        # client-side binding, so placeholders can also be used in DDL queries
+        kwargs = {x: self.config[x] for x in self.config if self.config[x]}
+        if 'database' in kwargs:
+            kwargs['dbname'] = kwargs.pop('database')
+        kwargs['cursor_factory'] = psycopg.AsyncClientCursor
+        # decode strings as UTF-8 like psycopg2, also for SQL_ASCII databases
+        kwargs.setdefault('client_encoding', 'utf8')
+        self.pool = AsyncConnectionPool(kwargs=kwargs, min_size=min_size,
+                                        max_size=max_size, open=False)
+        # serializes uploads to partitioned tables, see _insert
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        """
+        Opens the connection pool and logs the database version.
+
+        :return:
+        """
+        logger.info("Connecting to the PostgreSQL database...")
+        await self.pool.open()
+        async with self.pool.connection() as conn:
+            cur = await conn.execute("SELECT version()")
+            db_version = await cur.fetchone()
+            logger.info("Running PostgreSQL version " + db_version[0])
+
+    async def close(self):
+        """
+        Closes all connections in the pool.
+
+        :return:
+        """
+        await self.pool.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def query(self, query, fetch=False):
+        """
+        Accepts a query and provides the results,
+        using a connection from the pool.
+
+        :param query: String containing query
+        :param fetch: If true, fetches results
+        :return: List of results
+        """
+        return await self.value_query(query, values=None, fetch=fetch)
+
+    async def value_query(self, query, values, fetch=False):
+        """
+        Accepts a query with values and provides the results.
+        If values is a list, the query is executed once for each tuple in the list.
+
+        :param query: String containing query
+        :param values: Tuple or list of values
+        :param fetch: If true, fetches results
+        :return: List of results
+        """
+        results = None
+        query, values = _translate(query, values)
+        async with self.pool.connection() as conn:
+            try:
+                async with conn.cursor() as c:
+                    if type(values) == list:
+                        await c.executemany(query, values)
+                    else:
+                        await c.execute(query, values)
+                    if fetch:
+                        results = await c.fetchall()
+            except psycopg.Error as e:
+                logger.error(e)
+                await conn.rollback()
+        return results
+
+    async def iter_query(self, query, values=None, itersize=2000):
+        """
+        Accepts a query and yields the resulting rows one by one,
+        from a server-side cursor that fetches itersize rows per round trip.
+
+        :param query: String containing SELECT query
+        :param values: Tuple of values
+        :param itersize: Number of rows fetched per round trip
+        :return: Async generator of rows
+        """
+        query, values = _translate(query, values)
+        async with self.pool.connection() as conn:
+            try:
+                async with conn.cursor(name="masq_" + uuid4().hex) as c:
+                    c.itersize = itersize
+                    await c.execute(query, values)
+                    async for row in c:
+                        yield row
+            except psycopg.Error as e:
+                logger.error(e)
+
+    async def _handle(self, query, values, handler, itersize=2000):
+        """
+        Passes the rows of a query to a handler that runs in a worker thread.
+        The rows are fetched from a server-side cursor in batches of itersize rows,
+        and at most two batches wait for the handler,
+        so large results neither block the event loop nor are loaded into memory at once.
+
+        :param query: String containing SELECT query
+        :param values: Tuple of values
+        :param handler: Function that accepts an iterable of rows
+        :param itersize: Number of rows fetched per round trip
+        :return: Output of the handler
+        """
+        batches = queue.Queue(maxsize=2)
+        stopped = threading.Event()
+
+        def consume():
+            try:
+                return handler(_drain(batches))
+            finally:
+                stopped.set()
+
+        def put(batch):
+            # stop waiting if the handler returned without reading all rows
+            while not stopped.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        result = asyncio.get_running_loop().run_in_executor(None, consume)
+        try:
+            batch = list()
+            async for row in self.iter_query(query, values, itersize):
+                batch.append(row)
+                if len(batch) == itersize:
+                    await asyncio.to_thread(put, batch)
+                    batch = list()
+                    if stopped.is_set():
+                        break
+            await asyncio.to_thread(put, batch)
+        finally:
+            await asyncio.to_thread(put, None)
+        return await result
+
+    async def _insert(self, conn, key_table, key_rows, tables):
+        """
+        Inserts rows into several tables in one transaction.
+        If the key table is list-partitioned, partitions are created
+        for the first value of each key row.
+        Creating a partition locks the tables it refers to,
+        which can deadlock with concurrent uploads;
+        uploads to list-partitioned tables therefore run one at a time.
+
+        :param conn: Connection from the pool
+        :param key_table: Table that is partitioned by the key rows, edges or counts
+        :param key_rows: List of rows with the partition key as first value
+        :param tables: List of (query, values) tuples
+        :return: True if the transaction was committed
+        """
+        try:
+            async with conn.cursor() as c:
+                await c.execute("SELECT p.partstrat FROM pg_partitioned_table AS p "
+                                "JOIN pg_class AS r ON p.partrelid = r.oid "
+                                "WHERE r.relname = %s;", (key_table,))
+                layout = await c.fetchall()
+                await conn.commit()
+                if layout and layout[0][0] == 'l':
+                    async with self.lock:
+                        async with conn.transaction():
+                            for value in key_rows:
+                                await c.execute(_partition_query(key_table, value[0]), (value[0],))
+                            await _insert_rows(c, tables)
+                else:
+                    async with conn.transaction():
+                        await _insert_rows(c, tables)
+            return True
+        except psycopg.Error as e:
+            logger.error(e)
+            return False
+
+    async def get_networks(self):
+        """
+        Gets the network names from the database.
+
+        :return: List with network names
+        """
+        networks = await self.query("SELECT networkID from networks;", fetch=True)
+        return [x[0] for x in networks]
+
+
+class AsyncBiomConnection(AsyncParentConnection):
+    """
+    Async version of the BiomConnection class.
+    """
+    # inherits init from parent
+    async def add_biom(self, biomfile, name):
+        """
+        Writes a BIOM table to the database.
+        All rows are inserted in one transaction on a single pooled connection,
+        so a failed import leaves the database untouched.
+
+        :param biomfile: BIOM table
+        :param name: BIOM table name
+        :return: True if the BIOM table was uploaded
+        """
+        # the conversion runs in a thread, so other tasks on the event loop continue
+        summary_values, taxonomy_values, sample_values, \
+            meta_values, obs_values = await asyncio.to_thread(_biom_rows, biomfile, name)
+        summary_values = [summary_values]
+        tables = [("INSERT INTO bioms (studyID,tax_num,sample_num) "
+                   "VALUES (%s,%s,%s)", summary_values),
+                  ('INSERT INTO taxonomy (taxon,studyID,Kingdom,Phylum,Class,"Order",Family,Genus,Species) '
+                   'VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)', taxonomy_values),
+                  ("INSERT INTO samples (sampleID, studyID) "
+                   "VALUES (%s,%s)", sample_values),
+                  ("INSERT INTO meta (sampleID, studyID, property, textvalue, numvalue) "
+                   "VALUES (%s,%s,%s,%s,%s)", meta_values),
+                  ("INSERT INTO counts (studyID,taxon,sampleID,count) "
+                   "VALUES (%s,%s,%s,%s)", obs_values)]
+        async with self.pool.connection() as conn:
+            success = await self._insert(conn, 'counts', summary_values, tables)
+        if success:
+            logger.info("Uploaded BIOM data for " + name + ".\n")
+        else:
+            logger.error("Could not upload BIOM data for " + name + ".\n")
+        return success
+
+
+class AsyncIoConnection(AsyncParentConnection):
+    """
+    Async version of the IoConnection class.
+    """
+    # inherits init from parent
+    async def add_network(self, network, name, study):
+        """
+        Writes a networkx object to the database.
+        The network and its edges are inserted in one transaction.
+
+        :param network: NetworkX object
+        :param name: Network name
+        :param study: Study ID (needs to match a biom ID)
+        :return: True if the network was uploaded
+        """
+        # the conversion runs in a thread, so other tasks on the event loop continue
+        network_values, edge_values = await asyncio.to_thread(_network_rows, network, name, study)
+        network_values = [network_values]
+        tables = [("INSERT INTO networks(networkID, studyID,node_num,edge_num) "
+                   "VALUES (%s, %s,%s,%s)", network_values),
+                  ("INSERT INTO edges (networkID,source,target,weight) "
+                   "VALUES (%s,%s,%s,%s)", edge_values)]
+        async with self.pool.connection() as conn:
+            success = await self._insert(conn, 'edges', network_values, tables)
+        if success:
+            logger.info("Uploaded network data for " + name + ".\n")
+        else:
+            logger.error("Could not upload network data for " + name + ".\n")
+        return success
+
+    async def export_network(self, name, handler=None, itersize=2000):
+        """
+        Extracts all edges belonging to a specific network.
+
+        :param name: Network name
+        :param handler: Function that accepts an iterable of edge rows,
+        by default a networkx object is built.
+        :param itersize: Number of rows fetched per round trip
+        :return: Output of the handler
+        """
+        if not handler:
+            handler = _convert_edges
+        return await self._handle("SELECT networkID, source, target, weight FROM edges "
+                                  "WHERE networkID=%s;", (name,), handler, itersize)
+
+
+class AsyncSetConnection(AsyncParentConnection):
+    """
+    Async version of the SetConnection class.
+    """
+    # inherits init from parent
+    async def get_intersection(self, networks, number, weight=True, handler=None):
+        """
+        :param networks: List of networks to extract intersection from
+        :param number: Number of networks where an edge has to occur
+        :param weight: If true, an edge is counted separately if the sign of the weight is different
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
+        """
+        return await self._get_set(_intersection_query(number, weight), networks, handler)
+
+    async def get_difference(self, networks, weight=True, handler=None):
+        """
+        :param networks: List of networks to extract difference from
+        :param weight: If true, an edge is counted separately if the sign of the weight is different
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
+        """
+        return await self._get_set(_difference_query(weight), networks, handler)
+
+    async def get_union(self, networks, handler=None):
+        """
+        :param networks: List of networks to extract union from
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
+        """
+        return await self._get_set(_union_query(), networks, handler)
+
+    async def _get_set(self, set_query, networks, handler):
+        """
+        Runs a set query and passes the rows to the handler.
+
+        :param set_query: Query with a placeholder for the networks
+        :param networks: List of networks
+        :param handler: Function that accepts an iterable of set rows
+        :return: Output of the handler
+        """
+        if not handler:
+            handler = _convert_network
+        return await self._handle(set_query, (tuple(networks),), handler)
+
+
+def _drain(batches):
+    """
+    Yields the rows of batches from a queue, until the queue returns None.
+
+    :param batches: Queue with lists of rows
+    :return: Generator of rows
+    """
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        yield from batch
+
+
+async def _insert_rows(cursor, tables):
+    """
+    Runs insert queries for lists of rows.
+
+    :param cursor: Async cursor
+    :param tables: List of (query, values) tuples
+    :return:
+    """
+    for query, values in tables:
+        if values:
+            await cursor.executemany(query, values)
+
+
+def _translate(query, values):
+    """
+    Rewrites IN %s placeholders for tuples to = ANY(%s) for lists,
+    since psycopg 3 adapts lists to arrays but does not adapt tuples.
+
+    :param query: Query string
+    :param values: Tuple or list of values
+    :return: Query and values
+    """
+    if type(values) == tuple and any(type(x) == tuple for x in values):
+        query = re.sub(r'\bIN\s+%s', '= ANY(%s)', query)
+        values = tuple(list(x) if type(x) == tuple else x for x in values)
+    return query, values
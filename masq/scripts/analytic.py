@@ -0,0 +1,101 @@
+"""
+This file contains a class for mirroring tables of the PostgreSQL database
+to an embedded DuckDB database.
+DuckDB is a columnar engine, so the aggregating queries
+used to extract network sets and to find pairs of edges for agglomeration
+run much faster on the mirror than on PostgreSQL.
+PostgreSQL remains the system of record:
+the mirror is a copy of the edges, taxonomy and counts tables,
+which is loaded with COPY TO and can be refreshed at any time.
+This requires the optional duckdb package.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import os
+import tempfile
+import logging.handlers
+from masq.scripts.utils import ParentConnection
+from masq.scripts.columnar import _columns, _quote_column
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# DuckDB types of the column types in _columns
+_types = {'string': 'VARCHAR', 'float64': 'DOUBLE', 'int64': 'BIGINT'}
+
+
+class AnalyticConnection(ParentConnection):
+    """
+    Initializes a DuckDB mirror of tables in a source database.
+    The query methods of the parent class run on the mirror,
+    so the same queries can be sent to PostgreSQL or DuckDB.
+    Changes to the source database are not visible in the mirror
+    until the tables are refreshed; write queries can be sent to both.
+    """
+    def __init__(self, source, path=None, tables=None):
+        """
+        :param source: Connection object of the database to mirror
+        :param path: Filename of DuckDB database, by default the mirror is kept in memory
+        :param tables: List of tables to mirror, by default edges, taxonomy and counts
+        """
+        super().__init__(config=None, database=path, backend='duckdb')
+        self.source = source
+        self.refresh(tables)
+
+    def refresh(self, tables=None):
+        """
+        Copies tables from the source database to the mirror,
+        replacing any earlier copy.
+
+        :param tables: List of tables to mirror, by default edges, taxonomy and counts
+        :return:
+        """
+        if not tables:
+            tables = ['edges', 'taxonomy', 'counts']
+        for table in tables:
+            self.mirror_table(table)
+
+    def mirror_table(self, table):
+        """
+        Copies a single table from the source database.
+        The rows are streamed to a temporary CSV file with COPY TO,
+        which DuckDB then reads in parallel.
+
+        :param table: Name of table, edges, taxonomy or counts
+        :return: Number of mirrored rows
+        """
+        if table not in _columns:
+            raise ValueError("Table " + table + " cannot be mirrored.")
+        columns = ",".join(_quote_column(x[0]) for x in _columns[table])
+        column_types = ",".join("'" + x[0] + "': '" + _types[x[1]] + "'" for x in _columns[table])
+        self.query("DROP TABLE IF EXISTS " + table + ";")
+        self.query("CREATE TABLE " + table + " (" +
+                   ",".join(_quote_column(x[0]) + " " + _types[x[1]] for x in _columns[table]) + ");")
+        fd, filename = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                self.source.copy_query("SELECT " + columns + " FROM " + table, file, csv=True)
+            # DuckDB cannot detect the columns of an empty file
+            if os.path.getsize(filename) > 0:
+                self.value_query("INSERT INTO " + table + " SELECT * FROM read_csv(%s, "
+                                 "header=false, auto_detect=false, delim=',', quote='\"', escape='\"', "
+                                 "allow_quoted_nulls=false, columns={" + column_types + "});",
+                                 values=(filename,))
+        finally:
+            os.remove(filename)
+        rows = self.query("SELECT COUNT(*) FROM " + table + ";", fetch=True)[0][0]
+        logger.info("Mirrored " + str(rows) + " rows of " + table + " to DuckDB.\n")
+        return rows
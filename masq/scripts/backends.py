@@ -0,0 +1,683 @@
+"""
+This file contains the database backends used by the ParentConnection class.
+A backend opens connections and takes care of the parts of the SQL dialect
+and driver API that differ between databases,
+so the connection classes can run their queries unchanged on either database.
+
+The PostgreSQL backend is the default.
+The SQLite backend runs an embedded database in the same process,
+which is useful for laptop-scale analyses and for tests
+that should not depend on a running PostgreSQL server.
+The DuckDB backend is only used for analytic mirrors of PostgreSQL tables.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import csv
+import io
+import re
+import sqlite3
+import threading
+import zlib
+from uuid import uuid4
+
+
+class PostgresBackend:
+    """
+    Backend for PostgreSQL databases, using psycopg2.
+    Each call to connect opens a new connection,
+    unless a pool was opened with open_pool.
+    A pool keeps released connections open and hands them out again,
+    so long-running processes do not pay for a new connection per query.
+    """
+    name = 'postgresql'
+    label = 'PostgreSQL'
+    version_query = "SELECT version()"
+    # supports table partitions, see create_tables
+    partitioning = True
+    # supports PREPARE and EXECUTE, see prepared_query
+    prepared = True
+    # supports SELECT ... FOR UPDATE SKIP LOCKED, see jobs.py
+    row_locks = True
+    # supports advisory locks, see ParentConnection.lock
+    advisory_locks = True
+    # column type of auto-incrementing keys
+    serial = 'SERIAL'
+    # current time in seconds since the epoch
+    now = "extract(epoch from clock_timestamp())"
+    # function that hashes a string to an integer, for fingerprints of tables
+    text_hash = 'hashtext'
+    # maximum number of idle connections kept open per database, see open_pool
+    pool_size = 0
+    # idle connections, by connection parameters
+    idle = dict()
+    lock = threading.Lock()
+
+    def __init__(self, config):
+        """
+        :param config: Dictionary with host, database, user and password
+        """
+        # the driver is only imported once a PostgreSQL database is used
+        import psycopg2
+        self.driver = psycopg2
+        self.Error = psycopg2.Error
+        self.config = config
+        self.key = tuple(sorted(config.items()))
+
+    def connect(self):
+        """
+        Returns an idle connection from the pool,
+        or opens a connection to the database.
+
+        :return: psycopg2 connection
+        """
+        if self.pool_size:
+            with self.lock:
+                idle = self.idle.get(self.key)
+                while idle:
+                    conn = idle.pop()
+                    if not conn.closed:
+                        return conn
+        return self.driver.connect(**self.config)
+
+    def release(self, conn):
+        """
+        Returns a connection opened with connect to the pool,
+        or closes it if the pool is full or there is no pool.
+
+        :param conn: psycopg2 connection
+        :return:
+        """
+        if self.pool_size and not conn.closed:
+            try:
+                conn.rollback()
+            except self.Error:
+                # the server dropped the connection, so it is not pooled
+                conn.close()
+                return
+            with self.lock:
+                idle = self.idle.setdefault(self.key, list())
+                if len(idle) < self.pool_size:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def open_pool(self, size):
+        """
+        Starts pooling connections for all PostgreSQL backends in this process,
+        and opens connections to this database until the pool holds size connections.
+
+        :param size: Maximum number of idle connections per database
+        :return:
+        """
+        PostgresBackend.pool_size = size
+        with self.lock:
+            idle = self.idle.setdefault(self.key, list())
+            while len(idle) < size:
+                idle.append(self.driver.connect(**self.config))
+
+    @classmethod
+    def close_pool(cls):
+        """
+        Closes all idle connections and stops pooling.
+
+        :return:
+        """
+        with cls.lock:
+            cls.pool_size = 0
+            for idle in cls.idle.values():
+                for conn in idle:
+                    conn.close()
+            cls.idle.clear()
+
+    def translate(self, query, values=None):
+        """
+        PostgreSQL queries are written for psycopg2, so they are not changed.
+
+        :param query: Query string
+        :param values: Tuple or list of values
+        :return: Query and values
+        """
+        return query, values
+
+    def stream_cursor(self, conn, itersize):
+        """
+        Returns a named server-side cursor,
+        which fetches rows from the server in batches of itersize rows.
+
+        :param conn: psycopg2 connection
+        :param itersize: Number of rows fetched per round trip
+        :return: Cursor
+        """
+        c = conn.cursor(name="masq_" + uuid4().hex)
+        c.itersize = itersize
+        return c
+
+    def copy_to(self, cursor, query, values, file, size, csv=False):
+        """
+        Streams the result of a query to a file-like object with COPY TO STDOUT.
+
+        :param cursor: psycopg2 cursor
+        :param query: SELECT query
+        :param values: Tuple of values for the placeholders
+        :param file: Object with a write method
+        :param size: Size of chunks passed to the write method
+        :param csv: If True, the output is CSV instead of text format
+        :return:
+        """
+        if values:
+            query = cursor.mogrify(query, values).decode('utf-8')
+        query = query.rstrip().rstrip(';')
+        options = " WITH (FORMAT csv)" if csv else ""
+        cursor.copy_expert("COPY (" + query + ") TO STDOUT" + options + ";", file, size=size)
+
+    def create_staging(self, cursor, table, staging):
+        """
+        Creates an UNLOGGED staging table with the columns of a table,
+        but without its indexes and foreign keys.
+
+        :param cursor: psycopg2 cursor
+        :param table: Name of live table
+        :param staging: Name of staging table
+        :return:
+        """
+        cursor.execute("CREATE UNLOGGED TABLE " + staging + " (LIKE " + table + ");")
+
+    def load_rows(self, cursor, table, columns, values):
+        """
+        Writes rows to a table with COPY FROM STDIN,
+        which is much faster than inserting the rows one by one.
+        The rows are formatted as CSV; None values are written as NULL.
+
+        :param cursor: psycopg2 cursor
+        :param table: Name of table
+        :param columns: List of column names
+        :param values: List of row tuples
+        :return:
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in values:
+            writer.writerow(['\\N' if x is None else x for x in row])
+        buffer.seek(0)
+        cursor.copy_expert("COPY " + table + " (" + ",".join(columns) + ") FROM STDIN "
+                           "WITH (FORMAT csv, NULL '\\N');", buffer)
+
+    def primary_key(self, cursor, table):
+        """
+        Returns the primary key columns of a table.
+
+        :param cursor: psycopg2 cursor
+        :param table: Name of table
+        :return: List of column names
+        """
+        cursor.execute("SELECT a.attname FROM pg_index AS i "
+                       "JOIN pg_attribute AS a ON a.attrelid = i.indrelid "
+                       "AND a.attnum = ANY(i.indkey) "
+                       "WHERE i.indrelid = %s::regclass AND i.indisprimary;", (table,))
+        return [x[0] for x in cursor.fetchall()]
+
+    def partition_layout(self, cursor, table):
+        """
+        Checks whether a table is partitioned.
+
+        :param cursor: psycopg2 cursor
+        :param table: Name of table
+        :return: 'list', 'hash' or None
+        """
+        cursor.execute("SELECT p.partstrat FROM pg_partitioned_table AS p "
+                       "JOIN pg_class AS c ON p.partrelid = c.oid "
+                       "WHERE c.relname = %s;", (table,))
+        layout = cursor.fetchall()
+        if layout:
+            return {'l': 'list', 'h': 'hash'}.get(layout[0][0])
+        return None
+
+
+class SqliteBackend:
+    """
+    Backend for an embedded SQLite database, using the sqlite3 module.
+    The database name from the config is the filename of the database,
+    or :memory: for a database that only exists in this process.
+    A single connection per database is kept open and shared by all queries
+    and connection objects in the process,
+    so there are no connection costs and in-memory databases persist.
+    A thread holds the connection from connect until release,
+    so queries and transactions of concurrent threads do not interleave.
+
+    PostgreSQL-specific syntax in the queries is translated:
+    %s placeholders become question marks, tuples for IN %s are expanded,
+    ::type casts and CASCADE are removed,
+    and the string_agg, sign and hashtext functions are provided.
+    """
+    name = 'sqlite'
+    label = 'SQLite'
+    Error = sqlite3.Error
+    version_query = "SELECT sqlite_version()"
+    partitioning = False
+    # sqlite3 caches prepared statements by itself
+    prepared = False
+    # a single connection is shared, so rows do not need to be locked
+    row_locks = False
+    advisory_locks = False
+    serial = 'INTEGER'
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+    # registered on each connection, see _hashtext
+    text_hash = 'hashtext'
+    # shared connections and the locks of their users, by database filename
+    connections = dict()
+    users = dict()
+    lock = threading.Lock()
+
+    def __init__(self, config):
+        """
+        :param config: Dictionary with database filename
+        """
+        self.config = config
+
+    def connect(self):
+        """
+        Returns the shared connection, which is opened on first use.
+        Other threads wait until the connection is released;
+        the same thread can connect again, e.g. while iterating over iter_query.
+
+        :return: sqlite3 connection
+        """
+        database = self.config.get('database') or ':memory:'
+        with self.lock:
+            users = self.users.setdefault(database, threading.RLock())
+            if database not in self.connections:
+                conn = sqlite3.connect(database, check_same_thread=False)
+                conn.execute("PRAGMA foreign_keys = ON;")
+                conn.create_aggregate('string_agg', 2, _StringAgg)
+                conn.create_function('sign', 1, _sign, deterministic=True)
+                conn.create_function('hashtext', 1, _hashtext, deterministic=True)
+                self.connections[database] = conn
+        users.acquire()
+        return self.connections[database]
+
+    def release(self, conn):
+        """
+        The shared connection stays open,
+        and can be used by other threads again.
+
+        :param conn: sqlite3 connection
+        :return:
+        """
+        self.users[self.config.get('database') or ':memory:'].release()
+
+    def translate(self, query, values=None):
+        """
+        Translates a query written for psycopg2 to SQLite.
+
+        :param query: Query string
+        :param values: Tuple or list of values
+        :return: Query and values
+        """
+        query = re.sub(r'::\w+', '', query)
+        query = re.sub(r'\s+CASCADE\s*;', ';', query)
+        return _qmark(query, values)
+
+    def stream_cursor(self, conn, itersize):
+        """
+        SQLite cursors step through the results lazily,
+        so a normal cursor already streams the rows.
+
+        :param conn: sqlite3 connection
+        :param itersize: Number of rows per fetch
+        :return: Cursor
+        """
+        c = conn.cursor()
+        c.arraysize = itersize
+        return c
+
+    def copy_to(self, cursor, query, values, file, size, csv=False):
+        """
+        Writes the result of a query to a file-like object,
+        in the text or CSV format of PostgreSQL's COPY TO.
+
+        :param cursor: sqlite3 cursor
+        :param query: SELECT query
+        :param values: Tuple of values for the placeholders
+        :param file: Object with a write method
+        :param size: Approximate size of chunks passed to the write method
+        :param csv: If True, the output is CSV instead of text format
+        :return:
+        """
+        query, values = self.translate(query, values)
+        cursor.execute(query, values or ())
+        chunk = list()
+        length = 0
+        for row in cursor:
+            if csv:
+                line = ','.join(_copy_csv(x) for x in row) + '\n'
+            else:
+                line = '\t'.join(_copy_text(x) for x in row) + '\n'
+            chunk.append(line)
+            length += len(line)
+            if length >= size:
+                file.write(''.join(chunk))
+                chunk = list()
+                length = 0
+        if chunk:
+            file.write(''.join(chunk))
+
+    def create_staging(self, cursor, table, staging):
+        """
+        Creates a temporary staging table with the columns of a table,
+        but without its constraints.
+
+        :param cursor: sqlite3 cursor
+        :param table: Name of live table
+        :param staging: Name of staging table
+        :return:
+        """
+        cursor.execute("CREATE TEMP TABLE " + staging + " AS SELECT * FROM " + table + " WHERE 0;")
+
+    def load_rows(self, cursor, table, columns, values):
+        """
+        Inserts rows into a table.
+
+        :param cursor: sqlite3 cursor
+        :param table: Name of table
+        :param columns: List of column names
+        :param values: List of row tuples
+        :return:
+        """
+        cursor.executemany("INSERT INTO " + table + " (" + ",".join(columns) + ") "
+                           "VALUES (" + ",".join(['?'] * len(columns)) + ");", values)
+
+    def primary_key(self, cursor, table):
+        """
+        Returns the primary key columns of a table.
+
+        :param cursor: sqlite3 cursor
+        :param table: Name of table
+        :return: List of column names
+        """
+        cursor.execute("PRAGMA table_info(" + table + ");")
+        return [x[1] for x in cursor.fetchall() if x[5]]
+
+    def partition_layout(self, cursor, table):
+        """
+        SQLite does not support partitions.
+
+        :param cursor: sqlite3 cursor
+        :param table: Name of table
+        :return: None
+        """
+        return None
+
+
+class DuckdbBackend:
+    """
+    Backend for an embedded DuckDB database, using the optional duckdb package.
+    DuckDB is a columnar engine, so it is much faster than PostgreSQL
+    for aggregating queries over complete tables.
+    It is not used as system of record,
+    but as an analytic mirror of PostgreSQL tables (see analytic.py).
+    Each backend object has its own connection,
+    so an in-memory database lives as long as the backend.
+    """
+    name = 'duckdb'
+    label = 'DuckDB'
+    version_query = "SELECT version()"
+    partitioning = False
+    prepared = False
+    advisory_locks = False
+    text_hash = 'hash'
+
+    def __init__(self, config):
+        """
+        :param config: Dictionary with database filename
+        """
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("The analytic backend requires the duckdb package.")
+        self.driver = duckdb
+        self.Error = duckdb.Error
+        self.config = config
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Returns the connection of this backend, which is opened on first use.
+
+        :return: Wrapped duckdb connection
+        """
+        with self.lock:
+            if self.conn is None:
+                self.conn = _DuckdbConnection(self.driver.connect(self.config.get('database') or ':memory:'),
+                                              self.driver.TransactionException)
+        return self.conn
+
+    def release(self, conn):
+        """
+        The connection stays open.
+
+        :param conn: Wrapped duckdb connection
+        :return:
+        """
+        pass
+
+    def translate(self, query, values=None):
+        """
+        DuckDB understands the PostgreSQL dialect,
+        so only the placeholders need to be changed.
+
+        :param query: Query string
+        :param values: Tuple or list of values
+        :return: Query and values
+        """
+        return _qmark(query, values)
+
+    def stream_cursor(self, conn, itersize):
+        """
+        Returns a cursor that fetches rows in batches of itersize rows.
+
+        :param conn: Wrapped duckdb connection
+        :param itersize: Number of rows per fetch
+        :return: Cursor
+        """
+        c = conn.cursor()
+        c.arraysize = itersize
+        return c
+
+    def partition_layout(self, cursor, table):
+        """
+        The analytic mirror is not partitioned.
+
+        :param cursor: Cursor
+        :param table: Name of table
+        :return: None
+        """
+        return None
+
+
+backends = {'postgresql': PostgresBackend,
+            'sqlite': SqliteBackend,
+            'duckdb': DuckdbBackend}
+
+
+class _DuckdbConnection:
+    """
+    Wraps a duckdb connection, so it can be used like
+    the connections of the DB-API drivers.
+    DuckDB runs in autocommit mode unless a transaction is started,
+    so rolling back without a transaction is ignored.
+    """
+    def __init__(self, conn, transaction_error):
+        self.conn = conn
+        self.transaction_error = transaction_error
+
+    def cursor(self):
+        return _DuckdbCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        try:
+            self.conn.rollback()
+        except self.transaction_error:
+            pass
+
+    def close(self):
+        self.conn.close()
+
+
+class _DuckdbCursor:
+    """
+    Wraps a duckdb cursor, so the rows of a query can be iterated over.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.arraysize = 2000
+
+    def execute(self, query, values=None):
+        self.cursor.execute(query, values)
+
+    def executemany(self, query, values):
+        self.cursor.executemany(query, values)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __iter__(self):
+        rows = self.cursor.fetchmany(self.arraysize)
+        while rows:
+            for row in rows:
+                yield row
+            rows = self.cursor.fetchmany(self.arraysize)
+
+    def close(self):
+        self.cursor.close()
+
+
+class _StringAgg:
+    """
+    Aggregate that joins values with a separator,
+    like string_agg in PostgreSQL.
+    """
+    def __init__(self):
+        self.values = list()
+        self.separator = ','
+
+    def step(self, value, separator):
+        if value is not None:
+            self.values.append(str(value))
+        self.separator = separator
+
+    def finalize(self):
+        if not self.values:
+            return None
+        return self.separator.join(self.values)
+
+
+def _sign(value):
+    """
+    Returns the sign of a number, like SIGN in PostgreSQL.
+
+    :param value: Number
+    :return: -1.0, 0.0 or 1.0
+    """
+    if value is None:
+        return None
+    return float((value > 0) - (value < 0))
+
+
+def _hashtext(value):
+    """
+    Returns a 32-bit integer hash of a string.
+    The values differ from PostgreSQL's hashtext,
+    but are equally suitable for fingerprints.
+
+    :param value: String
+    :return: Integer
+    """
+    if value is None:
+        return None
+    return zlib.crc32(value.encode('utf-8')) - 2 ** 31
+
+
+# quoted literals, escaped percent signs and placeholders of psycopg2 queries
+_placeholders = re.compile(r"('(?:[^']|'')*'|%%|%s)")
+
+
+def _qmark(query, values):
+    """
+    Replaces the %s placeholders of psycopg2 with question marks.
+    Tuples used for IN %s are expanded to one placeholder per value.
+    Values without a placeholder are dropped.
+    As in psycopg2, %% is only unescaped when values are given,
+    and %s inside quoted literals is left alone.
+
+    :param query: Query string
+    :param values: Tuple or list of values
+    :return: Query and values
+    """
+    if values is None:
+        return query, values
+    parts = _placeholders.split(query)
+    new_query = ''
+    new_values = list()
+    i = 0
+    for part in parts:
+        if part == '%s':
+            if type(values) == tuple and type(values[i]) == tuple:
+                new_query += '(' + ','.join(['?'] * len(values[i])) + ')'
+                new_values.extend(values[i])
+            else:
+                new_query += '?'
+                if type(values) == tuple:
+                    new_values.append(values[i])
+            i += 1
+        else:
+            # psycopg2 also unescapes %% inside quoted literals
+            new_query += part.replace('%%', '%') if part.startswith("'") or part == '%%' else part
+    if type(values) == tuple:
+        values = tuple(new_values)
+    return new_query, values
+
+
+def _copy_csv(value):
+    """
+    Formats a value as in the CSV format of COPY TO.
+    NULL is written as an unquoted empty value,
+    and strings with separators, quotes or line breaks are quoted.
+
+    :param value: Value
+    :return: String
+    """
+    if value is None:
+        return ''
+    value = str(value)
+    if value == '' or any(x in value for x in ',"\n\r'):
+        value = '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _copy_text(value):
+    """
+    Formats a value as in the text format of COPY TO.
+    NULL is written as \\N, and backslashes, tabs and line breaks are escaped.
+
+    :param value: Value
+    :return: String
+    """
+    if value is None:
+        return '\\N'
+    value = str(value)
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value:
+        value = value.replace('\\', '\\\\').replace('\t', '\\t')
+        value = value.replace('\n', '\\n').replace('\r', '\\r')
+    return value
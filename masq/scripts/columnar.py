@@ -0,0 +1,285 @@
+"""
+This file contains a class for exchanging the masq tables
+with Apache Arrow / Parquet files.
+The Parquet files use the same columns as the tables
+defined in the create_tables function.
+Rows are transferred in record batches:
+the export streams the output of COPY TO through the Arrow CSV reader,
+and the import writes each record batch as CSV to COPY FROM.
+This requires the optional pyarrow package.
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import os
+import io
+import threading
+import psycopg2
+import logging.handlers
+from masq.scripts.utils import ParentConnection, _partition_query
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# columns and types of the tables in create_tables
+_columns = {'bioms': [('studyID', 'string'), ('tax_num', 'int64'),
+                      ('sample_num', 'int64')],
+            'samples': [('sampleID', 'string'), ('studyID', 'string')],
+            'networks': [('networkID', 'string'), ('studyID', 'string'),
+                         ('node_num', 'int64'), ('edge_num', 'int64')],
+            'edges': [('networkID', 'string'), ('source', 'string'),
+                      ('target', 'string'), ('weight', 'float64')],
+            'counts': [('studyID', 'string'), ('taxon', 'string'),
+                       ('sampleID', 'string'), ('count', 'float64')],
+            'meta': [('sampleID', 'string'), ('studyID', 'string'),
+                     ('property', 'string'), ('textvalue', 'string'),
+                     ('numvalue', 'float64')],
+            'taxonomy': [('taxon', 'string'), ('studyID', 'string'),
+                         ('Kingdom', 'string'), ('Phylum', 'string'),
+                         ('Class', 'string'), ('Order', 'string'),
+                         ('Family', 'string'), ('Genus', 'string'),
+                         ('Species', 'string')]}
+
+
+def export_parquet(location, tables=None,
+                   config='database.ini',
+                   host=None, database=None,
+                   username=None, password=None):
+    """
+    Writes tables from the PostgreSQL database to Parquet files.
+    Each table is written to a file named after the table.
+
+    :param location: Folder to write the Parquet files to
+    :param tables: List of tables to export, by default all tables
+    :param config: Location of file with database parameters.
+    :param host: Database address.
+    :param database: Name of PostgreSQL database.
+    :param username: Username for PostgreSQL database.
+    :param password: Password of PostgreSQL database.
+    :return:
+    """
+    conn = ColumnarConnection(config, host, database, username, password)
+    if not tables:
+        tables = list(_columns)
+    for table in tables:
+        conn.export_table(table, location + '/' + table + '.parquet')
+
+
+def import_parquet(location, tables=None,
+                   config='database.ini',
+                   host=None, database=None,
+                   username=None, password=None):
+    """
+    Imports Parquet files named after the tables into the PostgreSQL database.
+    Parent tables are imported first, so a snapshot can be restored
+    into an empty database: bioms, samples and networks before the rows
+    that refer to them, and taxonomy before counts, since counts refer to taxa.
+
+    :param location: Folder with the Parquet files
+    :param tables: List of tables to import, by default all tables
+    :param config: Location of file with database parameters.
+    :param host: Database address.
+    :param database: Name of PostgreSQL database.
+    :param username: Username for PostgreSQL database.
+    :param password: Password of PostgreSQL database.
+    :return:
+    """
+    conn = ColumnarConnection(config, host, database, username, password)
+    if not tables:
+        tables = ['bioms', 'samples', 'networks', 'taxonomy', 'meta', 'counts', 'edges']
+    for table in tables:
+        filename = location + '/' + table + '.parquet'
+        if os.path.isfile(filename):
+            conn.import_table(table, filename)
+
+
+class ColumnarConnection(ParentConnection):
+    """
+    Initializes a connection to the PostgreSQL database.
+    This connection object contains methods for writing
+    the tables from create_tables to Parquet files,
+    and for loading these files into the database.
+    """
+    # inherits init from parent
+    def _check_backend(self):
+        """
+        Raises an error if the database is not PostgreSQL,
+        since the transfers rely on COPY.
+
+        :return:
+        """
+        if self.backend.name != 'postgresql':
+            raise ValueError("Parquet import and export requires a PostgreSQL database, "
+                             "not " + self.backend.label + ".")
+
+    def export_table(self, table, path, batch_size=65536):
+        """
+        Writes a table to a Parquet file.
+        The output of COPY TO is piped into the Arrow CSV reader,
+        which converts it to record batches that are written as they arrive.
+
+        :param table: Name of table
+        :param path: Filename of Parquet file
+        :param batch_size: Maximum size of the CSV blocks read by Arrow, in bytes
+        :return: Number of exported rows
+        """
+        _check_pyarrow()
+        self._check_backend()
+        schema = _table_schema(table)
+        columns = ",".join(_quote_column(x) for x in schema.names)
+        read_end, write_end = os.pipe()
+        errors = list()
+
+        def copy():
+            # the read end is closed early if Arrow cannot parse the output
+            conn = None
+            try:
+                with os.fdopen(write_end, 'wb') as file:
+                    conn = psycopg2.connect(**self.config)
+                    c = conn.cursor()
+                    c.copy_expert("COPY (SELECT " + columns + " FROM " + table + ") "
+                                  "TO STDOUT WITH (FORMAT csv);", file)
+                    c.close()
+            except (psycopg2.Error, OSError) as e:
+                errors.append(e)
+            finally:
+                if conn:
+                    conn.close()
+        thread = threading.Thread(target=copy)
+        thread.start()
+        rows = 0
+        try:
+            with os.fdopen(read_end, 'rb') as file:
+                with pq.ParquetWriter(path, schema) as writer:
+                    # an empty table has no output for Arrow to read
+                    if file.peek(1):
+                        reader = pacsv.open_csv(file,
+                                                read_options=pacsv.ReadOptions(column_names=schema.names,
+                                                                               block_size=batch_size),
+                                                convert_options=pacsv.ConvertOptions(column_types=schema,
+                                                                                     strings_can_be_null=True,
+                                                                                     quoted_strings_can_be_null=False))
+                        for batch in reader:
+                            writer.write_batch(batch)
+                            rows += batch.num_rows
+        except pa.ArrowInvalid as e:
+            logger.error(e)
+            rows = 0
+            if os.path.isfile(path):
+                os.remove(path)
+        finally:
+            thread.join()
+        for e in errors:
+            logger.error(e)
+        logger.info("Exported " + str(rows) + " rows of " + table + " to " + path + ".\n")
+        return rows
+
+    def import_table(self, table, path, batch_size=65536):
+        """
+        Loads a Parquet file into a table.
+        Each record batch is written as CSV and copied with COPY FROM.
+        All batches are loaded in one transaction,
+        so a failed import, e.g. a missing file or a column that cannot be cast,
+        leaves the table untouched.
+        If the table is list-partitioned, missing partitions are created.
+
+        :param table: Name of table
+        :param path: Filename of Parquet file
+        :param batch_size: Number of rows per record batch
+        :return: Number of imported rows
+        """
+        _check_pyarrow()
+        self._check_backend()
+        schema = _table_schema(table)
+        columns = ",".join(_quote_column(x) for x in schema.names)
+        key = {'edges': 'networkID', 'counts': 'studyID'}.get(table)
+        partitioned = key and self.get_partition_layout(table) == 'list'
+        partitions = set()
+        rows = 0
+        conn = psycopg2.connect(**self.config)
+        c = conn.cursor()
+        try:
+            parquet = pq.ParquetFile(path)
+            missing = [x for x in schema.names if x not in parquet.schema_arrow.names]
+            if missing:
+                raise ValueError("The Parquet file " + path + " does not have the columns " +
+                                 ", ".join(missing) + ".")
+            for batch in parquet.iter_batches(batch_size=batch_size, columns=schema.names):
+                batch = pa.RecordBatch.from_arrays([batch.column(x).cast(schema.field(x).type)
+                                                    for x in schema.names], schema=schema)
+                if partitioned:
+                    for value in pc.unique(batch.column(key)).to_pylist():
+                        if value is not None and value not in partitions:
+                            c.execute(_partition_query(table, value), (value,))
+                            partitions.add(value)
+                buffer = io.BytesIO()
+                pacsv.write_csv(batch, buffer,
+                                write_options=pacsv.WriteOptions(include_header=False,
+                                                                 quoting_style='all_valid'))
+                buffer.seek(0)
+                c.copy_expert("COPY " + table + " (" + columns + ") FROM STDIN "
+                              "WITH (FORMAT csv);", buffer)
+                rows += batch.num_rows
+            conn.commit()
+            logger.info("Imported " + str(rows) + " rows of " + table + " from " + path + ".\n")
+        except (psycopg2.Error, pa.ArrowException, ValueError, OSError) as e:
+            logger.error(e)
+            conn.rollback()
+            rows = 0
+        finally:
+            c.close()
+            conn.close()
+        return rows
+
+
+def _check_pyarrow():
+    """
+    Raises an error if the optional pyarrow package is not installed.
+
+    :return:
+    """
+    if pa is None:
+        raise ImportError("Reading and writing Parquet files requires the pyarrow package.")
+
+
+def _table_schema(table):
+    """
+    Returns the Arrow schema of a table.
+
+    :param table: Name of table
+    :return: Arrow schema
+    """
+    if table not in _columns:
+        raise ValueError("Table " + table + " cannot be converted to Parquet.")
+    return pa.schema([(name, getattr(pa, dtype)()) for name, dtype in _columns[table]])
+
+
+def _quote_column(column):
+    """
+    Quotes the Order column, since it is an SQL keyword.
+
+    :param column: Column name
+    :return: Column name for queries
+    """
+    if column == 'Order':
+        return '"Order"'
+    return column
@@ -0,0 +1,369 @@
+"""
+This file contains functions for profiling the queries
+that are sent to the database by the connection classes.
+When a profile is started, every query run through ParentConnection
+is recorded with its fingerprint, wall time,
+number of rows affected and number of rows returned.
+The fingerprint is the query with all literals and placeholders
+replaced by question marks, so queries that only differ in their values
+are aggregated together, in a histogram of wall times.
+Queries that take longer than the slow query threshold are logged
+as soon as they finish.
+When no profile is running, the connection classes only check
+a single module variable per query.
+
+The file also contains a memory profiler based on tracemalloc.
+When it is started, the stages of BIOM and network uploads,
+set extraction and agglomeration report the peak memory
+and the memory that is still allocated at the end of the stage,
+together with the lines of code that allocated most of the retained memory.
+Tracing memory slows Python code down considerably,
+so the memory profiler should only be used to find out where memory goes.
+
+Example:
+
+    profile = start_profile(slow=0.5)
+    conn.start_metastats(...)
+    stop_profile()
+    print(profile.report())
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import sys
+import re
+import tracemalloc
+from time import perf_counter
+from functools import lru_cache
+from contextlib import contextmanager
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# profile that queries are recorded in, see start_profile
+profile = None
+
+# memory profile that stages are recorded in, see start_memory_profile
+memory = None
+
+# upper bounds in seconds of the histogram buckets
+_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float('inf'))
+
+_literals = [(re.compile(r"'(?:[^']|'')*'"), '?'),
+             (re.compile(r'%s|\$\d+'), '?'),
+             (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+             (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+             (re.compile(r'\s+'), ' ')]
+
+
+class QueryProfile:
+    """
+    Collects statistics of queries per fingerprint.
+    """
+    def __init__(self, slow=1.0):
+        """
+        :param slow: Queries that take longer than this number of seconds are logged,
+        set to None to disable the slow query log
+        """
+        self.slow = slow
+        self.stats = dict()
+
+    def record(self, query, seconds, affected=None, returned=None):
+        """
+        Adds a query to the profile.
+
+        :param query: String containing query
+        :param seconds: Wall time of the query
+        :param affected: Number of rows affected, or None if unknown
+        :param returned: Number of rows returned, or None if not fetched
+        :return:
+        """
+        key = fingerprint(query)
+        if key not in self.stats:
+            self.stats[key] = {'fingerprint': key,
+                               'count': 0,
+                               'total': 0.0,
+                               'max': 0.0,
+                               'rows_affected': 0,
+                               'rows_returned': 0,
+                               'histogram': [0] * len(_buckets)}
+        stat = self.stats[key]
+        stat['count'] += 1
+        stat['total'] += seconds
+        stat['max'] = max(stat['max'], seconds)
+        if affected and affected > 0:
+            stat['rows_affected'] += affected
+        if returned:
+            stat['rows_returned'] += returned
+        for i, bound in enumerate(_buckets):
+            if seconds <= bound:
+                stat['histogram'][i] += 1
+                break
+        if self.slow is not None and seconds > self.slow:
+            logger.warning("Slow query (" + format(seconds, '.3f') + " s): " + key)
+
+    def summary(self):
+        """
+        Returns the statistics per fingerprint,
+        sorted by the total time spent on the fingerprint.
+        The histogram is a dictionary of bucket upper bounds in seconds
+        and the number of queries that fell in the bucket.
+
+        :return: List of dictionaries
+        """
+        summary = list()
+        for stat in sorted(self.stats.values(), key=lambda x: x['total'], reverse=True):
+            stat = dict(stat)
+            stat['mean'] = stat['total'] / stat['count']
+            stat['histogram'] = {bound: number for bound, number
+                                 in zip(_buckets, stat['histogram']) if number}
+            summary.append(stat)
+        return summary
+
+    def report(self, top=20):
+        """
+        Formats the summary of the most time-consuming fingerprints as a table.
+
+        :param top: Number of fingerprints to include
+        :return: String with table
+        """
+        lines = ["{:>8} {:>10} {:>10} {:>10} {:>10} {:>10}  {}".format(
+            'count', 'total (s)', 'mean (s)', 'max (s)', 'affected', 'returned', 'query')]
+        for stat in self.summary()[:top]:
+            lines.append("{:>8} {:>10.3f} {:>10.4f} {:>10.4f} {:>10} {:>10}  {}".format(
+                stat['count'], stat['total'], stat['mean'], stat['max'],
+                stat['rows_affected'], stat['rows_returned'], stat['fingerprint'][:120]))
+        return "\n".join(lines)
+
+    def reset(self):
+        """
+        Removes all recorded queries.
+
+        :return:
+        """
+        self.stats.clear()
+
+
+class MemoryProfile:
+    """
+    Collects the peak and retained memory of stages.
+    Stages can be nested; the peak of a stage includes the peaks of its inner stages.
+    """
+    def __init__(self, top=3):
+        """
+        :param top: Number of allocation sites reported per stage
+        """
+        self.top = top
+        self.stages = list()
+        self.stack = list()
+
+    def enter(self, name, label=None):
+        """
+        Starts measuring a stage.
+
+        :param name: Name of stage
+        :param label: Name of study or network that the stage works on
+        :return:
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+        snapshot = tracemalloc.take_snapshot() if self.top else None
+        self.stack.append({'name': name, 'label': label, 'start': current,
+                           'peak': current, 'snapshot': snapshot})
+        tracemalloc.reset_peak()
+
+    def exit(self):
+        """
+        Stops measuring the innermost stage and logs its memory use.
+
+        :return: Dictionary with name, label, peak and retained memory in bytes, and allocation sites
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self.stack.pop()
+        peak = max(frame['peak'], peak)
+        stage = {'name': frame['name'], 'label': frame['label'],
+                 'peak': peak - frame['start'], 'retained': current - frame['start'],
+                 'sites': list()}
+        if frame['snapshot']:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)])
+            for difference in snapshot.compare_to(frame['snapshot'], 'lineno')[:self.top]:
+                if difference.size_diff > 0:
+                    frame_info = difference.traceback[0]
+                    stage['sites'].append((frame_info.filename + ":" + str(frame_info.lineno),
+                                           difference.size_diff))
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        self.stages.append(stage)
+        message = "Memory of " + stage['name']
+        if stage['label']:
+            message += " for " + stage['label']
+        message += ": peak " + _megabytes(stage['peak']) + \
+                   ", retained " + _megabytes(stage['retained'])
+        for site, size in stage['sites']:
+            message += "\n    " + _megabytes(size) + " retained by " + site
+        logger.info(message)
+        return stage
+
+    def summary(self):
+        """
+        Returns the recorded stages, in the order that they finished.
+
+        :return: List of dictionaries
+        """
+        return [dict(x) for x in self.stages]
+
+    def report(self):
+        """
+        Formats the recorded stages as a table.
+
+        :return: String with table
+        """
+        lines = ["{:<28} {:<24} {:>12} {:>12}".format('stage', 'label', 'peak (MB)', 'retained (MB)')]
+        for stage in self.stages:
+            lines.append("{:<28} {:<24} {:>12.2f} {:>12.2f}".format(
+                stage['name'], str(stage['label'] or '')[:24],
+                stage['peak'] / 1e6, stage['retained'] / 1e6))
+        return "\n".join(lines)
+
+
+def start_profile(slow=1.0):
+    """
+    Starts recording all queries in a new profile.
+
+    :param slow: Queries that take longer than this number of seconds are logged,
+    set to None to disable the slow query log
+    :return: QueryProfile object
+    """
+    global profile
+    profile = QueryProfile(slow=slow)
+    return profile
+
+
+def stop_profile():
+    """
+    Stops recording queries.
+
+    :return: QueryProfile object with the recorded queries, or None if no profile was started
+    """
+    global profile
+    stopped = profile
+    profile = None
+    return stopped
+
+
+def start_memory_profile(top=3):
+    """
+    Starts tracing memory allocations and recording stages in a new memory profile.
+
+    :param top: Number of allocation sites reported per stage
+    :return: MemoryProfile object
+    """
+    global memory
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    memory = MemoryProfile(top=top)
+    return memory
+
+
+def stop_memory_profile():
+    """
+    Stops tracing memory allocations.
+
+    :return: MemoryProfile object with the recorded stages, or None if no profile was started
+    """
+    global memory
+    stopped = memory
+    memory = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return stopped
+
+
+@contextmanager
+def stage(name, label=None):
+    """
+    Measures the memory of the code in a with block,
+    if a memory profile is running.
+
+    :param name: Name of stage
+    :param label: Name of study or network that the stage works on
+    :return:
+    """
+    running = memory
+    if running is None:
+        yield
+        return
+    running.enter(name, label)
+    try:
+        yield
+    finally:
+        running.exit()
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Replaces literals and placeholders in a query with question marks,
+    and lists of values with (...).
+
+    :param query: String containing query
+    :return: Fingerprint of query
+    """
+    for pattern, replacement in _literals:
+        query = pattern.sub(replacement, query)
+    return query.strip()
+
+
+def _start():
+    """
+    Returns the start time of a query if a profile is running.
+
+    :return: Time in seconds or None
+    """
+    if profile is not None:
+        return perf_counter()
+
+
+def _record(query, start, cursor=None, results=None, returned=None):
+    """
+    Adds a query to the running profile.
+
+    :param query: String containing query
+    :param start: Start time returned by _start
+    :param cursor: Cursor that ran the query, used for the number of affected rows
+    :param results: Fetched rows
+    :param returned: Number of returned rows, if the rows were not fetched at once
+    :return:
+    """
+    if start is None or profile is None:
+        return
+    seconds = perf_counter() - start
+    affected = getattr(cursor, 'rowcount', None)
+    if results is not None:
+        returned = len(results)
+    profile.record(query, seconds, affected, returned)
+
+
+def _megabytes(size):
+    """
+    Formats a number of bytes as megabytes.
+
+    :param size: Number of bytes
+    :return: String
+    """
+    return format(size / 1e6, '.2f') + " MB"
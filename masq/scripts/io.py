@@ -16,9 +16,16 @@ __license__ = 'Apache 2.0'
 
 import sys
 import os
-import networkx as nx
+import re
+import itertools
+from array import array
+from hashlib import md5
+from xml.sax.saxutils import escape, quoteattr
 import logging.handlers
 from masq.scripts.utils import ParentConnection
+from masq.scripts import instrument
+from masq.scripts import metrics
+from masq.scripts import tracing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -30,11 +37,16 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 sh.setFormatter(formatter)
 logger.addHandler(sh)
 
+# file formats that networks can be written to
+_formats = ('graphml', 'gml', 'txt')
 
+
+@tracing.traced('import_networks', location='location')
 def import_networks(location, mapping=None, sources=None,
                     config='database.ini',
                     host=None, database=None,
-                    username=None, password=None):
+                    username=None, password=None,
+                    bulk=False):
     """
     Can read a single network or all networks in a folder.
     These are then imported into the sqlite database.
@@ -51,6 +63,7 @@ def import_networks(location, mapping=None, sources=None,
     :param database: Name of PostgreSQL database.
     :param username: Username for PostgreSQL database.
     :param password: Password of PostgreSQL database.
+    :param bulk: If true, networks are loaded through staging tables.
     :return:
     """
     conn = IoConnection(config, host, database, username, password)
@@ -64,7 +77,9 @@ def import_networks(location, mapping=None, sources=None,
                 source = name
             if source:
                 source = sources[name]
-            conn.add_network(network, name=name, study=source)
+            conn.add_network(network, name=name, study=source, bulk=bulk)
+            metrics.add_file(location + '/' + y, 'network')
+            metrics.export()
     else:
         network = _read_network_extension(location)
         name = location.split('/')[-1]
@@ -76,7 +91,9 @@ def import_networks(location, mapping=None, sources=None,
             source = name
         if sources:
             source = sources[name]
-        conn.add_network(network, name=name, study=source)
+        conn.add_network(network, name=name, study=source, bulk=bulk)
+        metrics.add_file(location, 'network')
+        metrics.export()
 
 
 class IoConnection(ParentConnection):
@@ -87,42 +104,57 @@ class IoConnection(ParentConnection):
     and rows in the edges table.
     """
     # inherits init from parent
-    def add_network(self, network, name, study):
+    @tracing.traced('add_network', network='name', study='study', bulk='bulk')
+    def add_network(self, network, name, study, bulk=False):
         """
         Takes a networkx object and writes this to the sqlite3 database.
+        In bulk mode, the network and its edges are loaded through staging tables
+        in a single transaction, so a failed import leaves the database untouched.
         :param network: NetworkX object
         :param name: Network name
         :param study: Study ID (needs to match a biom ID)
+        :param bulk: If true, rows are loaded through staging tables
         :return:
         """
-        node_num = len(network.nodes)
-        edge_num = len(network.edges)
-        network_values = name, study, node_num, edge_num
-        self.add_network_node(network_values)
-        edge_values = list()
-        for edge in network.edges:
-            # need to make sure source and target are sorted,
-            # so they are always identical.
-            # This facilitates group_by SQL queries
-            partners = sorted([edge[0], edge[1]])
-            if 'weight' in network.edges[edge]:
-                edge_values.append((name, partners[0], partners[1], network.edges[edge]['weight']))
+        with self.lock(exclusive=[('network', name)], shared=[('study', study)]):
+            with instrument.stage('add_network.rows', name):
+                network_values, edge_values = _network_rows(network, name, study)
+            if not bulk:
+                self.add_network_node(network_values)
+            if bulk:
+                with instrument.stage('add_network.bulk', name):
+                    success = self.bulk_query([('networks', ['networkID', 'studyID', 'node_num', 'edge_num'],
+                                                [network_values]),
+                                               ('edges', ['networkID', 'source', 'target', 'weight'], edge_values)])
+                if not success:
+                    logger.error("Could not upload network data for " + name + ".\n")
+                    return
             else:
-                edge_values.append((name, partners[0], partners[1], None))
-        self.add_edge(edge_values)
-        logger.info("Uploaded network data for " + name + ".\n")
+                with instrument.stage('add_network.edges', name):
+                    self.add_edge(edge_values)
+            logger.info("Uploaded network data for " + name + ".\n")
 
+    @tracing.traced('add_network_node', rows='values')
     def add_network_node(self, values):
         """
         Adds rows to the networks table in the PostgreSQL database.
+        If the edges table is list-partitioned,
+        a partition is created for each network.
 
         :param values: List of tuples for bioms table
         :return:
         """
         network_query = "INSERT INTO networks(networkID, studyID,node_num,edge_num) " \
                         "VALUES (%s, %s,%s,%s)"
+        start = metrics._start()
         self.value_query(network_query, values)
+        metrics._rows('networks', values, start)
+        if type(values) == tuple:
+            values = [values]
+        for value in values:
+            self.add_partition('edges', value[0])
 
+    @tracing.traced('add_edge', rows='values')
     def add_edge(self, values):
         """
         Adds rows to the edges table in the PostgreSQL database.
@@ -132,22 +164,280 @@ class IoConnection(ParentConnection):
         """
         edge_query = "INSERT INTO edges (networkID,source,target,weight) " \
                      "VALUES (%s,%s,%s,%s)"
+        start = metrics._start()
         self.value_query(edge_query, values)
+        metrics._rows('edges', values, start)
 
-    def export_network(self, name):
+    def export_network(self, name, handler=None, itersize=2000):
         """
         Extracts all edges belonging to a specific network,
         and returns these as a networkx object.
+        The edges are streamed from the database,
+        so they can also be passed to a different handler,
+        e.g. a function that writes them to a file.
+        :param name: Network name
+        :param handler: Function that accepts an iterable of edge rows
+        (networkID, source, target, weight). By default, a networkx object is built.
+        :param itersize: Number of rows fetched per round trip
+        :return: Output of the handler
+        """
+        if not handler:
+            handler = _convert_edges
+        network_query = "SELECT networkID, source, target, weight FROM edges " \
+                        "WHERE networkID=%s;"
+        edges = self.iter_query(network_query, values=(name,), itersize=itersize)
+        return handler(edges)
+
+    def write_network(self, name, path, itersize=2000):
+        """
+        Streams all edges belonging to a specific network
+        directly to a GraphML, GML or weighted edge list file.
+        The file format is derived from the extension, as for imported networks.
+        Unlike export_network, no networkx object is built,
+        so memory use does not grow with the number of edges.
+
         :param name: Network name
+        :param path: Filename ending in .graphml, .gml or .txt
+        :param itersize: Number of rows fetched per round trip
         :return:
         """
-        network_query = "SELECT * from edges WHERE " \
-                        "networkID='" + name + "';"
-        edges = self.query(network_query, fetch=True)
-        network = nx.Graph()
-        for edge in edges:
-            network.add_edge(edge[1], edge[2], weight=edge[3])
-        return network
+        # raises a ValueError for other extensions, before the edges are queried
+        writer = _network_writer(path)
+        self.export_network(name, handler=writer, itersize=itersize)
+        logger.info("Wrote network " + name + " to " + path + ".\n")
+
+    def export_networks(self, names=None, path=None, format='graphml', itersize=2000):
+        """
+        Extracts the edges of several networks with a single ordered query.
+        The rows are split by networkID while they are streamed from the database,
+        so only one network is handled at a time.
+        If a path is given, each network is written to a separate file
+        in that folder, named after the network (see _network_filename).
+        Otherwise, a dictionary of networkx objects is returned.
+
+        :param names: List of network names. If not given, all networks are exported.
+        :param path: Folder to write the network files to
+        :param format: File format, graphml, gml or txt
+        :param itersize: Number of rows fetched per round trip
+        :return: Dictionary with network names as keys and networkx objects
+        or filenames as values
+        """
+        if path and format not in _formats:
+            raise ValueError("Cannot export networks as " + str(format) +
+                             ", choose from " + ", ".join(_formats) + ".")
+        if not names:
+            names = self.get_networks()
+        network_query = "SELECT networkID, source, target, weight FROM edges " \
+                        "WHERE networkID IN %s ORDER BY networkID;"
+        edges = self.iter_query(network_query, values=(tuple(names),), itersize=itersize)
+        networks = dict()
+        filenames = set()
+        for name, rows in itertools.groupby(edges, key=lambda x: x[0]):
+            if path:
+                filename = _network_filename(path, name, format, filenames)
+                _network_writer(filename)(rows)
+                networks[name] = filename
+            else:
+                networks[name] = _convert_edges(rows)
+        for name in names:
+            if name not in networks:
+                logger.warning("Network " + name + " does not contain any edges.")
+        logger.info("Exported " + str(len(networks)) + " networks.\n")
+        return networks
+
+    def export_adjacency(self, names=None, cache=None, validate=True, itersize=2000):
+        """
+        Extracts networks as sparse adjacency matrices in CSR format,
+        together with an array of node labels that gives the row and column order.
+        The adjacency matrix is symmetric and contains the edge weights;
+        edges without weight get a value of 1.
+        If an edge occurs more than once, the weights are summed.
+
+        If a cache folder is given, the matrices are stored there as .npy files
+        that are loaded memory-mapped on the next call.
+        A cached network is compared to the database with a fingerprint
+        of its edges, and exported again if the network was changed.
+        If validate is set to false, cached networks are used without contacting the database.
+
+        :param names: List of network names. If not given, all networks are exported.
+        :param cache: Folder for cached adjacency matrices
+        :param validate: If true, cached networks are checked against the database
+        :param itersize: Number of rows fetched per round trip
+        :return: Dictionary with network names as keys and (CSR matrix, label array) tuples as values
+        """
+        if not names:
+            names = self.get_networks()
+        matrices = dict()
+        fingerprints = dict()
+        if cache:
+            os.makedirs(cache, exist_ok=True)
+            if validate:
+                fingerprint_query = "SELECT networkID, COUNT(*), " \
+                                    "SUM(" + self.backend.text_hash + "(source || ',' || target || ',' || " \
+                                    "COALESCE(weight::varchar, ''))) " \
+                                    "FROM edges WHERE networkID IN %s GROUP BY networkID;"
+                for row in self.value_query(fingerprint_query, values=(tuple(names),), fetch=True):
+                    fingerprints[row[0]] = str(row[1]) + ':' + str(row[2])
+            for name in names:
+                cached = _load_adjacency(cache, name, fingerprints.get(name), validate)
+                if cached:
+                    matrices[name] = cached
+        missing = [x for x in names if x not in matrices]
+        if missing:
+            network_query = "SELECT networkID, source, target, weight FROM edges " \
+                            "WHERE networkID IN %s ORDER BY networkID;"
+            edges = self.iter_query(network_query, values=(tuple(missing),), itersize=itersize)
+            for name, rows in itertools.groupby(edges, key=lambda x: x[0]):
+                matrices[name] = _convert_adjacency(rows)
+                if cache:
+                    _save_adjacency(cache, name, matrices[name], fingerprints.get(name))
+        return matrices
+
+
+def _convert_adjacency(edge_list):
+    """
+    Takes an iterable of edge rows from the edges table
+    and converts these to a symmetric sparse adjacency matrix.
+
+    :param edge_list: Iterable of (networkID, source, target, weight) tuples
+    :return: Tuple of CSR matrix and array of node labels
+    """
+    import numpy as np
+    from scipy import sparse
+    labels = dict()
+    rows = array('q')
+    cols = array('q')
+    data = array('d')
+    for edge in edge_list:
+        for node in edge[1:3]:
+            if node not in labels:
+                labels[node] = len(labels)
+        weight = 1.0 if edge[3] is None else edge[3]
+        rows.append(labels[edge[1]])
+        cols.append(labels[edge[2]])
+        data.append(weight)
+        # self-loops are only added once, since duplicates are summed
+        if edge[1] != edge[2]:
+            rows.append(labels[edge[2]])
+            cols.append(labels[edge[1]])
+            data.append(weight)
+    matrix = sparse.coo_matrix((np.frombuffer(data, dtype=np.float64),
+                                (np.frombuffer(rows, dtype=np.int64),
+                                 np.frombuffer(cols, dtype=np.int64))),
+                               shape=(len(labels), len(labels))).tocsr()
+    return matrix, np.array(list(labels), dtype=str)
+
+
+def _adjacency_folder(cache, name):
+    """
+    Returns the cache folder of a network.
+    Network names are hashed, since they can contain characters
+    that are not allowed in filenames.
+
+    :param cache: Cache folder
+    :param name: Network name
+    :return: Folder name
+    """
+    return os.path.join(cache, md5(name.encode('utf-8')).hexdigest())
+
+
+def _save_adjacency(cache, name, adjacency, fingerprint):
+    """
+    Writes the CSR arrays and node labels of a network to the cache.
+
+    :param cache: Cache folder
+    :param name: Network name
+    :param adjacency: Tuple of CSR matrix and array of node labels
+    :param fingerprint: Fingerprint of the network edges
+    :return:
+    """
+    import numpy as np
+    folder = _adjacency_folder(cache, name)
+    os.makedirs(folder, exist_ok=True)
+    matrix, labels = adjacency
+    arrays = {'data': matrix.data, 'indices': matrix.indices,
+              'indptr': matrix.indptr, 'labels': labels}
+    # the old fingerprint is removed first, so a partially written cache is never used
+    if os.path.isfile(os.path.join(folder, 'fingerprint')):
+        os.remove(os.path.join(folder, 'fingerprint'))
+    # files are replaced rather than overwritten,
+    # so matrices that are still memory-mapped keep their data
+    for array_name in arrays:
+        filename = os.path.join(folder, array_name + '.npy')
+        with open(filename + '.tmp', 'wb') as file:
+            np.save(file, arrays[array_name])
+        os.replace(filename + '.tmp', filename)
+    with open(os.path.join(folder, 'fingerprint'), 'w') as file:
+        file.write(str(fingerprint))
+
+
+def _load_adjacency(cache, name, fingerprint, validate=True):
+    """
+    Loads a network from the cache, with the arrays memory-mapped.
+    If validate is true and the fingerprint does not match
+    the cached fingerprint, nothing is returned.
+
+    :param cache: Cache folder
+    :param name: Network name
+    :param fingerprint: Fingerprint of the network edges in the database
+    :param validate: If true, the fingerprints need to match
+    :return: Tuple of CSR matrix and array of node labels, or None
+    """
+    import numpy as np
+    from scipy import sparse
+    folder = _adjacency_folder(cache, name)
+    try:
+        with open(os.path.join(folder, 'fingerprint'), 'r') as file:
+            cached = file.read()
+    except FileNotFoundError:
+        return None
+    if validate and cached != str(fingerprint):
+        return None
+    arrays = [np.load(os.path.join(folder, x + '.npy'), mmap_mode='r')
+              for x in ['data', 'indices', 'indptr', 'labels']]
+    matrix = sparse.csr_matrix((arrays[0], arrays[1], arrays[2]),
+                               shape=(len(arrays[3]), len(arrays[3])))
+    return matrix, arrays[3]
+
+
+def _network_rows(network, name, study):
+    """
+    Converts a networkx object to rows for the networks and edges tables.
+
+    :param network: NetworkX object
+    :param name: Network name
+    :param study: Study ID
+    :return: Tuple of network row and list of edge rows
+    """
+    node_num = len(network.nodes)
+    edge_num = len(network.edges)
+    network_values = name, study, node_num, edge_num
+    edge_values = list()
+    for edge in network.edges:
+        # need to make sure source and target are sorted,
+        # so they are always identical.
+        # This facilitates group_by SQL queries
+        partners = sorted([edge[0], edge[1]])
+        if 'weight' in network.edges[edge]:
+            edge_values.append((name, partners[0], partners[1], network.edges[edge]['weight']))
+        else:
+            edge_values.append((name, partners[0], partners[1], None))
+    return network_values, edge_values
+
+
+def _convert_edges(edge_list):
+    """
+    Takes an iterable of edge rows from the edges table
+    and adds these to a networkx object.
+
+    :param edge_list: Iterable of (networkID, source, target, weight) tuples
+    :return: Networkx graph
+    """
+    import networkx as nx
+    network = nx.Graph()
+    for edge in edge_list:
+        network.add_edge(edge[1], edge[2], weight=edge[3])
+    return network
 
 
 def _read_network_extension(filename):
@@ -158,6 +448,7 @@ def _read_network_extension(filename):
     :param filename: Complete filename.
     :return: NetworkX object
     """
+    import networkx as nx
     extension = filename.split(sep=".")
     extension = extension[len(extension) - 1]
     network = None
@@ -177,4 +468,184 @@ def _read_network_extension(filename):
                     network = nx.relabel_nodes(network, nx.get_node_attributes(network, 'name'))
         except IndexError:
             logger.warning('One of the imported networks contains no nodes.', exc_info=True)
-    return network
\ No newline at end of file
+    return network
+
+
+def _network_filename(path, name, format, filenames):
+    """
+    Returns the filename of a network in a folder.
+    Characters other than letters, digits, dashes, underscores and dots are replaced,
+    so names with slashes cannot write outside the folder.
+    If the name was changed, or only differs in case from an earlier filename,
+    a hash of the name is added, so filenames are also unique on
+    case-insensitive filesystems.
+
+    :param path: Folder
+    :param name: Network name
+    :param format: File extension
+    :param filenames: Set of lowercase filenames used so far, updated with the new filename
+    :return: Filename
+    """
+    filename = re.sub(r'[^\w.-]', '_', name).lstrip('.')
+    if filename != name or filename.lower() in filenames:
+        filename += '_' + md5(name.encode('utf-8')).hexdigest()[:8]
+    filenames.add(filename.lower())
+    return os.path.join(path, filename + '.' + format)
+
+
+def _network_writer(filename, network_attr=None):
+    """
+    Given a filename with a specific extension,
+    this function returns a handler that streams rows to a file of that format.
+    The rows need to contain a network name (or aggregated names),
+    the source, the target and the weight as first values.
+    Only the node names are kept in memory.
+
+    :param filename: Complete filename.
+    :param network_attr: If given, the first value of each row is written as edge attribute with this name.
+    :return: Function that accepts an iterable of rows
+    """
+    extension = filename.split(sep=".")
+    extension = extension[len(extension) - 1]
+    writers = {'graphml': _write_graphml,
+               'gml': _write_gml,
+               'txt': _write_edgelist}
+    if extension not in writers:
+        raise ValueError("Cannot write network with extension " + extension +
+                         ", choose from " + ", ".join(_formats) + ".")
+
+    def handler(rows):
+        with open(filename, 'w', encoding='utf-8') as file:
+            writers[extension](file, rows, network_attr)
+    return handler
+
+
+def _attribute_type(value):
+    """
+    Returns the GraphML attribute type for a Python value.
+
+    :param value: Edge attribute value
+    :return: GraphML type name
+    """
+    if type(value) == str:
+        return 'string'
+    return 'double'
+
+
+def _write_graphml(file, rows, network_attr=None):
+    """
+    Writes rows as an undirected GraphML graph.
+    Edges are written as they arrive; since GraphML allows nodes
+    to follow edges, the node elements are added at the end.
+    The first row is read ahead to determine the weight type.
+
+    :param file: File object
+    :param rows: Iterable of rows
+    :param network_attr: Name of attribute for the first value of each row
+    :return:
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    weight_type = 'double'
+    if first is not None and first[3] is not None:
+        weight_type = _attribute_type(first[3])
+    file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+               '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+               'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+               'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+               'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+    file.write('  <key id="d0" for="edge" attr.name="weight" attr.type="' + weight_type + '" />\n')
+    if network_attr:
+        file.write('  <key id="d1" for="edge" attr.name=' + quoteattr(network_attr) +
+                   ' attr.type="string" />\n')
+    file.write('  <graph edgedefault="undirected">\n')
+    nodes = dict()
+    if first is not None:
+        rows = itertools.chain([first], rows)
+    for row in rows:
+        nodes[row[1]] = None
+        nodes[row[2]] = None
+        file.write('    <edge source=' + quoteattr(str(row[1])) +
+                   ' target=' + quoteattr(str(row[2])) + '>\n')
+        if row[3] is not None:
+            file.write('      <data key="d0">' + escape(str(row[3])) + '</data>\n')
+        if network_attr:
+            file.write('      <data key="d1">' + escape(str(row[0])) + '</data>\n')
+        file.write('    </edge>\n')
+    for node in nodes:
+        file.write('    <node id=' + quoteattr(str(node)) + ' />\n')
+    file.write('  </graph>\n</graphml>\n')
+
+
+def _write_gml(file, rows, network_attr=None):
+    """
+    Writes rows as an undirected GML graph.
+    Nodes get an integer ID the first time they appear in an edge,
+    and are written with their label after the edges.
+    The network attribute cannot be named source or target in GML,
+    so it is renamed to networks.
+    Since rows with a network attribute can contain the same edge
+    once for each weight sign, these graphs are written as multigraphs.
+
+    :param file: File object
+    :param rows: Iterable of rows
+    :param network_attr: Name of attribute for the first value of each row
+    :return:
+    """
+    # source and target are reserved edge keys in GML
+    if network_attr in ('source', 'target'):
+        network_attr = 'networks'
+    file.write('graph [\n')
+    if network_attr:
+        # sets grouped by weight sign can contain the same edge twice
+        file.write('  multigraph 1\n')
+    nodes = dict()
+    for row in rows:
+        for node in row[1:3]:
+            if node not in nodes:
+                nodes[node] = len(nodes)
+        file.write('  edge [\n'
+                   '    source ' + str(nodes[row[1]]) + '\n'
+                   '    target ' + str(nodes[row[2]]) + '\n')
+        if row[3] is not None:
+            file.write('    weight ' + _gml_value(row[3]) + '\n')
+        if network_attr:
+            file.write('    ' + network_attr + ' ' + _gml_value(row[0]) + '\n')
+        file.write('  ]\n')
+    for node in nodes:
+        file.write('  node [\n'
+                   '    id ' + str(nodes[node]) + '\n'
+                   '    label ' + _gml_value(str(node)) + '\n'
+                   '  ]\n')
+    file.write(']\n')
+
+
+def _gml_value(value):
+    """
+    Formats a value for a GML file.
+    Strings are quoted, with quotes and ampersands escaped as HTML entities.
+
+    :param value: String or number
+    :return: Formatted value
+    """
+    if type(value) == str:
+        return '"' + escape(value, {'"': '&quot;'}) + '"'
+    return repr(float(value))
+
+
+def _write_edgelist(file, rows, network_attr=None):
+    """
+    Writes rows as a weighted edge list,
+    with one 'source target weight' line per edge.
+    Edge lists have no edge attributes, so network names are not written.
+
+    :param file: File object
+    :param rows: Iterable of rows
+    :param network_attr: Ignored
+    :return:
+    """
+    for row in rows:
+        weight = row[3]
+        if weight is None:
+            weight = float('nan')
+        file.write(str(row[1]) + ' ' + str(row[2]) + ' ' + str(weight) + '\n')
@@ -0,0 +1,505 @@
+"""
+This file contains the job types that masq can run in the background,
+and a work queue that is stored in the database itself.
+Jobs are added to a jobs table with submit,
+and any number of workers, on any number of machines,
+claim them one at a time with SELECT ... FOR UPDATE SKIP LOCKED,
+so no two workers run the same job and PostgreSQL is the only coordination service.
+While a job runs, its worker updates the heartbeat of the job.
+Jobs whose worker stops sending heartbeats are put back in the queue,
+and failed jobs are retried with an increasing delay
+until they have used up their attempts.
+A job fails if it raises an exception or logs an error.
+Since a job can be run again after a worker was lost,
+jobs should not depend on being run exactly once.
+
+On SQLite, workers do not send heartbeats while a job runs,
+since all queries share a single connection, and lost jobs are not requeued.
+
+Example:
+
+    masq submit -c database.ini import_biom -p '{"location": "bioms/study1.biom"}'
+    masq worker -c database.ini --drain
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import socket
+import inspect
+import argparse
+import importlib
+import threading
+from time import sleep
+from collections import deque
+import logging.handlers
+from masq.scripts.utils import ParentConnection
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# parameters that are set by the server or worker, not by jobs
+_connection_params = ('config', 'host', 'database', 'username', 'password')
+
+
+def _export_networks(path, names=None, format='graphml', config='database.ini',
+                     host=None, database=None, username=None, password=None):
+    """
+    Writes networks to a folder, one file per network.
+
+    :param path: Folder to write the network files to
+    :param names: List of network names, by default all networks
+    :param format: File format, graphml, gml or txt
+    :return:
+    """
+    from masq.scripts.io import IoConnection
+    conn = IoConnection(config, host, database, username, password)
+    conn.export_networks(names=names, path=path, format=format)
+
+
+def _export_biom(study, path, config='database.ini',
+                 host=None, database=None, username=None, password=None):
+    """
+    Writes the counts and metadata of a study to a BIOM file.
+
+    :param study: Name of study
+    :param path: Location of BIOM file
+    :return:
+    """
+    from masq.scripts.sq4biom import BiomConnection
+    conn = BiomConnection(config, host, database, username, password)
+    conn.export_biom(study, path)
+
+
+# job types, with the module and name of the function that runs them;
+# the modules are imported when the first job of a type is submitted
+job_types = {'import_biom': ('masq.scripts.sq4biom', 'import_biom'),
+             'import_networks': ('masq.scripts.io', 'import_networks'),
+             'extract_sets': ('masq.scripts.netstats', 'extract_sets'),
+             'agglomerate': ('masq.scripts.metastats', 'start_metastats'),
+             'export_networks': (__name__, '_export_networks'),
+             'export_biom': (__name__, '_export_biom')}
+
+
+class JobConnection(ParentConnection):
+    """
+    Initializes a connection to the PostgreSQL database.
+    This connection object contains methods for adding jobs to the jobs table,
+    and for claiming, completing and retrying them.
+    """
+    # inherits init from parent
+    def create_jobs(self):
+        """
+        Creates the jobs table if it does not exist yet.
+        Times are stored as seconds since the epoch, as given by the database server,
+        so workers on different machines agree on them.
+
+        :return:
+        """
+        self.query("CREATE TABLE IF NOT EXISTS jobs (" +
+                   "jobID " + self.backend.serial + " PRIMARY KEY,"
+                   "type varchar NOT NULL,"
+                   "params varchar,"
+                   "status varchar NOT NULL,"
+                   "attempts int DEFAULT 0,"
+                   "max_attempts int,"
+                   "worker varchar,"
+                   "error varchar,"
+                   "submitted float,"
+                   "run_after float,"
+                   "started float,"
+                   "heartbeat float,"
+                   "finished float"
+                   ");")
+        self.query("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, jobID);")
+
+    def delete_jobs(self):
+        """
+        Deletes the jobs table.
+
+        :return:
+        """
+        self.query("DROP TABLE jobs;")
+
+    def submit(self, type, params=None, attempts=3):
+        """
+        Adds a job to the jobs table.
+
+        :param type: Job type, one of the keys of job_types
+        :param params: Dictionary of parameters of the job function
+        :param attempts: Number of times the job is tried before it fails
+        :return: ID of job
+        """
+        params = _check_job(type, params)
+        now = self.backend.now
+        results = self.value_query("INSERT INTO jobs (type, params, status, max_attempts, "
+                                   "submitted, run_after) "
+                                   "VALUES (%s, %s, 'queued', %s, " + now + ", " + now + ") "
+                                   "RETURNING jobID;",
+                                   values=(type, json.dumps(params), attempts), fetch=True)
+        return results[0][0]
+
+    def claim(self, worker):
+        """
+        Claims the oldest queued job.
+        On PostgreSQL, rows that are being claimed by other workers are skipped,
+        so workers never wait for each other.
+
+        :param worker: Name of worker
+        :return: Dictionary with job ID, type, params and attempt, or None if no job is queued
+        """
+        now = self.backend.now
+        lock = " FOR UPDATE SKIP LOCKED" if self.backend.row_locks else ""
+        results = self.value_query("UPDATE jobs SET status='running', worker=%s, "
+                                   "attempts=attempts+1, error=NULL, "
+                                   "started=" + now + ", heartbeat=" + now + " "
+                                   "WHERE jobID = (SELECT jobID FROM jobs "
+                                   "WHERE status='queued' AND run_after <= " + now + " "
+                                   "ORDER BY jobID LIMIT 1" + lock + ") "
+                                   "RETURNING jobID, type, params, attempts, max_attempts;",
+                                   values=(worker,), fetch=True)
+        if not results:
+            return None
+        job_id, type, params, attempt, attempts = results[0]
+        return {'id': job_id, 'type': type, 'params': json.loads(params),
+                'attempt': attempt, 'attempts': attempts}
+
+    def heartbeat(self, job_id, worker):
+        """
+        Updates the heartbeat of a running job.
+
+        :param job_id: ID of job
+        :param worker: Name of worker
+        :return: True if the job is still claimed by the worker
+        """
+        results = self.value_query("UPDATE jobs SET heartbeat=" + self.backend.now + " "
+                                   "WHERE jobID=%s AND worker=%s AND status='running' "
+                                   "RETURNING jobID;", values=(job_id, worker), fetch=True)
+        return bool(results)
+
+    def complete(self, job_id, worker):
+        """
+        Marks a job as done.
+
+        :param job_id: ID of job
+        :param worker: Name of worker
+        :return:
+        """
+        self.value_query("UPDATE jobs SET status='done', finished=" + self.backend.now + " "
+                         "WHERE jobID=%s AND worker=%s AND status='running';",
+                         values=(job_id, worker))
+
+    def fail(self, job_id, worker, error, delay=0):
+        """
+        Puts a failed job back in the queue after a delay,
+        or marks it as failed if it has used up its attempts.
+
+        :param job_id: ID of job
+        :param worker: Name of worker
+        :param error: Error message
+        :param delay: Number of seconds before the job can be claimed again
+        :return:
+        """
+        now = self.backend.now
+        self.value_query("UPDATE jobs SET "
+                         "status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                         "error=%s, finished=" + now + ", run_after=" + now + " + %s "
+                         "WHERE jobID=%s AND worker=%s AND status='running';",
+                         values=(error, delay, job_id, worker))
+
+    def requeue_stale(self, timeout):
+        """
+        Puts running jobs without a recent heartbeat back in the queue,
+        or marks them as failed if they have used up their attempts.
+
+        :param timeout: Number of seconds without heartbeat after which a worker is considered lost
+        :return: List of IDs of requeued or failed jobs
+        """
+        now = self.backend.now
+        results = self.value_query("UPDATE jobs SET "
+                                   "status = CASE WHEN attempts < max_attempts "
+                                   "THEN 'queued' ELSE 'failed' END, "
+                                   "error = 'Worker ' || worker || ' stopped sending heartbeats.', "
+                                   "run_after=" + now + " "
+                                   "WHERE status='running' AND heartbeat < " + now + " - %s "
+                                   "RETURNING jobID;", values=(timeout,), fetch=True)
+        for result in results or []:
+            logger.warning("Job " + str(result[0]) + " lost its worker.")
+        return [x[0] for x in results or []]
+
+    def get_jobs(self, status=None):
+        """
+        Returns the jobs in the jobs table.
+
+        :param status: Only return jobs with this status, e.g. queued or failed
+        :return: List of dictionaries
+        """
+        columns = ['id', 'type', 'params', 'status', 'attempts', 'max_attempts', 'worker',
+                   'error', 'submitted', 'started', 'heartbeat', 'finished']
+        query = "SELECT jobID, type, params, status, attempts, max_attempts, worker, " \
+                "error, submitted, started, heartbeat, finished FROM jobs"
+        if status:
+            results = self.value_query(query + " WHERE status=%s ORDER BY jobID;",
+                                       values=(status,), fetch=True)
+        else:
+            results = self.query(query + " ORDER BY jobID;", fetch=True)
+        jobs = [dict(zip(columns, x)) for x in results]
+        for job in jobs:
+            job['params'] = json.loads(job['params'])
+        return jobs
+
+
+def run_worker(config='database.ini', host=None, database=None,
+               username=None, password=None, name=None,
+               poll=5, heartbeat=10, timeout=60, retry_delay=30, drain=False):
+    """
+    Claims and runs jobs from the jobs table until it is interrupted.
+
+    :param config: Location of file with database parameters.
+    :param host: Database address.
+    :param database: Name of PostgreSQL database.
+    :param username: Username for PostgreSQL database.
+    :param password: Password of PostgreSQL database.
+    :param name: Name of worker, by default the host name and process ID
+    :param poll: Number of seconds to wait before checking an empty queue again
+    :param heartbeat: Number of seconds between heartbeats of a running job
+    :param timeout: Number of seconds without heartbeat after which jobs of other workers are requeued
+    :param retry_delay: Number of seconds before a failed job is retried, doubled for every attempt
+    :param drain: If True, the worker stops when no job is queued
+    :return: Dictionary with the number of jobs that were done and failed
+    """
+    connection = {'config': config, 'host': host, 'database': database,
+                  'username': username, 'password': password}
+    conn = JobConnection(**connection)
+    conn.create_jobs()
+    name = name or socket.gethostname() + ':' + str(os.getpid())
+    # heartbeats need a second connection while the job runs
+    beats = conn.backend.name != 'sqlite'
+    handler = _JobLog()
+    logging.getLogger('masq').addHandler(handler)
+    counts = {'done': 0, 'failed': 0}
+    logger.info("Worker " + name + " started.")
+    try:
+        while True:
+            if beats:
+                conn.requeue_stale(timeout)
+            job = conn.claim(name)
+            if not job:
+                if drain:
+                    break
+                sleep(poll)
+                continue
+            logger.info("Running " + job['type'] + " job " + str(job['id']) +
+                        ", attempt " + str(job['attempt']) + " of " + str(job['attempts']) + "...")
+            stop = threading.Event()
+            if beats:
+                beat = threading.Thread(target=_heartbeat, args=(conn, job['id'], name, heartbeat, stop),
+                                        daemon=True)
+                beat.start()
+            log = {'messages': deque(maxlen=50), 'errors': list(), 'progress': None}
+            handler.jobs[threading.get_ident()] = log
+            try:
+                _job_function(job['type'])(**job['params'], **connection)
+            except Exception as e:
+                error = "Job " + str(job['id']) + " failed: " + str(e)
+                logger.error(error, exc_info=True)
+                # the job also fails if the log record does not reach the handler,
+                # e.g. when this module runs as __main__
+                if error not in log['errors']:
+                    log['errors'].append(error)
+            handler.jobs.pop(threading.get_ident())
+            stop.set()
+            if log['errors']:
+                conn.fail(job['id'], name, "\n".join(log['errors']),
+                          delay=retry_delay * 2 ** (job['attempt'] - 1))
+                counts['failed'] += 1
+            else:
+                conn.complete(job['id'], name)
+                counts['done'] += 1
+    except KeyboardInterrupt:
+        logger.info("Stopping worker " + name + "...")
+    finally:
+        logging.getLogger('masq').removeHandler(handler)
+    logger.info("Worker " + name + " ran " + str(counts['done']) + " jobs, " +
+                str(counts['failed']) + " failed.")
+    return counts
+
+
+def _heartbeat(conn, job_id, worker, interval, stop):
+    """
+    Updates the heartbeat of a job until the stop event is set.
+
+    :param conn: JobConnection object
+    :param job_id: ID of job
+    :param worker: Name of worker
+    :param interval: Number of seconds between heartbeats
+    :param stop: threading.Event that is set when the job is finished
+    :return:
+    """
+    while not stop.wait(interval):
+        if not conn.heartbeat(job_id, worker):
+            logger.warning("Job " + str(job_id) + " is no longer claimed by " + worker + ".")
+            return
+
+
+class _JobLog(logging.Handler):
+    """
+    Adds log messages to the job that runs in the thread that logged them.
+    Jobs are dictionaries with a deque of messages, a list of errors and the last message as progress.
+    """
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        # jobs by thread identifier
+        self.jobs = dict()
+
+    def emit(self, record):
+        job = self.jobs.get(record.thread)
+        if job is None:
+            return
+        message = record.getMessage().strip()
+        job['messages'].append(message)
+        job['progress'] = message
+        if record.levelno >= logging.ERROR:
+            job['errors'].append(message)
+
+
+def _check_job(type, params):
+    """
+    Checks if a job type exists and if the function of the job accepts the parameters.
+
+    :param type: Job type
+    :param params: Dictionary of parameters, or None
+    :return: Dictionary of parameters
+    """
+    params = dict(params or dict())
+    if type not in job_types:
+        raise ValueError("Unknown job type " + str(type) + ", choose from " +
+                         ", ".join(job_types) + ".")
+    for param in _connection_params:
+        if param in params:
+            raise ValueError("Jobs cannot set the connection parameter " + param + ".")
+    inspect.signature(_job_function(type)).bind(**params, **dict.fromkeys(_connection_params))
+    return params
+
+
+def _job_function(type):
+    """
+    Returns the function that runs a job type.
+
+    :param type: Job type
+    :return: Function
+    """
+    module, name = job_types[type]
+    return getattr(importlib.import_module(module), name)
+
+
+worker_parser = argparse.ArgumentParser(description='masq worker', prog='masq worker')
+worker_parser.add_argument('-c', '--config',
+                           dest='config',
+                           help='Config file with the database that holds the jobs table. ',
+                           default='database.ini',
+                           type=str)
+worker_parser.add_argument('-n', '--name',
+                           dest='name',
+                           help='Name of worker, by default the host name and process ID. ',
+                           default=None,
+                           type=str)
+worker_parser.add_argument('-poll', '--poll',
+                           dest='poll',
+                           help='Seconds to wait before checking an empty queue again. ',
+                           default=5,
+                           type=float)
+worker_parser.add_argument('-hb', '--heartbeat',
+                           dest='heartbeat',
+                           help='Seconds between heartbeats of a running job. ',
+                           default=10,
+                           type=float)
+worker_parser.add_argument('-t', '--timeout',
+                           dest='timeout',
+                           help='Seconds without heartbeat after which a job is requeued. ',
+                           default=60,
+                           type=float)
+worker_parser.add_argument('-r', '--retry_delay',
+                           dest='retry_delay',
+                           help='Seconds before a failed job is retried, doubled for every attempt. ',
+                           default=30,
+                           type=float)
+worker_parser.add_argument('-d', '--drain',
+                           dest='drain',
+                           help='If flagged, the worker stops when no job is queued. ',
+                           default=False,
+                           action='store_true')
+
+submit_parser = argparse.ArgumentParser(description='masq job submission', prog='masq submit')
+submit_parser.add_argument('type',
+                           help='Job type. ',
+                           choices=list(job_types))
+submit_parser.add_argument('-c', '--config',
+                           dest='config',
+                           help='Config file with the database that holds the jobs table. ',
+                           default='database.ini',
+                           type=str)
+submit_parser.add_argument('-p', '--params',
+                           dest='params',
+                           help='JSON object with the parameters of the job. ',
+                           default='{}',
+                           type=str)
+submit_parser.add_argument('-a', '--attempts',
+                           dest='attempts',
+                           help='Number of times the job is tried before it fails. ',
+                           default=3,
+                           type=int)
+
+
+def worker_command(options):
+    """
+    Runs a worker with the options of the worker parser.
+
+    :param options: Namespace from worker_parser
+    :return:
+    """
+    run_worker(config=options.config, name=options.name, poll=options.poll,
+               heartbeat=options.heartbeat, timeout=options.timeout,
+               retry_delay=options.retry_delay, drain=options.drain)
+
+
+def submit_command(options):
+    """
+    Submits a job with the options of the submit parser.
+
+    :param options: Namespace from submit_parser
+    :return:
+    """
+    conn = JobConnection(options.config)
+    conn.create_jobs()
+    job_id = conn.submit(options.type, json.loads(options.params), attempts=options.attempts)
+    logger.info("Submitted " + options.type + " job " + str(job_id) + ".")
+
+
+worker_parser.set_defaults(func=worker_command)
+submit_parser.set_defaults(func=submit_command)
+
+
+def main(args=None):
+    worker_command(worker_parser.parse_args(args))
+
+
+def submit_main(args=None):
+    submit_command(submit_parser.parse_args(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+This file contains a batch import that reads all BIOM files and networks
+of a project from a single manifest file.
+The manifest is a JSON or YAML file with lists of BIOM files and networks,
+where each item is a file, a folder, or a dictionary with a path
+and optionally a name, a study and a bulk flag.
+Names are derived from the filenames, unless they are given in the mapping
+or the item, and networks belong to the study with the same name,
+unless it is given in the sources or the item.
+Relative paths are read from the folder that contains the manifest.
+
+Example:
+
+    bulk: false
+    mapping: {study1_filtered: study1}
+    sources: {study1_spiec: study1}
+    bioms:
+      - bioms/
+      - {path: extra/study2.biom, name: study2, bulk: true}
+    networks:
+      - networks/
+      - {path: extra/study2.graphml, name: study2_conet, study: study2}
+
+All files are imported by one process on a fixed number of threads
+that share a pool of warm database connections.
+Networks wait until the BIOM file of their study has been imported,
+and are skipped if that import failed.
+A file fails if it raises an exception or logs an error,
+and the manifest import ends with a summary of all files.
+On SQLite, files are imported one at a time, since all queries share a single connection.
+
+    masq manifest project.yaml -c database.ini -w 4 -r report.json -met masq.prom
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import argparse
+import threading
+import contextvars
+from time import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging.handlers
+from masq.scripts.utils import ParentConnection
+from masq.scripts.sq4biom import BiomConnection
+from masq.scripts.io import IoConnection, _read_network_extension
+from masq.scripts.jobs import _JobLog
+from masq.scripts import metrics
+from masq.scripts import tracing
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# extensions of files that are imported from folders
+_extensions = {'biom': ('biom',), 'network': ('graphml', 'gml', 'txt')}
+
+
+def read_manifest(location):
+    """
+    Reads a manifest file and lists the BIOM files and networks it contains.
+    Folders are replaced by the files in them with a known extension.
+
+    :param location: Location of JSON or YAML manifest
+    :return: List of dictionaries with type, path, name, study and bulk flag of each file
+    """
+    with open(location, 'r') as file:
+        contents = file.read()
+    if location.split('.')[-1] in ('yaml', 'yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML manifests requires the pyyaml package.")
+        manifest = yaml.safe_load(contents)
+    else:
+        manifest = json.loads(contents)
+    if not isinstance(manifest, dict):
+        raise ValueError("The manifest " + location + " does not contain a dictionary.")
+    unknown = set(manifest) - {'bioms', 'networks', 'mapping', 'sources', 'bulk'}
+    if unknown:
+        raise ValueError("Unknown manifest keys: " + ", ".join(sorted(unknown)) + ".")
+    folder = os.path.dirname(os.path.abspath(location))
+    mapping = manifest.get('mapping') or dict()
+    sources = manifest.get('sources') or dict()
+    bulk = manifest.get('bulk', False)
+    files = list()
+    for type, key in (('biom', 'bioms'), ('network', 'networks')):
+        for item in manifest.get(key) or list():
+            files.extend(_manifest_files(item, type, folder, mapping, sources, bulk))
+    for type in ('biom', 'network'):
+        names = [x['name'] for x in files if x['type'] == type]
+        duplicates = sorted(set(x for x in names if names.count(x) > 1))
+        if duplicates:
+            raise ValueError("The manifest contains more than one " + type + " named " +
+                             ", ".join(duplicates) + ".")
+    return files
+
+
+def _manifest_files(item, type, folder, mapping, sources, bulk):
+    """
+    Lists the files of a single manifest item.
+
+    :param item: Path, or dictionary with path and optionally name, study and bulk
+    :param type: Either 'biom' or 'network'
+    :param folder: Folder that relative paths are read from
+    :param mapping: Dictionary with filenames as keys, new names as values
+    :param sources: Dictionary with network names as keys, BIOM names as values
+    :param bulk: Default bulk flag
+    :return: List of dictionaries
+    """
+    if isinstance(item, str):
+        item = {'path': item}
+    if not isinstance(item, dict) or 'path' not in item:
+        raise ValueError("Manifest items need to be a path or a dictionary with a path, not " +
+                         str(item) + ".")
+    path = os.path.join(folder, item['path'])
+    if os.path.isdir(path):
+        if 'name' in item:
+            raise ValueError("The folder " + item['path'] + " cannot have a single name.")
+        paths = [os.path.join(path, x) for x in sorted(os.listdir(path))
+                 if x.split('.')[-1] in _extensions[type]]
+    elif os.path.isfile(path):
+        paths = [path]
+    else:
+        raise ValueError("The manifest refers to " + item['path'] + ", which does not exist.")
+    files = list()
+    for path in paths:
+        name = os.path.basename(path).split('.')[0]
+        name = item.get('name', mapping.get(name, name))
+        files.append({'type': type, 'path': path, 'name': name,
+                      'study': item.get('study', sources.get(name, name)) if type == 'network' else name,
+                      'bulk': item.get('bulk', bulk)})
+    return files
+
+
+def import_manifest(location, config='database.ini',
+                    host=None, database=None,
+                    username=None, password=None,
+                    workers=4, pool=None, report=None):
+    """
+    Imports all BIOM files and networks in a manifest.
+    Networks are only imported after the BIOM file of their study,
+    if this BIOM file is in the manifest.
+
+    :param location: Location of JSON or YAML manifest
+    :param config: Location of file with database parameters.
+    :param host: Database address.
+    :param database: Name of PostgreSQL database.
+    :param username: Username for PostgreSQL database.
+    :param password: Password of PostgreSQL database.
+    :param workers: Number of files that are imported at the same time
+    :param pool: Number of warm PostgreSQL connections, by default twice the number of workers
+    :param report: If given, the summary is written to this JSON file
+    :return: Dictionary with summary
+    """
+    files = read_manifest(location)
+    connection = (config, host, database, username, password)
+    conn = ParentConnection(*connection)
+    backend = conn.backend
+    if backend.name == 'sqlite' and workers > 1:
+        logger.warning("SQLite databases share a single connection, so files are imported one at a time.")
+        workers = 1
+    if hasattr(backend, 'open_pool'):
+        backend.open_pool(pool or 2 * workers)
+    for file in files:
+        file.update({'status': 'queued', 'started': None, 'finished': None,
+                     'progress': None, 'messages': deque(maxlen=50), 'errors': list()})
+    logger.info("Importing " + str(len(files)) + " files from " + location + "...")
+    start = time()
+    # log messages are collected by the thread that imports the file
+    handler = _JobLog()
+    logging.getLogger('masq').addHandler(handler)
+    lock = threading.Lock()
+    try:
+        with tracing.span('import_manifest', manifest=location, files=len(files)):
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='masq_manifest') as executor:
+                # BIOM files are submitted first, so networks that wait for them
+                # can never hold up a BIOM import that has not started yet
+                bioms = dict()
+                for file in files:
+                    if file['type'] == 'biom':
+                        bioms[file['name']] = executor.submit(contextvars.copy_context().run, _import_file,
+                                                              file, connection, handler, lock)
+                for file in files:
+                    if file['type'] == 'network':
+                        executor.submit(contextvars.copy_context().run, _import_file,
+                                        file, connection, handler, lock, bioms.get(file['study']))
+    finally:
+        logging.getLogger('masq').removeHandler(handler)
+        if hasattr(backend, 'close_pool'):
+            backend.close_pool()
+    summary = _summary(location, files, time() - start)
+    logger.info("Manifest import summary: \n" + _report(summary))
+    if report:
+        with open(report, 'w') as file:
+            json.dump(summary, file, indent=2)
+    return summary
+
+
+def _import_file(file, connection, handler, lock, depends=None):
+    """
+    Imports a single BIOM file or network in a worker thread.
+
+    :param file: Dictionary from read_manifest, updated with the status of the import
+    :param connection: Tuple of connection parameters
+    :param handler: _JobLog that collects log messages of the file
+    :param lock: Lock for the status of files
+    :param depends: Future of the BIOM import of the network study
+    :return: True if the file was imported
+    """
+    if depends and not depends.result():
+        file['status'] = 'skipped'
+        file['errors'].append("The BIOM file of study " + file['study'] + " was not imported.")
+        return False
+    thread = threading.get_ident()
+    with lock:
+        handler.jobs[thread] = file
+        file['status'] = 'running'
+        file['started'] = time()
+    try:
+        if file['type'] == 'biom':
+            import biom
+            biomtab = biom.load_table(file['path'])
+            if biomtab.is_empty():
+                raise ValueError("Could not read BIOM file " + file['path'] + ".")
+            conn = BiomConnection(*connection)
+            conn.add_biom(biomtab, file['name'], bulk=file['bulk'])
+        else:
+            network = _read_network_extension(file['path'])
+            if not network:
+                raise ValueError("Could not read network " + file['path'] + ".")
+            conn = IoConnection(*connection)
+            conn.add_network(network, name=file['name'], study=file['study'], bulk=file['bulk'])
+        metrics.add_file(file['path'], file['type'])
+        metrics.export()
+    except Exception as e:
+        error = "Could not import " + file['path'] + ": " + str(e)
+        logger.error(error, exc_info=True)
+        # the file also fails if the log record does not reach the handler,
+        # e.g. when this module runs as __main__
+        with lock:
+            if error not in file['errors']:
+                file['errors'].append(error)
+    with lock:
+        handler.jobs.pop(thread)
+        file['finished'] = time()
+        file['status'] = 'failed' if file['errors'] else 'done'
+    return file['status'] == 'done'
+
+
+def _summary(location, files, seconds):
+    """
+    Summarizes the imported files.
+
+    :param location: Location of manifest
+    :param files: List of file dictionaries
+    :param seconds: Duration of the complete import
+    :return: Dictionary
+    """
+    counts = {type: {'done': 0, 'failed': 0, 'skipped': 0, 'queued': 0}
+              for type in ('biom', 'network')}
+    results = list()
+    for file in files:
+        counts[file['type']][file['status']] += 1
+        results.append({'type': file['type'], 'path': file['path'], 'name': file['name'],
+                        'study': file['study'], 'status': file['status'],
+                        'seconds': file['finished'] - file['started'] if file['finished'] else None,
+                        'errors': list(file['errors'])})
+    return {'manifest': location, 'seconds': seconds, 'counts': counts, 'files': results}
+
+
+def _report(summary):
+    """
+    Formats the summary of a manifest import as a table,
+    followed by the errors of files that were not imported.
+
+    :param summary: Dictionary from _summary
+    :return: String with table
+    """
+    lines = ["{:<10} {:>8} {:>8} {:>8}".format('type', 'done', 'failed', 'skipped')]
+    for type, counts in summary['counts'].items():
+        lines.append("{:<10} {:>8} {:>8} {:>8}".format(type, counts['done'], counts['failed'],
+                                                       counts['skipped']))
+    lines.append("Imported in {:.2f} seconds.".format(summary['seconds']))
+    for file in summary['files']:
+        if file['errors']:
+            lines.append(file['status'] + " " + file['path'] + ": " + file['errors'][0])
+    return "\n".join(lines)
+
+
+manifest_parser = argparse.ArgumentParser(description='masq manifest import', prog='masq manifest')
+manifest_parser.add_argument('manifest',
+                             help='JSON or YAML file listing BIOM files, networks, '
+                                  'name mappings and network sources. ')
+manifest_parser.add_argument('-c', '--config',
+                             dest='config',
+                             help='Config file with the database that files are imported in. ',
+                             default='database.ini',
+                             type=str)
+manifest_parser.add_argument('-w', '--workers',
+                             dest='workers',
+                             help='Number of files that are imported at the same time. ',
+                             default=4,
+                             type=int)
+manifest_parser.add_argument('-pool', '--pool',
+                             dest='pool',
+                             help='Number of warm database connections, by default twice the number of workers. ',
+                             default=None,
+                             type=int)
+manifest_parser.add_argument('-r', '--report',
+                             dest='report',
+                             help='JSON file that the summary of the import is written to. ',
+                             default=None,
+                             type=str)
+manifest_parser.add_argument('-met', '--metrics',
+                             dest='metrics',
+                             help='File that metrics are written to, such as rows per second per table, \n'
+                                  'imported files and bytes, queries and connection wait time. \n'
+                                  'The file is updated after every imported file. ',
+                             default=None,
+                             type=str)
+manifest_parser.add_argument('-mf', '--metrics_format',
+                             dest='metrics_format',
+                             help='Format of the metrics file: a Prometheus textfile, \n'
+                                  'or JSON lines that are appended to the file. ',
+                             choices=['prometheus', 'jsonl'],
+                             default='prometheus',
+                             type=str)
+manifest_parser.add_argument('-tr', '--trace',
+                             dest='trace',
+                             help='File that trace spans of the manifest and file imports \n'
+                                  'are appended to, as JSON lines. ',
+                             default=None,
+                             type=str)
+
+
+def manifest_command(options):
+    """
+    Imports a manifest with the options of the manifest parser,
+    and exits with status 1 if any file was not imported.
+
+    :param options: Namespace from manifest_parser
+    :return:
+    """
+    if options.trace:
+        tracing.start_tracing(path=options.trace)
+    if options.metrics:
+        metrics.start_metrics(path=options.metrics, format=options.metrics_format)
+    try:
+        summary = import_manifest(options.manifest, config=options.config, workers=options.workers,
+                                  pool=options.pool, report=options.report)
+    finally:
+        if options.trace:
+            tracing.stop_tracing()
+            logger.info('Wrote trace to ' + options.trace + '.')
+        if options.metrics:
+            metrics.stop_metrics()
+            logger.info('Wrote metrics to ' + options.metrics + '.')
+    failed = sum(x['failed'] + x['skipped'] for x in summary['counts'].values())
+    if failed:
+        sys.exit(1)
+
+
+manifest_parser.set_defaults(func=manifest_command)
+
+
+def main(args=None):
+    manifest_command(manifest_parser.parse_args(args))
+
+
+if __name__ == '__main__':
+    main()
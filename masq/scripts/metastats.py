@@ -10,10 +10,13 @@ __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
 import sys
+import itertools
 from uuid import uuid4
 import logging.handlers
 from masq.scripts.utils import ParentConnection
-from pandas.core.common import flatten
+from masq.scripts import instrument
+from masq.scripts import metrics
+from masq.scripts import tracing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -26,8 +29,9 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+@tracing.traced('start_metastats', level='level')
 def start_metastats(level, networks=None,
-                    weight=True,
+                    weight=True, analytic=False,
                     config='database.ini',
                     host=None, database=None,
                     username=None, password=None):
@@ -41,6 +45,7 @@ def start_metastats(level, networks=None,
 
     :param set: Type of set to extract
     :param networks: Networks to extract set from
+    :param analytic: If True, pairs are searched on a DuckDB mirror of the edges and taxonomy tables
     :param config: Location of file with database parameters.
     :param host: Database address.
     :param database: Name of PostgreSQL database.
@@ -51,12 +56,18 @@ def start_metastats(level, networks=None,
     conn = MetaConnection(config, host, database, username, password)
     if not networks:
         networks = conn.get_networks()
+    if analytic:
+        conn.attach_analytic(tables=['edges', 'taxonomy'])
     tax_list = ['Species', 'Genus', 'Family', 'Order', 'Class', 'Phylum', 'Kingdom']
     level_id = tax_list.index(level.capitalize())
-    for level in range(0, level_id + 1):
-        logger.info("Checking " + tax_list[level] + " level...")
-        networks = conn.agglomerate_networks(level=tax_list[level],
-                                             weight=weight, networks=networks)
+    try:
+        for level in range(0, level_id + 1):
+            logger.info("Checking " + tax_list[level] + " level...")
+            networks = conn.agglomerate_networks(level=tax_list[level],
+                                                 weight=weight, networks=networks)
+    finally:
+        # returns the connection used for prepared statements
+        conn.close()
 
 
 class MetaConnection(ParentConnection):
@@ -64,8 +75,11 @@ class MetaConnection(ParentConnection):
     Initializes a connection to the PostgreSQL database.
     This connection object contains methods for aggregating networks
     by taxonomic level.
+    If an analytic mirror is attached, pairs and taxa are searched on the mirror,
+    and changes to the edges and taxonomy tables are written to both databases.
     """
     # inherits init from parent
+    @tracing.traced('agglomerate_networks', level='level')
     def agglomerate_networks(self, level=None, weight=True, networks=None):
         """
         Agglomerates to specified taxonomic level, or, if no level is specified,
@@ -91,78 +105,85 @@ class MetaConnection(ParentConnection):
         :param weight: If true, an edge is counted separately if the sign of the weight is different
         :return:
         """
-        tax_list = ['Species', 'Genus', 'Family', 'Order', 'Class', 'Phylum', 'Kingdom']
-        new_networks = dict()
-        # we create a copy of the original network
-        for network in networks:
-            previous_network = network
-            if type(networks) == list:
-                new_name = level + '_' + network
-            else:
-                new_name = level + '_' + '_'.join(network.split('_')[1:])
-            new_networks[new_name] = network
-            # first check if lower-level network exists
-            # if there were no pairs, it might not have been copied
-            network_query = "SELECT networkID from networks WHERE networkID = %s"
-            hit = self.value_query(query=network_query,
-                                   values=(network,),
-                                   fetch=True)
-            i = tax_list.index(level)
-            while len(hit) == 0:
-                previous_network = '_'.join(network.split('_')[1:])
-                if i > 0:
-                    previous_network = tax_list[i] + '_' + previous_network
-                    i -= 1
+        # the agglomerated networks are changed, the networks they are copied from are only read
+        with self.lock(exclusive=[('network', _agglomerated_name(level, x, networks)) for x in networks],
+                       shared=[('network', x) for x in networks]):
+            tax_list = ['Species', 'Genus', 'Family', 'Order', 'Class', 'Phylum', 'Kingdom']
+            new_networks = dict()
+            # we create a copy of the original network
+            for network in networks:
+                previous_network = network
+                new_name = _agglomerated_name(level, network, networks)
+                new_networks[new_name] = network
+                # first check if lower-level network exists
+                # if there were no pairs, it might not have been copied
+                network_query = "SELECT networkID from networks WHERE networkID = %s"
                 hit = self.value_query(query=network_query,
-                                       values=(previous_network,),
+                                       values=(network,),
                                        fetch=True)
-            # if there are no pairs at all, no need to copy network
-            # possible with nodes that do not have large taxonomy
-            testpair = self.get_pairlist(level, weight, previous_network)
-            if len(testpair) == 0:
-                testpair = self.get_taxlist(level, previous_network)
-            if not len(testpair) == 0:
-                logger.info("Copying " + previous_network + "...")
-                self.copy_network(previous_network, new_name)
-            else:
-                new_networks[new_name] = None
-        try:
-            for network in new_networks:
-                if new_networks[network]:
-                    logger.info("Agglomerating " + network + "...")
-                    stop_condition = False
-                    while not stop_condition:
-                        # limit is necessary to prevent excessively long queries
-                        pairs = self.get_pairlist(level=level, weight=weight, network=network)
-                        if pairs:
-                            self.agglomerate_pair(pairs, level=level, network=network)
-                        else:
-                            stop_condition = True
-                    stop_condition = False
-                    while not stop_condition:
-                        # after agglomerating edges
-                        # taxa with same taxonomic assignments should be merged
-                        # this rewires the network
-                        tax_nodes = self.get_taxlist(level=level, network=network)
-                        if tax_nodes:
-                            self.agglomerate_taxa(tax_nodes, level=level, network=network)
-                        else:
-                            stop_condition = True
-                    edge_num = self.value_query("SELECT count(*) FROM edges WHERE edges.networkID=%s",
-                                                values=(network,), fetch=True)[0][0]
-                    self.value_query("UPDATE networks SET edge_num=" + str(edge_num) +
-                                     " WHERE networks.networkid=%s", values=(network,))
-                    node_num = self.value_query("SELECT source, target FROM edges WHERE edges.networkID=%s",
-                                                 values=(network,), fetch=True)
-                    node_num = len(set(flatten(node_num)))
-                    self.value_query("UPDATE networks SET node_num=" + str(node_num) +
-                                     " WHERE networks.networkid=%s", values=(network,))
-                    logger.info("The agglomerated network " + network +
-                                " contains " + str(node_num) + " nodes and " + str(edge_num) + " edges.")
-        except Exception:
-            logger.error("Could not agglomerate edges to higher taxonomic levels. \n", exc_info=True)
-        return new_networks
+                i = tax_list.index(level)
+                while len(hit) == 0:
+                    previous_network = '_'.join(network.split('_')[1:])
+                    if i > 0:
+                        previous_network = tax_list[i] + '_' + previous_network
+                        i -= 1
+                    hit = self.value_query(query=network_query,
+                                           values=(previous_network,),
+                                           fetch=True)
+                # if there are no pairs at all, no need to copy network
+                # possible with nodes that do not have large taxonomy
+                testpair = self.get_pairlist(level, weight, previous_network)
+                if len(testpair) == 0:
+                    testpair = self.get_taxlist(level, previous_network)
+                if not len(testpair) == 0:
+                    logger.info("Copying " + previous_network + "...")
+                    self.copy_network(previous_network, new_name)
+                else:
+                    new_networks[new_name] = None
+            try:
+                for network in new_networks:
+                    if new_networks[network]:
+                        logger.info("Agglomerating " + network + "...")
+                        stop_condition = False
+                        with instrument.stage('agglomerate_pair', network):
+                            while not stop_condition:
+                                # limit is necessary to prevent excessively long queries
+                                pairs = self.get_pairlist(level=level, weight=weight, network=network)
+                                if pairs:
+                                    self.agglomerate_pair(pairs, level=level, network=network)
+                                    metrics.add('masq_agglomeration_iterations_total',
+                                                network=network, step='pair')
+                                else:
+                                    stop_condition = True
+                        stop_condition = False
+                        with instrument.stage('agglomerate_taxa', network):
+                            while not stop_condition:
+                                # after agglomerating edges
+                                # taxa with same taxonomic assignments should be merged
+                                # this rewires the network
+                                tax_nodes = self.get_taxlist(level=level, network=network)
+                                if tax_nodes:
+                                    self.agglomerate_taxa(tax_nodes, level=level, network=network)
+                                    metrics.add('masq_agglomeration_iterations_total',
+                                                network=network, step='taxa')
+                                else:
+                                    stop_condition = True
+                        edge_num = self.value_query("SELECT count(*) FROM edges WHERE edges.networkID=%s",
+                                                    values=(network,), fetch=True)[0][0]
+                        self.value_query("UPDATE networks SET edge_num=" + str(edge_num) +
+                                         " WHERE networks.networkid=%s", values=(network,))
+                        node_num = self.value_query("SELECT source, target FROM edges WHERE edges.networkID=%s",
+                                                    values=(network,), fetch=True)
+                        node_num = len(set(itertools.chain.from_iterable(node_num)))
+                        self.value_query("UPDATE networks SET node_num=" + str(node_num) +
+                                         " WHERE networks.networkid=%s", values=(network,))
+                        logger.info("The agglomerated network " + network +
+                                    " contains " + str(node_num) + " nodes and " + str(edge_num) + " edges.")
+            except Exception:
+                logger.error("Could not agglomerate edges to higher taxonomic levels. \n", exc_info=True)
+            return new_networks
 
+    @tracing.traced('get_pairlist', network='network', level='level')
     def get_pairlist(self, level, weight, network):
         """
         Returns a single pair of edges.
@@ -187,40 +208,50 @@ class MetaConnection(ParentConnection):
         :param network: Name of network that the pairs should belong to
         :return: List containing results of Neo4j transaction
         """
-        # first, modify the table so that
-        # edge taxonomy at the level of interest is in alphabetical order
-        copy_query = "CREATE TABLE copy AS " \
-                     "SELECT source, target, weight FROM edges " \
-                     "WHERE edges.networkID = %s;"
-        self.value_query(copy_query, (network,))
-        copy_query = "INSERT INTO copy (source, target, weight) " \
-                     "SELECT target, source, weight FROM copy;"
-        self.value_query(copy_query, (network,))
-        if weight:
-            agglom_query = "SELECT string_agg(source::varchar, ','), " \
-                           "string_agg(target::varchar, ','), p." + level + \
-                           " as source, q." + level + \
-                           " as target, sign(WEIGHT) FROM copy as e " \
-                           "JOIN taxonomy as p ON e.source = p.taxon " \
-                           "JOIN taxonomy as q on e.target = q.taxon " \
-                           "WHERE p." + level + \
-                           " IS NOT NULL AND q." + level + " IS NOT NULL " \
-                           "GROUP BY p." + level + ", q." + level + \
-                           ", SIGN(e.weight) " \
-                           "HAVING COUNT(*) > 1 LIMIT 1;"
+        if self.analytic:
+            results = self.analytic.value_query(_pair_query(level, weight),
+                                                values=(network, network), fetch=True)
+            lookup = self.analytic
         else:
-            agglom_query = "SELECT string_agg(source::varchar, ','), " \
-                           "string_agg(target::varchar, ','), p." + level + \
-                           " as source, q." + level + " as target FROM copy as e " \
-                           "JOIN taxonomy as p ON e.source = p.taxon " \
-                           "JOIN taxonomy as q on e.target = q.taxon " \
-                           "WHERE p." + level + \
-                           " IS NOT NULL AND q." + level + " IS NOT NULL " \
-                           "GROUP BY p." + level + ", q." + level + \
-                           " HAVING COUNT(*) > 1 " \
-                            "LIMIT 1;"
-        results = self.value_query(agglom_query, values=(network,), fetch=True)
-        self.query("DROP TABLE copy;")
+            # the copy table is shared by all processes
+            with self.lock(exclusive=[('scratch', 'copy')]):
+                # first, modify the table so that
+                # edge taxonomy at the level of interest is in alphabetical order
+                copy_query = "CREATE TABLE copy AS " \
+                             "SELECT source, target, weight FROM edges " \
+                             "WHERE edges.networkID = %s;"
+                self.value_query(copy_query, (network,))
+                copy_query = "INSERT INTO copy (source, target, weight) " \
+                             "SELECT target, source, weight FROM copy;"
+                self.value_query(copy_query, (network,))
+                if weight:
+                    agglom_query = "SELECT string_agg(source::varchar, ','), " \
+                                   "string_agg(target::varchar, ','), p." + level + \
+                                   " as source, q." + level + \
+                                   " as target, sign(WEIGHT) FROM copy as e " \
+                                   "JOIN taxonomy as p ON e.source = p.taxon " \
+                                   "JOIN taxonomy as q on e.target = q.taxon " \
+                                   "WHERE p." + level + \
+                                   " IS NOT NULL AND q." + level + " IS NOT NULL " \
+                                   "AND p." + level + " != q." + level + " " \
+                                   "GROUP BY p." + level + ", q." + level + \
+                                   ", SIGN(e.weight) " \
+                                   "HAVING COUNT(*) > 1 LIMIT 1;"
+                else:
+                    agglom_query = "SELECT string_agg(source::varchar, ','), " \
+                                   "string_agg(target::varchar, ','), p." + level + \
+                                   " as source, q." + level + " as target FROM copy as e " \
+                                   "JOIN taxonomy as p ON e.source = p.taxon " \
+                                   "JOIN taxonomy as q on e.target = q.taxon " \
+                                   "WHERE p." + level + \
+                                   " IS NOT NULL AND q." + level + " IS NOT NULL " \
+                                   "AND p." + level + " != q." + level + " " \
+                                   "GROUP BY p." + level + ", q." + level + \
+                                   " HAVING COUNT(*) > 1 " \
+                                    "LIMIT 1;"
+                results = self.value_query(agglom_query, values=(network,), fetch=True)
+                self.query("DROP TABLE copy;")
+            lookup = self
         if len(results) > 0:
             sources = results[0][0].split(',')
             targets = results[0][1].split(',')
@@ -232,15 +263,17 @@ class MetaConnection(ParentConnection):
             check_query = "SELECT source, target from edges WHERE networkID = %s " \
                           "AND source=%s AND target=%s"
             for i in range(len(sources)):
-                checks = self.value_query(check_query, values=(network, sources[i], targets[i]), fetch=True)
+                checks = lookup.prepared_query(check_query, values=(network, sources[i], targets[i]), fetch=True)
                 if len(checks) == 0:
                     sources[i] = results[0][1].split(',')[i]
                     targets[i] = results[0][0].split(',')[i]
             results = (sources, targets, weight)
         else:
             results = []
+        tracing.set_attribute('rows', len(results[0]) if results else 0)
         return results
 
+    @tracing.traced('get_taxlist', network='network', level='level')
     def get_taxlist(self, level, network):
         """
         Returns two taxa that have the same taxonomic label at the specified level,
@@ -251,30 +284,38 @@ class MetaConnection(ParentConnection):
         :param network: Name of network that the pairs should belong to
         :return: List containing results of Neo4j transaction
         """
-        # first, modify the table so that
-        # edge taxonomy at the level of interest is in alphabetical order
-        copy_query = "CREATE TABLE copy AS " \
-                     "SELECT source, target FROM edges " \
-                     "WHERE edges.networkID = %s;"
-        self.value_query(copy_query, (network,))
-        copy_query = "INSERT INTO copy (source, target) " \
-                     "SELECT target, source FROM copy;"
-        self.value_query(copy_query, (network,))
-        agglom_query = "SELECT string_agg(source::varchar, ',') " \
-                       "FROM (SELECT DISTINCT source FROM copy) as e " \
-                       "JOIN taxonomy as p ON e.source = p.taxon " \
-                       "WHERE p." + level + \
-                       " IS NOT NULL "\
-                       "GROUP BY p." + level + \
-                       " HAVING COUNT(*) > 1 LIMIT 1;"
-        results = self.value_query(agglom_query, values=(network,), fetch=True)
-        self.query("DROP TABLE copy;")
+        if self.analytic:
+            results = self.analytic.value_query(_taxon_query(level),
+                                                values=(network, network), fetch=True)
+        else:
+            # the copy table is shared by all processes
+            with self.lock(exclusive=[('scratch', 'copy')]):
+                # first, modify the table so that
+                # edge taxonomy at the level of interest is in alphabetical order
+                copy_query = "CREATE TABLE copy AS " \
+                             "SELECT source, target FROM edges " \
+                             "WHERE edges.networkID = %s;"
+                self.value_query(copy_query, (network,))
+                copy_query = "INSERT INTO copy (source, target) " \
+                             "SELECT target, source FROM copy;"
+                self.value_query(copy_query, (network,))
+                agglom_query = "SELECT string_agg(source::varchar, ',') " \
+                               "FROM (SELECT DISTINCT source FROM copy) as e " \
+                               "JOIN taxonomy as p ON e.source = p.taxon " \
+                               "WHERE p." + level + \
+                               " IS NOT NULL "\
+                               "GROUP BY p." + level + \
+                               " HAVING COUNT(*) > 1 LIMIT 1;"
+                results = self.value_query(agglom_query, values=(network,), fetch=True)
+                self.query("DROP TABLE copy;")
         if results:
             sources = results[0][0].split(',')
         else:
             sources = []
+        tracing.set_attribute('rows', len(sources))
         return sources
 
+    @tracing.traced('copy_network', network='new_network', source='source_network')
     def copy_network(self, source_network, new_network):
         """
         Copies a network node and its edges.
@@ -290,12 +331,14 @@ class MetaConnection(ParentConnection):
                                 values=(source_network,), fetch=True)
         self.value_query("INSERT INTO networks (networkID, studyID, node_num, edge_num) "
                          "VALUES (%s, %s, %s, %s)", values=(new_network,) + vals[0])
+        self.add_partition('edges', new_network)
         edges = self.value_query("SELECT source, target, weight FROM edges "
                                  "WHERE networkID=%s;", values=(source_network,), fetch=True)
-        self.value_query("INSERT INTO edges (networkID, source, target, weight) "
-                         "VALUES (%s, %s, %s, %s)",
-                         values=[(new_network,) + edge for edge in edges])
+        self._write_query("INSERT INTO edges (networkID, source, target, weight) "
+                          "VALUES (%s, %s, %s, %s)",
+                          values=[(new_network,) + edge for edge in edges])
 
+    @tracing.traced('agglomerate_pair', network='network', level='level')
     def agglomerate_pair(self, pair, level, network):
         """
         When given a tuple containg two tuples and a weight value,
@@ -315,14 +358,15 @@ class MetaConnection(ParentConnection):
         # delete edges between pair
         del_query = "DELETE FROM edges WHERE networkID=%s " \
                     "AND source=%s AND target=%s"
-        self.value_query(del_query,
-                         values=(network, pair[0][0], pair[1][0]))
-        self.value_query(del_query,
-                         values=(network, pair[0][1], pair[1][1]))
+        self._write_query(del_query,
+                          values=(network, pair[0][0], pair[1][0]))
+        self._write_query(del_query,
+                          values=(network, pair[0][1], pair[1][1]))
         # add new edge between new nodes
-        self.value_query("INSERT INTO edges (networkID, source, target, weight) "
-                         "VALUES (%s,%s,%s,%s)", values=(network, new_1, new_2, pair[2]))
+        self._write_query("INSERT INTO edges (networkID, source, target, weight) "
+                          "VALUES (%s,%s,%s,%s)", values=(network, new_1, new_2, pair[2]))
 
+    @tracing.traced('agglomerate_taxa', network='network', level='level', rows='nodes')
     def agglomerate_taxa(self, nodes, level, network):
         """
         Creates a merged taxon at the specified taxonomic level.
@@ -338,27 +382,30 @@ class MetaConnection(ParentConnection):
         new = self.create_agglom(parent=nodes[0], level=level)
         for node in nodes:
             # first get edges where node is source
-            partners = self.value_query("SELECT target, weight FROM edges as e "
-                                        "WHERE e.source=%s "
-                                        "AND e.networkID=%s", values=(node, network), fetch=True)
-            partners.extend(self.value_query("SELECT source, weight FROM edges as e "
-                                             "WHERE e.target=%s "
-                                             "AND e.networkID=%s", values=(node, network), fetch=True))
+            partners = self.prepared_query("SELECT target, weight FROM edges as e "
+                                           "WHERE e.source=%s "
+                                           "AND e.networkID=%s", values=(node, network), fetch=True)
+            partners.extend(self.prepared_query("SELECT source, weight FROM edges as e "
+                                                "WHERE e.target=%s "
+                                                "AND e.networkID=%s", values=(node, network), fetch=True))
             # delete old edges
             for partner in partners:
                 del_query = "DELETE FROM edges WHERE networkID=%s " \
                             "AND source=%s AND target=%s"
-                self.value_query(del_query, values=(network, node, partner[0]))
-                self.value_query(del_query, values=(network, partner[0], node))
+                self._write_query(del_query, values=(network, node, partner[0]))
+                self._write_query(del_query, values=(network, partner[0], node))
+                # edges between merged nodes become self-loops of the new node,
+                # otherwise the old node stays in the network
+                target = new if partner[0] in nodes else partner[0]
                 # add new edges if edge does not exist yet
-                check = self.value_query("SELECT weight FROM edges as e "
-                                         "WHERE e.networkid=%s AND e.source=%s "
-                                         "AND e.target=%s AND e.weight=%s",
-                                         values=(network, new, partner[0], partner[1]), fetch=True)
+                check = self.prepared_query("SELECT weight FROM edges as e "
+                                            "WHERE e.networkid=%s AND e.source=%s "
+                                            "AND e.target=%s AND e.weight=%s",
+                                            values=(network, new, target, partner[1]), fetch=True)
                 if len(check) == 0:
-                    self.value_query("INSERT INTO edges (networkID, source, target, weight) "
-                                     "VALUES (%s,%s,%s,%s)",
-                                     values=(network, new, partner[0], partner[1]))
+                    self._write_query("INSERT INTO edges (networkID, source, target, weight) "
+                                      "VALUES (%s,%s,%s,%s)",
+                                      values=(network, new, target, partner[1]))
 
     def create_agglom(self, parent, level):
         """
@@ -372,15 +419,88 @@ class MetaConnection(ParentConnection):
         uid = str(uuid4())
         tax_levels = ['Kingdom', 'Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species']
         tax_id = tax_levels.index(level)
-        tax = list(self.value_query("SELECT * FROM taxonomy WHERE taxon=%s",
-                               values=(parent,), fetch=True)[0])
+        tax = list(self.prepared_query("SELECT * FROM taxonomy WHERE taxon=%s",
+                                       values=(parent,), fetch=True)[0])
         tax = tuple(tax[1:(3+tax_id)])
         tax = (uid, ) + tax
         while len(tax) < 9:
             tax += (None, )
         tax_query = 'INSERT INTO taxonomy (taxon,studyID,Kingdom,Phylum,Class,"Order",Family,Genus,Species) ' \
                     'VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)'
-        self.value_query(tax_query, tax)
+        self._write_query(tax_query, tax)
         return uid
 
+    def _write_query(self, query, values):
+        """
+        Runs a query that changes the edges or taxonomy table.
+        These queries are repeated for every pair,
+        so they are sent as prepared statements.
+        If an analytic mirror is attached, the query is also run on the mirror,
+        so the mirror stays in sync during agglomeration.
+
+        :param query: String containing query
+        :param values: Tuple or list of values
+        :return:
+        """
+        self.prepared_query(query, values)
+        if self.analytic:
+            self.analytic.value_query(query, values)
+
+
+def _agglomerated_name(level, network, networks):
+    """
+    Returns the name of the network that a network is agglomerated to.
+
+    :param level: Taxonomic level
+    :param network: Name of network
+    :param networks: List of networks, or dict with agglomerated networks as values
+    :return: Name of agglomerated network
+    """
+    if type(networks) == list:
+        return level + '_' + network
+    return level + '_' + '_'.join(network.split('_')[1:])
+
+
+def _pair_query(level, weight):
+    """
+    Returns the pair query for the analytic mirror.
+    Instead of writing reversed edges to a scratch table,
+    the edges are reversed in a common table expression.
+    The sources and targets are aggregated in the same order,
+    so they can be matched up afterwards.
+
+    :param level: Taxonomic level to identify a pair
+    :param weight: If True, edges are grouped by the sign of the weight
+    :return: Query with two placeholders for the network name
+    """
+    sign = ", SIGN(e.weight)" if weight else ""
+    return "WITH copy AS (" \
+           "SELECT source, target, weight FROM edges WHERE networkID = %s " \
+           "UNION ALL SELECT target, source, weight FROM edges WHERE networkID = %s) " \
+           "SELECT string_agg(e.source, ',' ORDER BY e.source, e.target), " \
+           "string_agg(e.target, ',' ORDER BY e.source, e.target), " \
+           "p." + level + " as source, q." + level + " as target" + sign + " FROM copy as e " \
+           "JOIN taxonomy as p ON e.source = p.taxon " \
+           "JOIN taxonomy as q on e.target = q.taxon " \
+           "WHERE p." + level + " IS NOT NULL AND q." + level + " IS NOT NULL " \
+           "AND p." + level + " != q." + level + " " \
+           "GROUP BY p." + level + ", q." + level + sign + \
+           " HAVING COUNT(*) > 1 LIMIT 1;"
+
+
+def _taxon_query(level):
+    """
+    Returns the query for taxa with the same assignment for the analytic mirror.
+
+    :param level: Taxonomic level to merge to
+    :return: Query with two placeholders for the network name
+    """
+    return "SELECT string_agg(e.source, ',') " \
+           "FROM (SELECT source FROM edges WHERE networkID = %s " \
+           "UNION SELECT target FROM edges WHERE networkID = %s) as e " \
+           "JOIN taxonomy as p ON e.source = p.taxon " \
+           "WHERE p." + level + " IS NOT NULL " \
+           "GROUP BY p." + level + \
+           " HAVING COUNT(*) > 1 LIMIT 1;"
+
 
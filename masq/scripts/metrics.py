@@ -0,0 +1,277 @@
+"""
+This file contains counters for monitoring long-running masq jobs.
+When metrics are started, the connection classes count
+the rows written to each table and the time spent writing them,
+the files and bytes that are imported, the number of queries,
+the time spent waiting for database connections
+and the number of agglomeration iterations per network.
+The counters can be written as a Prometheus textfile,
+which the textfile collector of the node exporter can scrape,
+or appended to a JSON-lines file.
+If a file is given when the metrics are started,
+it is rewritten after every imported file, so running jobs can be followed.
+When no metrics are started, the connection classes only check
+a single module variable.
+
+Example:
+
+    start_metrics(path='/var/lib/node_exporter/masq.prom')
+    import_biom('bioms/')
+    stop_metrics()
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import threading
+from time import perf_counter, time
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# metrics that the counters are added to, see start_metrics
+registry = None
+
+# descriptions of the counters, in the order they are exported
+_help = {'masq_rows_total': 'Rows written per table.',
+         'masq_write_seconds_total': 'Seconds spent writing rows per table.',
+         'masq_rows_per_second': 'Rows written per second of writing, per table.',
+         'masq_files_total': 'Files imported per file type.',
+         'masq_bytes_read_total': 'Bytes of imported files per file type.',
+         'masq_queries_total': 'Queries sent to the database.',
+         'masq_connection_wait_seconds_total': 'Seconds spent opening database connections.',
+         'masq_agglomeration_iterations_total': 'Agglomeration iterations per network and step.'}
+
+
+class Metrics:
+    """
+    Collects counters with labels.
+    """
+    def __init__(self, path=None, format='prometheus'):
+        """
+        :param path: File that the metrics are exported to by export, optional
+        :param format: Export format, prometheus or jsonl
+        """
+        if format not in ('prometheus', 'jsonl'):
+            raise ValueError("Metrics can only be exported as prometheus or jsonl.")
+        self.path = path
+        self.format = format
+        self.counters = dict()
+        self.lock = threading.Lock()
+        # threads that export after each file share the temporary file
+        self.write_lock = threading.Lock()
+
+    def add(self, name, value=1, **labels):
+        """
+        Adds a value to a counter.
+
+        :param name: Name of counter
+        :param value: Value to add
+        :param labels: Labels of the counter, e.g. table='edges'
+        :return:
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, name, **labels):
+        """
+        Returns the value of a counter.
+
+        :param name: Name of counter
+        :param labels: Labels of the counter
+        :return: Value, 0 if the counter was never added to
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def samples(self):
+        """
+        Returns all counters, with rows per second calculated for each table.
+
+        :return: List of tuples with name, dictionary of labels and value
+        """
+        with self.lock:
+            counters = dict(self.counters)
+        for (name, labels), value in list(counters.items()):
+            if name == 'masq_rows_total':
+                seconds = counters.get(('masq_write_seconds_total', labels), 0)
+                if seconds:
+                    counters[('masq_rows_per_second', labels)] = value / seconds
+        order = list(_help)
+        return [(name, dict(labels), counters[(name, labels)]) for name, labels
+                in sorted(counters, key=lambda x: (order.index(x[0]) if x[0] in order else len(order), x))]
+
+    def to_prometheus(self):
+        """
+        Formats the counters in the Prometheus text format.
+
+        :return: String
+        """
+        lines = list()
+        name = None
+        for sample_name, labels, value in self.samples():
+            if sample_name != name:
+                name = sample_name
+                metric_type = 'gauge' if name == 'masq_rows_per_second' else 'counter'
+                lines.append("# HELP " + name + " " + _help.get(name, name))
+                lines.append("# TYPE " + name + " " + metric_type)
+            label_text = ",".join(x + '="' + _escape_label(str(labels[x])) + '"' for x in labels)
+            lines.append(name + ("{" + label_text + "}" if label_text else "") + " " + repr(float(value)))
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        """
+        Formats the counters as a single JSON line with a timestamp.
+
+        :return: String
+        """
+        return json.dumps({'timestamp': time(),
+                           'metrics': [{'name': name, 'labels': labels, 'value': value}
+                                       for name, labels, value in self.samples()]})
+
+    def write(self, path=None, format=None):
+        """
+        Writes the counters to a file.
+        Prometheus textfiles are replaced atomically, so a collector never reads half a file;
+        JSON lines are appended.
+
+        :param path: Location of file, by default the path the metrics were started with
+        :param format: Export format, prometheus or jsonl
+        :return:
+        """
+        path = path or self.path
+        format = format or self.format
+        with self.write_lock:
+            if format == 'prometheus':
+                temporary = path + '.' + str(os.getpid()) + '.tmp'
+                with open(temporary, 'w') as file:
+                    file.write(self.to_prometheus())
+                os.replace(temporary, path)
+            else:
+                with open(path, 'a') as file:
+                    file.write(self.to_json() + "\n")
+
+
+def start_metrics(path=None, format='prometheus'):
+    """
+    Starts counting in a new set of metrics.
+
+    :param path: File that the metrics are exported to after each imported file, optional
+    :param format: Export format, prometheus or jsonl
+    :return: Metrics object
+    """
+    global registry
+    registry = Metrics(path=path, format=format)
+    return registry
+
+
+def stop_metrics():
+    """
+    Stops counting, and exports the metrics if they were started with a file.
+
+    :return: Metrics object, or None if no metrics were started
+    """
+    global registry
+    stopped = registry
+    registry = None
+    if stopped and stopped.path:
+        stopped.write()
+    return stopped
+
+
+def add(name, value=1, **labels):
+    """
+    Adds a value to a counter of the running metrics.
+
+    :param name: Name of counter
+    :param value: Value to add
+    :param labels: Labels of the counter
+    :return:
+    """
+    if registry is not None:
+        registry.add(name, value, **labels)
+
+
+def add_file(filename, type):
+    """
+    Counts an imported file and its size.
+
+    :param filename: Location of file
+    :param type: File type, e.g. biom or network
+    :return:
+    """
+    if registry is not None:
+        registry.add('masq_files_total', 1, type=type)
+        registry.add('masq_bytes_read_total', os.path.getsize(filename), type=type)
+
+
+def export():
+    """
+    Exports the running metrics, if they were started with a file.
+
+    :return:
+    """
+    if registry is not None and registry.path:
+        registry.write()
+
+
+def _start():
+    """
+    Returns the start time of a measurement if metrics are running.
+
+    :return: Time in seconds or None
+    """
+    if registry is not None:
+        return perf_counter()
+
+
+def _rows(table, rows, start):
+    """
+    Counts rows written to a table and the time it took.
+
+    :param table: Name of table
+    :param rows: Tuple or list of rows
+    :param start: Start time returned by _start
+    :return:
+    """
+    if start is None or registry is None:
+        return
+    registry.add('masq_rows_total', len(rows) if type(rows) == list else 1, table=table)
+    registry.add('masq_write_seconds_total', perf_counter() - start, table=table)
+
+
+def _wait(start):
+    """
+    Counts a query and the time spent opening its connection.
+
+    :param start: Start time returned by _start
+    :return:
+    """
+    if start is None or registry is None:
+        return
+    registry.add('masq_queries_total')
+    registry.add('masq_connection_wait_seconds_total', perf_counter() - start)
+
+
+def _escape_label(value):
+    """
+    Escapes a label value for the Prometheus text format.
+
+    :param value: String
+    :return: Escaped string
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
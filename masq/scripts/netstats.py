@@ -11,9 +11,11 @@ __license__ = 'Apache 2.0'
 
 import sys
 import os
-import networkx as nx
 import logging.handlers
 from masq.scripts.utils import ParentConnection
+from masq.scripts import instrument
+from masq.scripts import tracing
+from masq.scripts.io import _network_writer
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -26,8 +28,10 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+@tracing.traced('extract_sets', set='set', networks='networks')
 def extract_sets(path, set, networks=None,
-                 size=None, weight=True,
+                 size=None, weight=True, format='graphml',
+                 analytic=False,
                  config='database.ini',
                  host=None, database=None,
                  username=None, password=None):
@@ -41,6 +45,8 @@ def extract_sets(path, set, networks=None,
 
     :param set: Type of set to extract
     :param networks: Networks to extract set from
+    :param format: File format of the set, graphml, gml or txt
+    :param analytic: If True, the set is computed on a DuckDB mirror of the edges table
     :param config: Location of file with database parameters.
     :param host: Database address.
     :param database: Name of PostgreSQL database.
@@ -48,22 +54,26 @@ def extract_sets(path, set, networks=None,
     :param password: Password of PostgreSQL database.
     :return:
     """
+    # rows are streamed to the file, without building a networkx object first;
+    # unsupported formats raise a ValueError before any query runs
+    writer = _network_writer(path + "//" + set + "." + format, network_attr='source')
     conn = SetConnection(config, host, database, username, password)
     if not networks:
         networks = conn.get_networks()
+    if analytic:
+        conn.attach_analytic(tables=['edges'])
     if set == 'intersection':
         if not size:
             size = 1
         elif size*len(networks) > len(networks):
             logger.error("Cannot extract intersection for more networks "
                          "than the number of networks in the database. ")
-        g = conn.get_intersection(networks, number=int((len(networks)*size)),
-                                  weight=weight)
+        conn.get_intersection(networks, number=int((len(networks)*size)),
+                              weight=weight, handler=writer)
     elif set == 'difference':
-        g = conn.get_difference(networks, weight=weight)
+        conn.get_difference(networks, weight=weight, handler=writer)
     elif set == 'union':
-        g = conn.get_union(networks)
-    nx.write_graphml(g, path + "//" + set + ".graphml")
+        conn.get_union(networks, handler=writer)
 
 
 class SetConnection(ParentConnection):
@@ -72,77 +82,126 @@ class SetConnection(ParentConnection):
     This connection object contains methods for converting NetworkX
     objects to rows in the summary network table
     and rows in the edges table.
+    If an analytic mirror is attached, the set queries run on the mirror.
     """
     # inherits init from parent
-    def get_intersection(self, networks, number, weight=True):
+    @tracing.traced('get_intersection', networks='networks')
+    def get_intersection(self, networks, number, weight=True, handler=None):
         """
         :param networks: List of networks to extract intersection from
         :param number: Number of networks where an edge has to occur
         :param weight: If true, an edge is counted separately if the sign of the weight is different
-        :return:
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
         """
-        # first, extract all edges that occur more than once
-        # these can have edges with different weight
-        if weight:
-            set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
-                        "source, target, SIGN(weight), COUNT(*) " \
-                        "FROM edges " \
-                        "WHERE networkID IN " + str(tuple(networks)) + \
-                        " GROUP BY source, target, SIGN(weight) " \
-                        "HAVING COUNT(*) > " + str(number-1)
-        else:
-            set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
-                        "source, target, string_agg(weight::varchar, ',') as weights, COUNT(*) " \
-                        "FROM edges " \
-                        "WHERE networkID IN " + str(tuple(networks)) + \
-                        " GROUP BY source, target " \
-                        "HAVING COUNT(*) > " + str(number-1)
-        set_result = self.query(set_query, fetch=True)
-        g = _convert_network(set_result)
+        set_query = _intersection_query(number, weight)
+        if not handler:
+            handler = _convert_network
+        set_result = (self.analytic or self).iter_query(set_query, values=(tuple(networks),))
+        with instrument.stage('get_intersection'):
+            g = handler(set_result)
         logger.info("Extracted intersection across " + str(number) + " networks...\n")
         return g
 
-    def get_difference(self, networks, weight=True):
+    @tracing.traced('get_difference', networks='networks')
+    def get_difference(self, networks, weight=True, handler=None):
         """
         :param networks: List of networks to extract intersection from
         :param weight: If true, an edge is counted separately if the sign of the weight is different
-        :return:
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
         """
-        if weight:
-            set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
-                        "source, target, SIGN(weight), COUNT(*) " \
-                        "FROM edges " \
-                        "WHERE networkID IN " + str(tuple(networks)) + \
-                        " GROUP BY source, target, SIGN(weight) " \
-                        "HAVING COUNT(*) = 1 "
-        else:
-            set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
-                        "source, target, string_agg(weight::varchar, ',') as weights, COUNT(*) " \
-                        "FROM edges " \
-                        "WHERE networkID IN " + str(tuple(networks)) + \
-                        " GROUP BY source, target " \
-                        "HAVING COUNT(*) = 1 "
-        set_result = self.query(set_query, fetch=True)
-        g = _convert_network(set_result)
+        set_query = _difference_query(weight)
+        if not handler:
+            handler = _convert_network
+        set_result = (self.analytic or self).iter_query(set_query, values=(tuple(networks),))
+        with instrument.stage('get_difference'):
+            g = handler(set_result)
         logger.info("Extracted difference...\n")
         return g
 
-    def get_union(self, networks):
+    @tracing.traced('get_union', networks='networks')
+    def get_union(self, networks, handler=None):
         """
         :param network: NetworkX object
         :param name: Network name
         :param study: Study ID (needs to match a biom ID)
-        :return:
+        :param handler: Function that accepts an iterable of set rows, by default a graph builder
+        :return: Output of the handler
         """
+        set_query = _union_query()
+        if not handler:
+            handler = _convert_network
+        set_result = (self.analytic or self).iter_query(set_query, values=(tuple(networks),))
+        with instrument.stage('get_union'):
+            g = handler(set_result)
+        logger.info("Extracted union...\n")
+        return g
+
+
+def _intersection_query(number, weight):
+    """
+    Returns the query for edges that occur in at least a number of networks.
+
+    :param number: Number of networks where an edge has to occur
+    :param weight: If true, an edge is counted separately if the sign of the weight is different
+    :return: Query with a placeholder for the tuple of networks
+    """
+    # first, extract all edges that occur more than once
+    # these can have edges with different weight
+    if weight:
+        set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
+                    "source, target, SIGN(weight), COUNT(*) " \
+                    "FROM edges " \
+                    "WHERE networkID IN %s" \
+                    " GROUP BY source, target, SIGN(weight) " \
+                    "HAVING COUNT(*) > " + str(number-1)
+    else:
         set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
                     "source, target, string_agg(weight::varchar, ',') as weights, COUNT(*) " \
                     "FROM edges " \
-                    "WHERE networkID IN " + str(tuple(networks)) + \
-                    " GROUP BY source, target;"
-        set_result = self.query(set_query, fetch=True)
-        g = _convert_network(set_result)
-        logger.info("Extracted union...\n")
-        return g
+                    "WHERE networkID IN %s" \
+                    " GROUP BY source, target " \
+                    "HAVING COUNT(*) > " + str(number-1)
+    return set_query
+
+
+def _difference_query(weight):
+    """
+    Returns the query for edges that occur in only one network.
+
+    :param weight: If true, an edge is counted separately if the sign of the weight is different
+    :return: Query with a placeholder for the tuple of networks
+    """
+    if weight:
+        set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
+                    "source, target, SIGN(weight), COUNT(*) " \
+                    "FROM edges " \
+                    "WHERE networkID IN %s" \
+                    " GROUP BY source, target, SIGN(weight) " \
+                    "HAVING COUNT(*) = 1 "
+    else:
+        set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
+                    "source, target, string_agg(weight::varchar, ',') as weights, COUNT(*) " \
+                    "FROM edges " \
+                    "WHERE networkID IN %s" \
+                    " GROUP BY source, target " \
+                    "HAVING COUNT(*) = 1 "
+    return set_query
+
+
+def _union_query():
+    """
+    Returns the query for all edges in a set of networks.
+
+    :return: Query with a placeholder for the tuple of networks
+    """
+    set_query = "SELECT string_agg(networkID::varchar, ',') AS networks, " \
+                "source, target, string_agg(weight::varchar, ',') as weights, COUNT(*) " \
+                "FROM edges " \
+                "WHERE networkID IN %s" \
+                " GROUP BY source, target;"
+    return set_query
 
 
 def _convert_network(edge_list):
@@ -155,11 +214,11 @@ def _convert_network(edge_list):
 
     WARNING: networkx does not support edges with multiple weights.
     So the edge may be overwritten.
-    :param edge_list:
+    :param edge_list: Iterable of rows
     :return: Networkx graph
     """
+    import networkx as nx
     g = nx.Graph()
-    if len(edge_list) > 0:
-        for edge in edge_list:
-            g.add_edge(edge[1], edge[2], source=edge[0], weight=edge[3])
+    for edge in edge_list:
+        g.add_edge(edge[1], edge[2], source=edge[0], weight=edge[3])
     return g
\ No newline at end of file
@@ -0,0 +1,438 @@
+"""
+This file contains a long-running masq server.
+The server keeps a pool of warm database connections
+and runs import, export, set and agglomeration jobs
+that are submitted over HTTP, on a local port or a Unix socket.
+Jobs are queued and run concurrently by a fixed number of worker threads,
+so many small jobs only pay for Python startup, imports and connections once.
+The log messages of each job are collected as its progress,
+and a job fails if it raises an exception or logs an error.
+
+The HTTP API accepts and returns JSON:
+
+    POST /jobs          {"type": "import_biom", "params": {"location": "bioms/"}}
+    GET  /jobs          status of all jobs
+    GET  /jobs/<id>     status of a single job
+    GET  /status        number of workers and jobs per status
+
+The job types are defined in jobs.py.
+Jobs always run on the database of the server,
+so the params cannot contain connection parameters.
+On SQLite, jobs run one at a time, since all queries share a single connection.
+
+Example:
+
+    masq serve -c database.ini -p 8765 -w 4
+    curl -X POST localhost:8765/jobs -d '{"type": "import_biom", "params": {"location": "bioms/"}}'
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+from time import time
+from uuid import uuid4
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import logging.handlers
+from masq.scripts.utils import ParentConnection
+from masq.scripts.jobs import _check_job, _job_function, _JobLog
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class JobQueue:
+    """
+    Runs jobs on a pool of worker threads, and keeps track of their status.
+    """
+    def __init__(self, config='database.ini', host=None, database=None,
+                 username=None, password=None, workers=4, pool=None):
+        """
+        :param config: Location of file with database parameters.
+        :param host: Database address.
+        :param database: Name of PostgreSQL database.
+        :param username: Username for PostgreSQL database.
+        :param password: Password of PostgreSQL database.
+        :param workers: Number of jobs that run at the same time
+        :param pool: Number of warm PostgreSQL connections, by default twice the number of workers
+        """
+        self.connection = {'config': config, 'host': host, 'database': database,
+                           'username': username, 'password': password}
+        conn = ParentConnection(config, host, database, username, password)
+        self.backend = conn.backend
+        if self.backend.name == 'sqlite' and workers > 1:
+            logger.warning("SQLite databases share a single connection, so jobs run one at a time.")
+            workers = 1
+        self.workers = workers
+        if hasattr(self.backend, 'open_pool'):
+            self.backend.open_pool(pool or 2 * workers)
+        conn.get_version()
+        self.jobs = dict()
+        self.futures = dict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='masq_job')
+        # log messages of jobs are collected by the thread that runs them
+        self.handler = _JobLog()
+        logging.getLogger('masq').addHandler(self.handler)
+
+    def submit(self, type, params=None):
+        """
+        Adds a job to the queue.
+
+        :param type: Job type, one of the keys of jobs.job_types
+        :param params: Dictionary of parameters of the job function
+        :return: Dictionary with job status
+        """
+        params = _check_job(type, params)
+        job = {'id': uuid4().hex, 'type': type, 'params': params, 'status': 'queued',
+               'submitted': time(), 'started': None, 'finished': None,
+               'progress': None, 'messages': deque(maxlen=50), 'errors': list()}
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.futures[job['id']] = self.executor.submit(self._run, job)
+        logger.info("Queued " + type + " job " + job['id'] + ".")
+        return _job_status(job)
+
+    def _run(self, job):
+        """
+        Runs a job in a worker thread.
+
+        :param job: Job dictionary
+        :return:
+        """
+        thread = threading.get_ident()
+        with self.lock:
+            self.handler.jobs[thread] = job
+            job['status'] = 'running'
+            job['started'] = time()
+        try:
+            _job_function(job['type'])(**job['params'], **self.connection)
+        except Exception as e:
+            error = "Job " + job['id'] + " failed: " + str(e)
+            logger.error(error, exc_info=True)
+            # the job also fails if the log record does not reach the handler,
+            # e.g. when this module runs as __main__
+            with self.lock:
+                if error not in job['errors']:
+                    job['errors'].append(error)
+        with self.lock:
+            self.handler.jobs.pop(thread)
+            job['finished'] = time()
+            job['status'] = 'failed' if job['errors'] else 'done'
+        logger.info("Finished " + job['type'] + " job " + job['id'] + " with status " +
+                    job['status'] + ".")
+
+    def get(self, job_id):
+        """
+        Returns the status of a job.
+
+        :param job_id: ID of job
+        :return: Dictionary with job status, or None if the job does not exist
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return _job_status(job) if job else None
+
+    def list(self):
+        """
+        Returns the status of all jobs, in the order they were submitted.
+
+        :return: List of dictionaries with job status
+        """
+        with self.lock:
+            return [_job_status(job) for job in self.jobs.values()]
+
+    def status(self):
+        """
+        Returns the number of workers and the number of jobs per status.
+
+        :return: Dictionary
+        """
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+        return {'backend': self.backend.name, 'workers': self.workers, 'jobs': counts}
+
+    def wait(self, job_id, timeout=None):
+        """
+        Waits until a job is finished.
+
+        :param job_id: ID of job
+        :param timeout: Maximum number of seconds to wait
+        :return: Dictionary with job status
+        """
+        self.futures[job_id].result(timeout=timeout)
+        return self.get(job_id)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers, by default after finishing all queued jobs,
+        and closes the warm connections.
+
+        :param wait: If False, queued jobs that have not started are cancelled
+        :return:
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        logging.getLogger('masq').removeHandler(self.handler)
+        if hasattr(self.backend, 'close_pool'):
+            self.backend.close_pool()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles requests to the HTTP API of the job queue.
+    """
+    server_version = 'masq'
+
+    def do_GET(self):
+        queue = self.server.queue
+        if self.path == '/status':
+            self._reply(200, queue.status())
+        elif self.path == '/jobs':
+            self._reply(200, queue.list())
+        elif self.path.startswith('/jobs/'):
+            job = queue.get(self.path[len('/jobs/'):])
+            if job:
+                self._reply(200, job)
+            else:
+                self._reply(404, {'error': 'Job not found.'})
+        else:
+            self._reply(404, {'error': 'Unknown path.'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self._reply(404, {'error': 'Unknown path.'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job = self.server.queue.submit(body.get('type'), body.get('params'))
+        except (ValueError, TypeError, AttributeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(202, job)
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # clients of Unix sockets do not have an address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """
+    HTTP server on a Unix socket.
+    """
+    daemon_threads = True
+
+
+class _UnixConnection(HTTPConnection):
+    """
+    HTTP client connection to a Unix socket.
+    """
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def create_server(queue, host='localhost', port=8765, path=None):
+    """
+    Creates an HTTP server for a job queue,
+    on a local port or on a Unix socket.
+
+    :param queue: JobQueue object
+    :param host: Address to listen on
+    :param port: Port to listen on, 0 picks a free port
+    :param path: Location of Unix socket, used instead of the port if given
+    :return: Server object, call serve_forever to start handling requests
+    """
+    if path:
+        if os.path.exists(path):
+            os.remove(path)
+        server = _UnixHTTPServer(path, _RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.queue = queue
+    return server
+
+
+def serve(config='database.ini', host='localhost', port=8765, path=None,
+          workers=4, pool=None):
+    """
+    Runs the masq server until it is interrupted.
+    Jobs that are still queued when the server stops are finished first.
+
+    :param config: Location of file with database parameters.
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param path: Location of Unix socket, used instead of the port if given
+    :param workers: Number of jobs that run at the same time
+    :param pool: Number of warm PostgreSQL connections, by default twice the number of workers
+    :return:
+    """
+    queue = JobQueue(config, workers=workers, pool=pool)
+    server = create_server(queue, host=host, port=port, path=path)
+    logger.info("masq server listening on " + (path or host + ":" + str(server.server_address[1])) +
+                " with " + str(queue.workers) + " workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping masq server...")
+    finally:
+        server.server_close()
+        queue.shutdown()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def submit_job(url, type, **params):
+    """
+    Submits a job to a masq server.
+
+    :param url: Address of the server, e.g. http://localhost:8765, or the location of its Unix socket
+    :param type: Job type
+    :param params: Parameters of the job
+    :return: Dictionary with job status
+    """
+    return _request(url, 'POST', '/jobs', {'type': type, 'params': params})
+
+
+def get_job(url, job_id=None):
+    """
+    Returns the status of a job on a masq server, or of all jobs.
+
+    :param url: Address of the server, or the location of its Unix socket
+    :param job_id: ID of job
+    :return: Dictionary with job status, or list of dictionaries
+    """
+    return _request(url, 'GET', '/jobs/' + job_id if job_id else '/jobs')
+
+
+def _request(url, method, path, body=None):
+    """
+    Sends a request to a masq server and returns the JSON response.
+
+    :param url: Address of the server, or the location of its Unix socket
+    :param method: HTTP method
+    :param path: Path of the API
+    :param body: Object that is sent as JSON
+    :return: Decoded response
+    """
+    if url.startswith('http://'):
+        address = url[len('http://'):].rstrip('/')
+        conn = HTTPConnection(address)
+    else:
+        conn = _UnixConnection(url)
+    try:
+        data = json.dumps(body) if body is not None else None
+        conn.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status >= 400:
+        raise ValueError(result['error'])
+    return result
+
+
+def _job_status(job):
+    """
+    Returns a copy of a job that can be written as JSON.
+
+    :param job: Job dictionary
+    :return: Dictionary
+    """
+    status = dict(job)
+    status['messages'] = list(job['messages'])
+    status['errors'] = list(job['errors'])
+    end = job['finished'] or time()
+    status['seconds'] = end - job['started'] if job['started'] else None
+    return status
+
+
+serve_parser = argparse.ArgumentParser(description='masq server', prog='masq serve')
+serve_parser.add_argument('-c', '--config',
+                          dest='config',
+                          help='Config file with the database that jobs run on. ',
+                          default='database.ini',
+                          type=str)
+serve_parser.add_argument('-host', '--host',
+                          dest='host',
+                          help='Address to listen on. ',
+                          default='localhost',
+                          type=str)
+serve_parser.add_argument('-p', '--port',
+                          dest='port',
+                          help='Port to listen on. ',
+                          default=8765,
+                          type=int)
+serve_parser.add_argument('-s', '--socket',
+                          dest='socket',
+                          help='Unix socket to listen on instead of a port. ',
+                          default=None,
+                          type=str)
+serve_parser.add_argument('-w', '--workers',
+                          dest='workers',
+                          help='Number of jobs that run at the same time. ',
+                          default=4,
+                          type=int)
+serve_parser.add_argument('-pool', '--pool',
+                          dest='pool',
+                          help='Number of warm database connections, by default twice the number of workers. ',
+                          default=None,
+                          type=int)
+
+
+def serve_command(options):
+    """
+    Runs the server with the options of the serve parser.
+
+    :param options: Namespace from serve_parser
+    :return:
+    """
+    serve(config=options.config, host=options.host, port=options.port, path=options.socket,
+          workers=options.workers, pool=options.pool)
+
+
+serve_parser.set_defaults(func=serve_command)
+
+
+def main(args=None):
+    serve_command(serve_parser.parse_args(args))
+
+
+if __name__ == '__main__':
+    main()
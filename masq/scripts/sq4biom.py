@@ -21,9 +21,12 @@ __license__ = 'Apache 2.0'
 
 import os
 import sys
-import biom
+from array import array
 import logging.handlers
 from masq.scripts.utils import ParentConnection
+from masq.scripts import instrument
+from masq.scripts import metrics
+from masq.scripts import tracing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -36,10 +39,12 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+@tracing.traced('import_biom', location='location')
 def import_biom(location, mapping=None,
                 config='database.ini',
                 host=None, database=None,
-                username=None, password=None):
+                username=None, password=None,
+                bulk=False):
     """
     Can read a single BIOM file or all BIOM files in a folder.
     These are then imported into the sqlite database.
@@ -53,8 +58,10 @@ def import_biom(location, mapping=None,
     :param database: Name of PostgreSQL database.
     :param username: Username for PostgreSQL database.
     :param password: Password of PostgreSQL database.
+    :param bulk: If true, files are loaded through staging tables.
     :return:
     """
+    import biom
     conn = BiomConnection(config, host, database, username, password)
     if os.path.isdir(location):
         for y in os.listdir(location):
@@ -63,7 +70,9 @@ def import_biom(location, mapping=None,
                 name = y.split(".")[0]
                 if mapping:
                     name = mapping[name]
-                conn.add_biom(biomtab, name)
+                conn.add_biom(biomtab, name, bulk=bulk)
+                metrics.add_file(location + '/' + y, 'biom')
+                metrics.export()
             except TypeError:
                 logger.warning('Ignoring file with wrong format.', exc_info=True)
     else:
@@ -76,7 +85,9 @@ def import_biom(location, mapping=None,
         name = name.split(".")[0]
         if mapping:
             name = mapping[name]
-        conn.add_biom(biomtab, name)
+        conn.add_biom(biomtab, name, bulk=bulk)
+        metrics.add_file(location, 'biom')
+        metrics.export()
 
 
 class BiomConnection(ParentConnection):
@@ -87,77 +98,70 @@ class BiomConnection(ParentConnection):
     and rows in the edges table.
     """
     # inherits init from parent
-    def add_biom(self, biomfile, name):
+    @tracing.traced('add_biom', study='name', bulk='bulk')
+    def add_biom(self, biomfile, name, bulk=False):
         """
         Takes a networkx object and writes this to the sqlite3 database.
+        In bulk mode, all rows are loaded through staging tables
+        in a single transaction, so a failed import leaves the database untouched.
         :param biomfile: BIOM table
         :param name: BIOM table name
+        :param bulk: If true, rows are loaded through staging tables
         :return:
         """
-        values = (name, biomfile.shape[0], biomfile.shape[1])
-        self.add_summary(values)
-        taxa = biomfile.ids(axis='observation')
-        samples = biomfile.ids(axis='sample')
-        taxonomy_values = list()
-        sample_values = list()
-        meta_values = list()
-        obs_values = list()
-        for sample in samples:
-            values = list()
-            sample_values.append((sample, name))
-        for tax in taxa:
-            taxonomy = biomfile.metadata(id=tax, axis='observation')['taxonomy']
-            # do not upload assignment if only prefix is available
-            clean_tax = list()
-            for val in taxonomy:
-                if len(val.split('_')[-1]) == 0:
-                    clean_tax.append(None)
-                else:
-                    clean_tax.append(val)
-            values = [tax, name]
-            values.extend(clean_tax)
-            # last values may be removed if taxonomy is unavailable
-            while len(values) < 9:
-                values.append(None)
-            taxonomy_values.append(tuple(values))
-            data = biomfile.data(id=tax, axis='observation')
-            for sample in samples:
-                sample_data = biomfile.metadata(id=sample, axis='sample')
-                values = list()
-                if sample_data:
-                    for property in sample_data:
-                        value = [sample]
-                        value.append(name)
-                        value.append(property)
-                        if type(sample_data[property]) == float or type(sample_data[property]) == int:
-                            value.append(None)
-                            value.append(sample_data[property])
-                        else:
-                            value.append(sample_data[property])
-                            value.append(None)
-                        values.append(tuple(value))
-                    meta_values.extend(values)
-                count_index = biomfile.index(sample, axis='sample')
-                count = data[count_index]
-                values = name, tax, sample, count
-                obs_values.append(values)
-        self.add_taxon(taxonomy_values)
-        self.add_sample(sample_values)
-        self.add_meta(meta_values)
-        self.add_observation(obs_values)
-        logger.info("Uploaded BIOM data for " + name +".\n")
+        with self.lock(exclusive=[('study', name)]):
+            with instrument.stage('add_biom.rows', name):
+                summary_values, taxonomy_values, sample_values, \
+                    meta_values, obs_values = _biom_rows(biomfile, name)
+            tracing.set_attribute('taxa', len(taxonomy_values))
+            tracing.set_attribute('samples', len(sample_values))
+            if not bulk:
+                self.add_summary(summary_values)
+            if bulk:
+                with instrument.stage('add_biom.bulk', name):
+                    success = self.bulk_query([('bioms', ['studyID', 'tax_num', 'sample_num'], [summary_values]),
+                                               ('taxonomy', ['taxon', 'studyID', 'Kingdom', 'Phylum', 'Class',
+                                                             '"Order"', 'Family', 'Genus', 'Species'],
+                                                taxonomy_values),
+                                               ('samples', ['sampleID', 'studyID'], sample_values),
+                                               ('meta', ['sampleID', 'studyID', 'property',
+                                                         'textvalue', 'numvalue'], meta_values),
+                                               ('counts', ['studyID', 'taxon', 'sampleID', 'count'], obs_values)])
+                if not success:
+                    logger.error("Could not upload BIOM data for " + name + ".\n")
+                    return
+            else:
+                with instrument.stage('add_biom.taxonomy', name):
+                    self.add_taxon(taxonomy_values)
+                with instrument.stage('add_biom.samples', name):
+                    self.add_sample(sample_values)
+                with instrument.stage('add_biom.meta', name):
+                    self.add_meta(meta_values)
+                with instrument.stage('add_biom.counts', name):
+                    self.add_observation(obs_values)
+            logger.info("Uploaded BIOM data for " + name +".\n")
 
+    @tracing.traced('add_summary', rows='values')
     def add_summary(self, values):
         """
         Adds rows to the bioms table in the PostgreSQL database.
+        If the counts table is list-partitioned,
+        a partition is created for each study.
 
         :param values: List of tuples for bioms table
         :return:
         """
         biom_query = "INSERT INTO bioms (studyID,tax_num,sample_num) " \
                        "VALUES (%s,%s,%s)"
+        start = metrics._start()
         self.value_query(biom_query, values)
+        metrics._rows('bioms', values, start)
+        if type(values) == tuple:
+            values = [values]
+        for value in values:
+            self.add_partition('counts', value[0])
 
+    @tracing.traced('add_taxon', rows='values')
     def add_taxon(self, values):
         """
         Adds taxonomy rows to the taxonomy table in the PostgreSQL database.
@@ -167,8 +171,11 @@ class BiomConnection(ParentConnection):
         """
         tax_query = 'INSERT INTO taxonomy (taxon,studyID,Kingdom,Phylum,Class,"Order",Family,Genus,Species) ' \
                     'VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)'
+        start = metrics._start()
         self.value_query(tax_query, values)
+        metrics._rows('taxonomy', values, start)
 
+    @tracing.traced('add_sample', rows='values')
     def add_sample(self, values):
         """
         Adds rows to the sample table in the PostgreSQL database.
@@ -178,8 +185,11 @@ class BiomConnection(ParentConnection):
         """
         sample_query = "INSERT INTO samples (sampleID, studyID) " \
                        "VALUES (%s,%s)"
+        start = metrics._start()
         self.value_query(sample_query, values)
+        metrics._rows('samples', values, start)
 
+    @tracing.traced('add_meta', rows='values')
     def add_meta(self, values):
         """
         Adds rows to the meta table in the PostgreSQL database.
@@ -189,8 +199,11 @@ class BiomConnection(ParentConnection):
         """
         sample_query = "INSERT INTO meta (sampleID, studyID, property, textvalue, numvalue) " \
                        "VALUES (%s,%s,%s,%s,%s)"
+        start = metrics._start()
         self.value_query(sample_query, values)
+        metrics._rows('meta', values, start)
 
+    @tracing.traced('add_observation', rows='values')
     def add_observation(self, values):
         """
         Adds rows to the counts table in the PostgreSQL database.
@@ -200,4 +213,237 @@ class BiomConnection(ParentConnection):
         """
         counts_query = "INSERT INTO counts (studyID,taxon,sampleID,count) " \
                        "VALUES (%s,%s,%s,%s)"
+        start = metrics._start()
         self.value_query(counts_query, values)
+        metrics._rows('counts', values, start)
+
+    def get_counts(self, study, taxa=None, samples=None):
+        """
+        Returns the count matrix of a study as a sparse matrix,
+        with taxa as rows and samples as columns, as in a BIOM file.
+        Only non-zero counts are streamed from the database with COPY TO,
+        and the taxon and sample filters are applied by the database.
+        Taxon and sample IDs are sorted alphabetically.
+
+        :param study: Study ID
+        :param taxa: Optional list of taxa to include
+        :param samples: Optional list of samples to include
+        :return: Tuple of CSR matrix, array of taxon IDs and array of sample IDs
+        """
+        import numpy as np
+        taxon_filter = ""
+        sample_filter = ""
+        taxon_values = (study,)
+        sample_values = (study,)
+        if taxa:
+            taxon_filter = " AND taxon IN %s"
+            taxon_values += (tuple(taxa),)
+        if samples:
+            sample_filter = " AND sampleID IN %s"
+            sample_values += (tuple(samples),)
+        values = taxon_values + sample_values[1:]
+        taxon_ids = self.value_query("SELECT DISTINCT taxon FROM counts "
+                                     "WHERE studyID=%s" + taxon_filter +
+                                     " ORDER BY taxon;",
+                                     values=taxon_values, fetch=True)
+        sample_ids = self.value_query("SELECT sampleID FROM samples "
+                                      "WHERE studyID=%s" + sample_filter +
+                                      " ORDER BY sampleID;",
+                                      values=sample_values, fetch=True)
+        taxon_ids = [x[0] for x in taxon_ids]
+        sample_ids = [x[0] for x in sample_ids]
+        stream = _CountStream(taxon_ids, sample_ids)
+        self.copy_query("SELECT taxon, sampleID, count FROM counts "
+                        "WHERE studyID=%s" + taxon_filter + sample_filter +
+                        " AND count <> 0", file=stream, values=values)
+        matrix = stream.to_matrix()
+        return matrix, np.array(taxon_ids, dtype=str), np.array(sample_ids, dtype=str)
+
+    def export_biom(self, study, path):
+        """
+        Rebuilds the BIOM table of a study from the database,
+        and writes it to an HDF5 BIOM file.
+        The counts are streamed from the database with get_counts,
+        the taxonomy is taken from the taxonomy table
+        and the sample metadata from the meta table.
+        Taxonomic levels that were not assigned are written
+        as prefixes only (e.g. s__), as in the original files.
+
+        :param study: Study ID
+        :param path: Filename of the new BIOM file
+        :return: BIOM table
+        """
+        import biom
+        from biom.util import biom_open
+        matrix, taxa, samples = self.get_counts(study)
+        prefixes = ['k__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__']
+        taxonomy = dict()
+        tax_query = 'SELECT taxon,Kingdom,Phylum,Class,"Order",Family,Genus,Species ' \
+                    'FROM taxonomy WHERE studyID=%s;'
+        for row in self.iter_query(tax_query, values=(study,)):
+            taxonomy[row[0]] = [prefixes[i] if row[i + 1] is None else row[i + 1]
+                                for i in range(len(prefixes))]
+        sample_data = {sample: dict() for sample in samples}
+        meta_query = "SELECT sampleID, property, textvalue, numvalue " \
+                     "FROM meta WHERE studyID=%s;"
+        for row in self.iter_query(meta_query, values=(study,)):
+            if row[0] in sample_data:
+                sample_data[row[0]][row[1]] = row[2] if row[3] is None else row[3]
+        biomtab = biom.Table(matrix, observation_ids=list(taxa), sample_ids=list(samples),
+                             observation_metadata=[{'taxonomy': taxonomy.get(x, prefixes)}
+                                                   for x in taxa],
+                             sample_metadata=[sample_data[x] for x in samples],
+                             table_id=study)
+        with biom_open(path, 'w') as file:
+            biomtab.to_hdf5(file, generated_by='masq')
+        logger.info("Exported BIOM data for " + study + ".\n")
+        return biomtab
+
+
+def _clean_taxonomy(metadata):
+    """
+    Cleans the taxonomy of all observations of a BIOM table at once.
+    The distinct lineages of the table are arranged as a matrix
+    with a column per taxonomic level, and all levels are cleaned in one pass:
+    levels that only consist of a prefix, e.g. s__, become None,
+    and missing levels are added as None.
+    Identical lineages share a single cleaned tuple,
+    which is only kept for the import of this table.
+
+    :param metadata: Observation metadata of a BIOM table, with a taxonomy for each observation
+    :return: List of tuples with at least 7 taxonomic levels
+    """
+    import numpy as np
+    lineages = [tuple(x['taxonomy']) for x in metadata]
+    distinct = list(dict.fromkeys(lineages))
+    width = max([7] + [len(x) for x in distinct])
+    levels = np.array([tuple('' if val is None else val for val in x) + ('',) * (width - len(x))
+                       for x in distinct], dtype=str).reshape(len(distinct), width)
+    # do not upload assignment if only prefix is available
+    empty = (levels == '') | np.char.endswith(levels, '_')
+    levels = levels.astype(object)
+    levels[empty] = None
+    # last values may be removed if taxonomy is unavailable
+    clean = {lineage: tuple(row[:max(7, len(lineage))]) for lineage, row in zip(distinct, levels)}
+    return [clean[x] for x in lineages]
+
+
+def _biom_rows(biomfile, name):
+    """
+    Converts a BIOM table to rows for the bioms, taxonomy,
+    samples, meta and counts tables.
+
+    :param biomfile: BIOM table
+    :param name: BIOM table name
+    :return: Tuple of summary row and lists of taxonomy, sample, meta and count rows
+    """
+    summary_values = (name, biomfile.shape[0], biomfile.shape[1])
+    taxa = biomfile.ids(axis='observation')
+    samples = biomfile.ids(axis='sample')
+    taxonomy_values = list()
+    sample_values = list()
+    meta_values = list()
+    obs_values = list()
+    for sample in samples:
+        values = list()
+        sample_values.append((sample, name))
+    lineages = _clean_taxonomy(biomfile.metadata(axis='observation')) if len(taxa) else list()
+    for tax, lineage in zip(taxa, lineages):
+        taxonomy_values.append((tax, name) + lineage)
+        data = biomfile.data(id=tax, axis='observation')
+        for sample in samples:
+            sample_data = biomfile.metadata(id=sample, axis='sample')
+            values = list()
+            if sample_data:
+                for property in sample_data:
+                    value = [sample]
+                    value.append(name)
+                    value.append(property)
+                    if type(sample_data[property]) == float or type(sample_data[property]) == int:
+                        value.append(None)
+                        value.append(sample_data[property])
+                    else:
+                        value.append(sample_data[property])
+                        value.append(None)
+                    values.append(tuple(value))
+                meta_values.extend(values)
+            count_index = biomfile.index(sample, axis='sample')
+            count = data[count_index]
+            values = name, tax, sample, count
+            obs_values.append(values)
+    return summary_values, taxonomy_values, sample_values, meta_values, obs_values
+
+
+class _CountStream:
+    """
+    File-like object that parses the output of COPY TO
+    for the counts table while it is being streamed,
+    and collects the counts as coordinates of a sparse matrix.
+    """
+    def __init__(self, taxa, samples):
+        """
+        :param taxa: List of taxon IDs in row order
+        :param samples: List of sample IDs in column order
+        """
+        self.taxa = {taxon: i for i, taxon in enumerate(taxa)}
+        self.samples = {sample: i for i, sample in enumerate(samples)}
+        self.rows = array('q')
+        self.cols = array('q')
+        self.data = array('d')
+        self.buffer = b''
+
+    def write(self, chunk):
+        """
+        Parses a chunk of the COPY output.
+        Chunks do not necessarily end on a line break,
+        so the last partial line is kept for the next chunk.
+
+        :param chunk: Bytes or string
+        :return:
+        """
+        if type(chunk) == str:
+            chunk = chunk.encode('utf-8')
+        lines = (self.buffer + chunk).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            taxon, sample, count = line.decode('utf-8').split('\t')
+            if '\\' in taxon or '\\' in sample:
+                taxon = _unescape_copy(taxon)
+                sample = _unescape_copy(sample)
+            self.rows.append(self.taxa[taxon])
+            self.cols.append(self.samples[sample])
+            self.data.append(float(count))
+
+    def to_matrix(self):
+        """
+        Converts the collected counts to a CSR matrix.
+
+        :return: CSR matrix
+        """
+        import numpy as np
+        from scipy import sparse
+        return sparse.coo_matrix((np.frombuffer(self.data, dtype=np.float64),
+                                  (np.frombuffer(self.rows, dtype=np.int64),
+                                   np.frombuffer(self.cols, dtype=np.int64))),
+                                 shape=(len(self.taxa), len(self.samples))).tocsr()
+
+
+def _unescape_copy(value):
+    """
+    Reverses the backslash escapes of the COPY text format.
+
+    :param value: Escaped string
+    :return: Unescaped string
+    """
+    escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r',
+               't': '\t', 'v': '\v', '\\': '\\'}
+    result = list()
+    i = 0
+    while i < len(value):
+        if value[i] == '\\' and i + 1 < len(value):
+            result.append(escapes.get(value[i + 1], value[i + 1]))
+            i += 2
+        else:
+            result.append(value[i])
+            i += 1
+    return ''.join(result)
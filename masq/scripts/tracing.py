@@ -0,0 +1,308 @@
+"""
+This file contains optional tracing of masq operations.
+When tracing is started, imports, set extraction and agglomeration
+are recorded as a tree of spans, e.g.
+import_biom > add_biom > add_taxon or agglomerate_networks > get_pairlist.
+Each span has a start and end time and attributes
+such as the network or study name and the number of rows it handled.
+Finished spans are passed to an exporter.
+Any object with an export(span) and a shutdown() method can be used as exporter;
+the FileExporter in this file appends spans as JSON lines to a local file,
+so no collector service is needed.
+When no tracing is started, traced functions only check
+a single module variable before calling the function.
+
+Example:
+
+    start_tracing(path='masq_trace.jsonl')
+    import_biom('bioms/')
+    stop_tracing()
+"""
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import inspect
+import threading
+from time import time_ns
+from functools import wraps
+from contextvars import ContextVar
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# handler to sys.stdout
+sh = logging.StreamHandler(sys.stdout)
+sh.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# tracer that spans are started with, see start_tracing
+tracer = None
+
+# span that is open in the current thread or task
+_current = ContextVar('masq_span', default=None)
+
+
+class Span:
+    """
+    Records the duration and attributes of a single operation.
+    Spans are context managers; the span is the parent of all spans
+    that are started while it is open.
+    """
+    def __init__(self, tracer, name, attributes):
+        """
+        :param tracer: Tracer that exports the span when it ends
+        :param name: Name of operation
+        :param attributes: Dictionary of attributes
+        """
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start = None
+        self.end = None
+        self.status = 'ok'
+        self.error = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.start = time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.status = 'error'
+            self.error = exc_type.__name__ + ": " + str(exc_value)
+        self.tracer.export(self)
+        return False
+
+    def set_attribute(self, key, value):
+        """
+        Sets an attribute of the span.
+        A rows attribute with a list of rows is stored as the number of rows.
+
+        :param key: Name of attribute
+        :param value: Value of attribute
+        :return:
+        """
+        self.attributes[key] = _count(value) if key == 'rows' else value
+
+    def to_dict(self):
+        """
+        Returns the span as a dictionary that can be written as JSON.
+
+        :return: Dictionary
+        """
+        return {'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent.span_id if self.parent else None,
+                'start_time': self.start, 'end_time': self.end,
+                'duration': (self.end - self.start) / 1e9,
+                'attributes': self.attributes,
+                'status': self.status, 'error': self.error}
+
+
+class _NullSpan:
+    """
+    Span that is returned when tracing is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_null = _NullSpan()
+
+
+class Tracer:
+    """
+    Starts spans and passes finished spans to an exporter.
+    """
+    def __init__(self, exporter):
+        """
+        :param exporter: Object with an export(span) and a shutdown() method
+        """
+        self.exporter = exporter
+
+    def span(self, name, **attributes):
+        """
+        Returns a new span, which starts when it is entered.
+
+        :param name: Name of operation
+        :param attributes: Attributes of the span; rows can be a list of rows
+        :return: Span object
+        """
+        if 'rows' in attributes:
+            attributes['rows'] = _count(attributes['rows'])
+        return Span(self, name, attributes)
+
+    def export(self, span):
+        """
+        Passes a finished span to the exporter.
+        Errors of the exporter are logged, so tracing never stops an import.
+
+        :param span: Span object
+        :return:
+        """
+        try:
+            self.exporter.export(span)
+        except Exception:
+            logger.warning("Could not export span " + span.name + ".", exc_info=True)
+
+
+class FileExporter:
+    """
+    Appends finished spans to a file, as one JSON object per line.
+    Child spans finish, and are therefore written, before their parents.
+    """
+    def __init__(self, path):
+        """
+        :param path: Location of file
+        """
+        self.path = path
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        """
+        Writes a span to the file.
+
+        :param span: Span object
+        :return:
+        """
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def shutdown(self):
+        """
+        Closes the file.
+
+        :return:
+        """
+        with self.lock:
+            self.file.close()
+
+
+def start_tracing(path=None, exporter=None):
+    """
+    Starts tracing masq operations.
+
+    :param path: File that spans are appended to, if no exporter is given
+    :param exporter: Object with an export(span) and a shutdown() method
+    :return: Tracer object
+    """
+    global tracer
+    if exporter is None:
+        if path is None:
+            raise ValueError("Tracing needs a file or an exporter.")
+        exporter = FileExporter(path)
+    tracer = Tracer(exporter)
+    return tracer
+
+
+def stop_tracing():
+    """
+    Stops tracing and shuts down the exporter.
+
+    :return: Tracer object, or None if no tracing was started
+    """
+    global tracer
+    stopped = tracer
+    tracer = None
+    if stopped:
+        stopped.exporter.shutdown()
+    return stopped
+
+
+def span(name, **attributes):
+    """
+    Returns a span for an operation,
+    or a span that does nothing if tracing is disabled.
+
+    :param name: Name of operation
+    :param attributes: Attributes of the span; rows can be a list of rows
+    :return: Span object
+    """
+    if tracer is None:
+        return _null
+    return tracer.span(name, **attributes)
+
+
+def set_attribute(key, value):
+    """
+    Sets an attribute of the span that is currently open.
+
+    :param key: Name of attribute
+    :param value: Value of attribute
+    :return:
+    """
+    if tracer is not None:
+        current = _current.get()
+        if current:
+            current.set_attribute(key, value)
+
+
+def traced(name, **attributes):
+    """
+    Decorator that records each call of a function as a span.
+    The attributes map attribute names to parameter names of the function,
+    e.g. traced('add_network', network='name') records the name parameter as network.
+    A rows attribute records the number of rows in the parameter.
+    Parameters are only looked up if tracing is enabled.
+
+    :param name: Name of operation
+    :param attributes: Attribute names with the parameter names that they record
+    :return: Decorator
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            values = {key: arguments.arguments[param] for key, param in attributes.items()}
+            with tracer.span(name, **values):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _count(rows):
+    """
+    Returns the number of rows in a list of row tuples,
+    where a single tuple is a single row.
+
+    :param rows: List of tuples, tuple or number
+    :return: Number of rows
+    """
+    if type(rows) == list:
+        return len(rows)
+    if type(rows) == tuple:
+        return 1
+    return rows
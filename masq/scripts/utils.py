@@ -1,6 +1,6 @@
 """
 This file contains a parent class for setting up a connection
-to a sqlite3 database,
+to a PostgreSQL or embedded SQLite database,
 and populating this database with tables that can contain count data,
 network data and (taxon and sample) metadata. """
 
@@ -10,11 +10,18 @@ __email__ = 'lisa.rottjers@kuleuven.be'
 __status__ = 'Development'
 __license__ = 'Apache 2.0'
 
-import psycopg2
 from configparser import ConfigParser
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from uuid import uuid4
 import sys
 import os
 import logging.handlers
+from masq.scripts.backends import backends
+from masq.scripts import instrument
+from masq.scripts import metrics
+from masq.scripts import tracing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -29,7 +36,8 @@ logger.addHandler(sh)
 
 def setup_database(config='database.ini', create=True,
                    host=None, database=None,
-                   username=None, password=None):
+                   username=None, password=None,
+                   partition=None):
     """
     Connects to PostgreSQL database,
     either via provided args (priority)
@@ -44,23 +52,82 @@ def setup_database(config='database.ini', create=True,
     :param database: Name of PostgreSQL database.
     :param username: Username for PostgreSQL database.
     :param password: Password of PostgreSQL database.
+    :param partition: Optional partition layout for the edges and counts tables, 'list' or 'hash'.
     :return:
     """
     conn = ParentConnection(config, host, database, username, password)
+    conn.get_version()
     if create:
-        conn.create_tables()
+        conn.create_tables(partition=partition)
     else:
         conn.delete_tables()
 
 
+def read_config(config='database.ini',
+                host=None, database=None,
+                username=None, password=None,
+                backend=None):
+    """
+    Reads the database parameters from a config file.
+    Parameters that are given directly replace those in the file.
+    If no backend is specified, the backend is sqlite
+    when the file has a [sqlite] section, and postgresql otherwise.
+
+    :param config: Location of file with database parameters.
+    :param host: Database address.
+    :param database: Name of PostgreSQL database.
+    :param username: Username for PostgreSQL database.
+    :param password: Password of PostgreSQL database.
+    :param backend: Database backend, postgresql or sqlite.
+    :return: Dictionary of database parameters and name of backend
+    """
+    params = {'host': None,
+              'database': None,
+              'user': None,
+              'password': None}
+    new_params = {'host': host,
+                  'database': database,
+                  'user': username,
+                  'password': password}
+    if config:
+        parser = ConfigParser()
+        try:
+            if os.path.isfile(config):
+                parser.read(config)
+            else:
+                parser.read(os.getcwd() + "\\" + config)
+        except FileNotFoundError:
+            logger.warning("Could not read database config file.")
+            exit()
+        if not backend:
+            backend = 'sqlite' if parser.has_section('sqlite') else 'postgresql'
+        for param in parser.items(backend):
+            params[param[0]] = param[1]
+    for d in new_params:
+        if new_params[d]:
+            params[d] = new_params[d]
+    return params, backend or 'postgresql'
+
+
 class ParentConnection:
+    # maximum number of prepared statements per connection object
+    statement_cache_size = 64
+    # namespaces of advisory locks, see lock
+    lock_spaces = {'study': 1, 'network': 2, 'scratch': 3}
+
     def __init__(self, config='database.ini',
                  host=None, database=None,
-                 username=None, password=None):
+                 username=None, password=None,
+                 backend=None):
         """
         Initialzes a driver for accessing the PostgreSQL database.
         The driver can either read in a config file,
         or accept parameters directly.
+        By default, the driver connects to PostgreSQL.
+        If the config file has a [sqlite] section instead of a [postgresql] section,
+        or the backend is set to sqlite, an embedded SQLite database is used;
+        the database parameter is then the filename of the database.
+        No connection is opened until the first query is run.
 
         Config adapted from: https://www.postgresqltutorial.com/postgresql-python/connect/
 
@@ -69,43 +136,56 @@ class ParentConnection:
         :param database: Name of PostgreSQL database.
         :param username: Username for PostgreSQL database.
         :param password: Password of PostgreSQL database.
+        :param backend: Database backend, postgresql or sqlite.
+        """
+        # DuckDB mirror for analytic queries, see attach_analytic
+        self.analytic = None
+        # connection kept open for prepared statements, see prepared_query
+        self.session = None
+        self.statements = OrderedDict()
+        # advisory locks held by this object, see lock
+        self.locks = set()
+        # partition layouts of tables, see get_partition_layout
+        self.layouts = dict()
+        self.config, backend = read_config(config, host, database,
+                                           username, password, backend)
+        self.backend = backends[backend](self.config)
+
+    def _connect(self):
+        """
+        Opens a connection with the backend.
+        If metrics are running, the connection is counted as a query,
+        together with the time it took to open it.
+
+        :return: Connection
+        """
+        start = metrics._start()
+        conn = self.backend.connect()
+        metrics._wait(start)
+        return conn
+
+    def get_version(self):
+        """
+        Connects to the database and logs its version.
+
+        :return: Version string, or None if the database could not be reached
         """
         conn = None
-        self.config = {'host': None,
-                       'database': None,
-                       'user': None,
-                       'password': None}
-        new_params = {'host': host,
-                       'database': database,
-                       'user': username,
-                       'password': password}
-        if config:
-            parser = ConfigParser()
-            try:
-                if os.path.isfile(config):
-                    parser.read(config)
-                else:
-                    parser.read(os.getcwd() + "\\" + config)
-            except FileNotFoundError:
-                logger.warning("Could not read database config file.")
-                exit()
-            params = parser.items('postgresql')
-            for param in params:
-                self.config[param[0]] = param[1]
-        for d in new_params:
-            if new_params[d]:
-                self.config[d] = new_params[d]
+        db_version = None
         try:
-            logger.info("Connecting to the PostgreSQL database...")
-            conn = psycopg2.connect(**self.config)
+            logger.info("Connecting to the " + self.backend.label + " database...")
+            conn = self._connect()
             cur = conn.cursor()
-            cur.execute("SELECT version()")
-            db_version = cur.fetchone()
-            logger.info("Running PostgreSQL version " + db_version[0])
+            cur.execute(self.backend.version_query)
+            db_version = cur.fetchone()[0]
+            logger.info("Running " + self.backend.label + " version " + db_version)
             cur.close()
-        except psycopg2.DatabaseError as e:
+        except self.backend.Error as e:
             logger.warning(e)
-        conn.close()
+        finally:
+            if conn:
+                self.backend.release(conn)
+        return db_version
 
     def query(self, query, fetch=False):
         """
@@ -116,18 +196,24 @@ class ParentConnection:
         :param fetch: If set to true, fetches output
         :return:
         """
-        conn = psycopg2.connect(**self.config)
+        conn = self._connect()
         results = None
         try:
-            c = conn.cursor()
-            c.execute(query)
-            if fetch:
-                results = c.fetchall()
-        except psycopg2.Error as e:
-            logger.error(e)
-        conn.commit()
-        c.close()
-        conn.close()
+            query, values = self.backend.translate(query)
+            start = instrument._start()
+            try:
+                c = conn.cursor()
+                c.execute(query)
+                if fetch:
+                    results = c.fetchall()
+            except self.backend.Error as e:
+                logger.error(e)
+                conn.rollback()
+            instrument._record(query, start, c, results)
+            conn.commit()
+            c.close()
+        finally:
+            self.backend.release(conn)
         return results
 
     def value_query(self, query, values, fetch=False):
@@ -143,34 +229,346 @@ class ParentConnection:
         :param fetch: If set to true, fetches output
         :return: Last row ID
         """
-        conn = psycopg2.connect(**self.config)
+        conn = self._connect()
+        results = None
+        try:
+            query, values = self.backend.translate(query, values)
+            start = instrument._start()
+            if type(values) == tuple:
+                try:
+                    c = conn.cursor()
+                    c.execute(query, values)
+                except self.backend.Error as e:
+                    logger.error(e)
+                    conn.rollback()
+            elif type(values) == list:
+                try:
+                    c = conn.cursor()
+                    c.executemany(query, values)
+                except self.backend.Error as e:
+                    logger.error(e)
+                    conn.rollback()
+            else:
+                logger.warning("Values are not a tuple or list, so no query was executed.")
+            if fetch:
+                results = c.fetchall()
+            instrument._record(query, start, c, results)
+            conn.commit()
+            c.close()
+        finally:
+            self.backend.release(conn)
+        return results
+
+    def prepared_query(self, query, values, fetch=False):
+        """
+        Runs a query as a prepared statement.
+        The first time a query is used, it is prepared with PREPARE
+        on a connection that stays open,
+        so the server only parses and plans it once;
+        later calls only send EXECUTE with the values.
+        Prepared statements are cached per connection object,
+        and the least recently used statement is deallocated
+        when the cache holds more than statement_cache_size statements.
+        Backends without PREPARE run the query with value_query.
+
+        :param query: String containing query with %s placeholders
+        :param values: Tuple or list of values
+        :param fetch: If true, fetches results
+        :return: List of results, empty if the query failed
+        """
+        if not self.backend.prepared:
+            results = self.value_query(query, values, fetch)
+            return [] if fetch and results is None else results
+        if not self.session or self.session.closed:
+            self.session = self._connect()
+            self.statements.clear()
         results = None
-        if type(values) == tuple:
+        start = instrument._start()
+        metrics.add('masq_queries_total')
+        c = self.session.cursor()
+        try:
+            name = self._prepare(c, query)
+            execute = "EXECUTE " + name
+            number = query.count('%s')
+            if number:
+                execute += " (" + ",".join(['%s'] * number) + ")"
+            if type(values) == list:
+                c.executemany(execute, [x[:number] for x in values])
+            else:
+                c.execute(execute, values[:number] if values else None)
+            if fetch:
+                results = c.fetchall()
+            self.session.commit()
+        except self.backend.Error as e:
+            logger.error(e)
+            self.session.rollback()
+            # callers iterate over the results, so a failed query returns no rows
+            if fetch:
+                results = list()
+        instrument._record(query, start, c, results)
+        c.close()
+        return results
+
+    def _prepare(self, cursor, query):
+        """
+        Returns the name of the prepared statement for a query,
+        and prepares the statement if it is not in the cache yet.
+
+        :param cursor: Cursor of the session connection
+        :param query: String containing query with %s placeholders
+        :return: Name of prepared statement
+        """
+        if query in self.statements:
+            self.statements.move_to_end(query)
+            return self.statements[query]
+        name = "masq_" + md5(query.encode('utf-8')).hexdigest()[:16]
+        parts = query.split('%s')
+        statement = parts[0]
+        for i in range(1, len(parts)):
+            statement += '$' + str(i) + parts[i]
+        try:
+            cursor.execute("PREPARE " + name + " AS " + statement.rstrip().rstrip(';'))
+            self.session.commit()
+        except self.backend.Error:
+            # the statement does not exist, so it should not be executed later
+            self.statements.pop(query, None)
+            raise
+        self.statements[query] = name
+        while len(self.statements) > self.statement_cache_size:
+            old_query, old_name = self.statements.popitem(last=False)
+            cursor.execute("DEALLOCATE " + old_name)
+            self.session.commit()
+        return name
+
+    def close(self):
+        """
+        Closes the connection used for prepared statements.
+        The statements are deallocated first,
+        since a pooled connection is handed out again.
+        If that fails, the connection is closed instead of pooled.
+
+        :return:
+        """
+        if self.session:
             try:
-                c = conn.cursor()
-                c.execute(query, values)
-            except psycopg2.Error as e:
+                if not self.session.closed:
+                    # DEALLOCATE fails in an aborted transaction
+                    self.session.rollback()
+                    if self.statements:
+                        c = self.session.cursor()
+                        c.execute("DEALLOCATE ALL")
+                        self.session.commit()
+                        c.close()
+                self.backend.release(self.session)
+            except self.backend.Error as e:
                 logger.error(e)
-        elif type(values) == list:
+                self.session.close()
+        self.session = None
+        self.statements.clear()
+
+    @contextmanager
+    def lock(self, exclusive=(), shared=()):
+        """
+        Holds PostgreSQL advisory locks on studies, networks or scratch tables
+        while the block runs, so concurrent masq processes
+        that change the same resources wait for each other,
+        while processes that work on different resources run in parallel.
+        Shared locks only wait for exclusive locks,
+        e.g. a network import holds a shared lock on its study,
+        so the study cannot be imported again or deleted at the same time.
+        Resources are given as tuples of a namespace from lock_spaces and a name,
+        e.g. ('network', 'g1'), and are locked in a fixed order to prevent deadlocks;
+        nested locks should therefore only use later namespaces.
+        Locks that this object already holds are not taken again.
+        The locks are held by a separate connection,
+        and released when the block ends or the connection is lost.
+        Backends without advisory locks run the block without locking.
+
+        :param exclusive: List of tuples with namespace and name
+        :param shared: List of tuples with namespace and name
+        :return:
+        """
+        exclusive = set(exclusive)
+        keys = [(space, name, (space, name) not in exclusive) for space, name
+                in exclusive.union(shared) if name is not None and (space, name) not in self.locks]
+        if not self.backend.advisory_locks or not keys:
+            yield
+            return
+        keys.sort(key=lambda x: (self.lock_spaces[x[0]], x[1]))
+        conn = self._connect()
+        c = conn.cursor()
+        taken = list()
+        try:
+            for space, name, is_shared in keys:
+                function = "pg_advisory_lock_shared" if is_shared else "pg_advisory_lock"
+                c.execute("SELECT pg_try_" + function[3:] + "(%s, hashtext(%s));",
+                          (self.lock_spaces[space], name))
+                if not c.fetchone()[0]:
+                    logger.info("Waiting for lock on " + space + " " + name + "...")
+                    c.execute("SELECT " + function + "(%s, hashtext(%s));",
+                              (self.lock_spaces[space], name))
+                conn.commit()
+                taken.append((space, name, is_shared))
+                self.locks.add((space, name))
+            yield
+        finally:
+            for space, name, is_shared in reversed(taken):
+                self.locks.discard((space, name))
             try:
-                c = conn.cursor()
-                c.executemany(query, values)
-            except psycopg2.Error as e:
+                for space, name, is_shared in reversed(taken):
+                    function = "pg_advisory_unlock_shared" if is_shared else "pg_advisory_unlock"
+                    c.execute("SELECT " + function + "(%s, hashtext(%s));",
+                              (self.lock_spaces[space], name))
+                conn.commit()
+                c.close()
+                self.backend.release(conn)
+            except self.backend.Error as e:
+                # locks are released by the server when the connection closes
                 logger.error(e)
-        else:
-            logger.warning("Values are not a tuple or list, so no query was executed.")
-        if fetch:
-            results = c.fetchall()
-        conn.commit()
-        c.close()
-        conn.close()
-        return results
+                conn.close()
+
+    def iter_query(self, query, values=None, itersize=2000):
+        """
+        Accepts a query and yields the resulting rows one by one.
+        On PostgreSQL, the rows are fetched from a named server-side cursor,
+        in batches of itersize rows, so large results
+        are never completely loaded into memory.
+        The connection is closed once the generator is exhausted or discarded.
+
+        :param query: String containing query, optionally with %s placeholders
+        :param values: Tuple of values for the placeholders
+        :param itersize: Number of rows fetched per round trip
+        :return: Generator of row tuples
+        """
+        conn = self._connect()
+        query, values = self.backend.translate(query, values)
+        start = instrument._start()
+        rows = 0
+        try:
+            c = self.backend.stream_cursor(conn, itersize)
+            c.execute(query, values)
+            for row in c:
+                rows += 1
+                yield row
+            c.close()
+            instrument._record(query, start, returned=rows)
+        except self.backend.Error as e:
+            logger.error(e)
+        finally:
+            self.backend.release(conn)
+
+    def copy_query(self, query, file, values=None, size=65536, csv=False):
+        """
+        Streams the result of a query to a file-like object
+        with COPY TO STDOUT, in the default tab-separated text format
+        or as CSV.
+        This is the fastest way to get large results out of PostgreSQL,
+        since the rows are never converted to Python tuples.
+
+        :param query: String containing SELECT query, optionally with %s placeholders
+        :param file: Object with a write method that accepts chunks of the output
+        :param values: Tuple of values for the placeholders
+        :param size: Size of the chunks passed to the write method
+        :param csv: If True, rows are written as CSV, with NULL as an unquoted empty value
+        :return:
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            self.backend.copy_to(c, query, values, file, size, csv=csv)
+            c.close()
+        except self.backend.Error as e:
+            logger.error(e)
+        finally:
+            self.backend.release(conn)
+
+    def bulk_query(self, tables):
+        """
+        Bulk loads rows into several tables at once.
+        The rows are first copied into UNLOGGED staging tables
+        without indexes or foreign keys, so the intermediate rows are not written to the WAL.
+        On SQLite, temporary tables are used instead.
+        The staged rows are checked for primary key conflicts and then moved into
+        the live tables with a single INSERT ... SELECT per table.
+        All of this happens in one transaction,
+        so a failed import leaves the live tables untouched.
+        Afterwards, the live tables are analyzed so the query planner has fresh statistics.
+
+        :param tables: List of tuples with table name, column names and list of row tuples,
+        in the order that the tables should be filled.
+        :return: True if the rows were loaded, False otherwise
+        """
+        conn = self._connect()
+        c = conn.cursor()
+        success = False
+        try:
+            staged = list()
+            for table, columns, values in tables:
+                staging = "staging_" + table + "_" + uuid4().hex[:8]
+                start = metrics._start()
+                with tracing.span('bulk_load', table=table, rows=values):
+                    self.backend.create_staging(c, table, staging)
+                    self.backend.load_rows(c, staging, columns, values)
+                metrics._rows(table, values, start)
+                staged.append((table, columns, staging))
+            for table, columns, staging in staged:
+                if not _check_staging(self.backend, c, table, staging):
+                    raise self.backend.Error("Staged rows for " + table +
+                                             " conflict with existing rows.")
+                if table in ('edges', 'counts') and \
+                        self.backend.partition_layout(c, table) == 'list':
+                    key = 'networkID' if table == 'edges' else 'studyID'
+                    c.execute("SELECT DISTINCT " + key + " FROM " + staging + ";")
+                    for value in c.fetchall():
+                        c.execute(_partition_query(table, value[0]), (value[0],))
+                column_names = ",".join(columns)
+                c.execute("INSERT INTO " + table + " (" + column_names + ") "
+                          "SELECT " + column_names + " FROM " + staging + ";")
+                c.execute("DROP TABLE " + staging + ";")
+            conn.commit()
+            success = True
+        except self.backend.Error as e:
+            logger.error(e)
+            conn.rollback()
+        finally:
+            c.close()
+            self.backend.release(conn)
+        if success:
+            for table, columns, values in tables:
+                self.query("ANALYZE " + table + ";")
+        return success
 
-    def create_tables(self):
+    def create_tables(self, partition=None, partitions=8):
         """
         Adds the default data entities.
+        Optionally, the edges table is partitioned by networkID
+        and the counts table by studyID.
+        With a list layout, each network and each study gets its own partition,
+        so deleting a network is a partition drop
+        and queries filtered on networkID only scan the requested networks.
+        With a hash layout, rows are spread over a fixed number of partitions.
+
+        :param partition: Partition layout, either None, 'list' or 'hash'.
+        :param partitions: Number of partitions for the hash layout.
         :return:
         """
+        if partition == 'list':
+            edge_partition = " PARTITION BY LIST (networkID)"
+            count_partition = " PARTITION BY LIST (studyID)"
+        elif partition == 'hash':
+            edge_partition = " PARTITION BY HASH (networkID)"
+            count_partition = " PARTITION BY HASH (studyID)"
+        elif partition:
+            logger.warning("Partition layout " + partition + " is not supported,\n"
+                           "so tables are not partitioned.")
+            partition = None
+        if partition and not self.backend.partitioning:
+            logger.warning(self.backend.label + " does not support partitions,\n"
+                           "so tables are not partitioned.")
+            partition = None
+        if not partition:
+            edge_partition = ""
+            count_partition = ""
         biom_query = "CREATE TABLE IF NOT EXISTS bioms (" \
                      "studyID varchar PRIMARY KEY," \
                      "tax_num int," \
@@ -201,7 +599,7 @@ class ParentConnection:
                      "target varchar NOT NULL," \
                      "weight float," \
                      "FOREIGN KEY (networkID) REFERENCES networks(networkID) ON DELETE CASCADE" \
-                     ");"
+                     ")" + edge_partition + ";"
         # in the metadata table,
         # we actually need 2 tables:
         # one with unique meta id + study id,
@@ -232,19 +630,105 @@ class ParentConnection:
                        "FOREIGN KEY (SampleID) REFERENCES samples(sampleID)," \
                        "FOREIGN KEY (Taxon) REFERENCES taxonomy(Taxon)," \
                        "FOREIGN KEY (studyID) REFERENCES bioms(studyID) ON DELETE CASCADE" \
-                       ");"
-        for query in [biom_query, network_query, tax_query, edge_query,
-                      meta_id_query, meta_query, counts_query]:
+                       ")" + count_partition + ";"
+        queries = [biom_query, network_query, tax_query, edge_query,
+                   meta_id_query, meta_query, counts_query]
+        for table in ['edges', 'counts']:
+            if partition == 'list':
+                # rows without a dedicated partition end up in the default partition
+                queries.append("CREATE TABLE IF NOT EXISTS " + table + "_default "
+                               "PARTITION OF " + table + " DEFAULT;")
+            elif partition == 'hash':
+                for i in range(partitions):
+                    queries.append("CREATE TABLE IF NOT EXISTS " + table + "_" + str(i) +
+                                   " PARTITION OF " + table + " FOR VALUES WITH "
+                                   "(MODULUS " + str(partitions) + ", REMAINDER " + str(i) + ");")
+        # existing tables keep their layout, so it is looked up again
+        self.layouts.clear()
+        for query in queries:
             try:
                 self.query(query)
-            except psycopg2.Error as e:
+            except self.backend.Error as e:
                 logger.warning(e)
 
+    def get_partition_layout(self, table):
+        """
+        Checks whether a table is partitioned.
+        The layout is stored on the connection object,
+        so only the first lookup after create_tables queries the database.
+
+        :param table: Name of the table, e.g. edges or counts.
+        :return: 'list', 'hash' or None if the table is not partitioned
+        """
+        if table in self.layouts:
+            return self.layouts[table]
+        conn = self._connect()
+        c = conn.cursor()
+        layout = None
+        try:
+            layout = self.backend.partition_layout(c, table)
+            self.layouts[table] = layout
+            conn.commit()
+        except self.backend.Error as e:
+            logger.error(e)
+        finally:
+            c.close()
+            self.backend.release(conn)
+        return layout
+
+    def add_partition(self, table, value):
+        """
+        Creates the partition of a list-partitioned table
+        that holds the rows of a single network (edges) or study (counts).
+        If the table is not list-partitioned, nothing happens.
+
+        :param table: Name of the partitioned table, edges or counts.
+        :param value: Network or study name.
+        :return:
+        """
+        if self.get_partition_layout(table) != 'list':
+            return
+        self.value_query(_partition_query(table, value), values=(value,))
+
+    def delete_network(self, name):
+        """
+        Deletes a network and its edges.
+        If the edges table is list-partitioned,
+        the partition of the network is dropped instead of
+        deleting the edges from the complete table.
+
+        :param name: Network name
+        :return:
+        """
+        with self.lock(exclusive=[('network', name)]):
+            if self.get_partition_layout('edges') == 'list':
+                self.query("DROP TABLE IF EXISTS " + _partition_name('edges', name) + ";")
+            self.value_query("DELETE FROM networks WHERE networkID=%s;", values=(name,))
+
+    def delete_study(self, name):
+        """
+        Deletes a study, its counts and all networks that belong to it.
+        For list-partitioned tables, the partitions of the study
+        and its networks are dropped.
+
+        :param name: Study name
+        :return:
+        """
+        with self.lock(exclusive=[('study', name)]):
+            networks = self.value_query("SELECT networkID FROM networks WHERE studyID=%s;",
+                                        values=(name,), fetch=True)
+            for network in networks:
+                self.delete_network(network[0])
+            if self.get_partition_layout('counts') == 'list':
+                self.query("DROP TABLE IF EXISTS " + _partition_name('counts', name) + ";")
+            self.value_query("DELETE FROM bioms WHERE studyID=%s;", values=(name,))
+
     def delete_tables(self):
         """
         Deletes the tables created by the create_tables function.
         :return:
         """
+        self.layouts.clear()
         self.query("DROP TABLE counts;")
         self.query("DROP TABLE edges;")
         self.query("DROP TABLE meta;")
@@ -262,4 +746,75 @@ class ParentConnection:
         network_query = "SELECT networkID from networks;"
         networks = self.query(network_query, fetch=True)
         networks = [x[0] for x in networks]
-        return networks
\ No newline at end of file
+        return networks
+
+    def attach_analytic(self, path=None, tables=None):
+        """
+        Mirrors tables to an embedded DuckDB database.
+        Connection classes that support the mirror
+        then run their aggregating queries on it.
+        Call the refresh method of the mirror after changing the mirrored tables
+        through other connection objects.
+
+        :param path: Filename of DuckDB database, by default the mirror is kept in memory
+        :param tables: List of tables to mirror, by default edges, taxonomy and counts
+        :return: AnalyticConnection object
+        """
+        # imported here since the analytic module depends on this module
+        from masq.scripts.analytic import AnalyticConnection
+        self.analytic = AnalyticConnection(self, path=path, tables=tables)
+        return self.analytic
+
+
+def _partition_name(table, value):
+    """
+    Generates the name of a list partition.
+    Network and study names can contain characters
+    that are not valid in table names, so the name is hashed.
+
+    :param table: Name of the partitioned table
+    :param value: Network or study name
+    :return: Partition name
+    """
+    return table + '_' + md5(value.encode('utf-8')).hexdigest()[:16]
+
+
+def _partition_query(table, value):
+    """
+    Generates the query for creating a list partition.
+    The query expects the partition value as parameter.
+
+    :param table: Name of the partitioned table
+    :param value: Network or study name
+    :return: Query string
+    """
+    return "CREATE TABLE IF NOT EXISTS " + _partition_name(table, value) + \
+           " PARTITION OF " + table + " FOR VALUES IN (%s);"
+
+
+def _check_staging(backend, cursor, table, staging):
+    """
+    Checks whether the rows in a staging table can be moved to the live table
+    without violating its primary key,
+    either because the key is repeated in the staged rows
+    or because it is already present in the live table.
+
+    :param backend: Database backend
+    :param cursor: Database cursor
+    :param table: Name of live table
+    :param staging: Name of staging table
+    :return: True if there are no conflicts
+    """
+    keys = backend.primary_key(cursor, table)
+    if not keys:
+        return True
+    key = keys[0]
+    cursor.execute("SELECT " + key + " FROM " + staging + " GROUP BY " + key +
+                   " HAVING COUNT(*) > 1 LIMIT 1;")
+    if cursor.fetchall():
+        return False
+    cursor.execute("SELECT s." + key + " FROM " + staging + " AS s " +
+                   "JOIN " + table + " AS t ON s." + key + " = t." + key + " LIMIT 1;")
+    if cursor.fetchall():
+        return False
+    return True
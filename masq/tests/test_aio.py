@@ -0,0 +1,270 @@
+"""
+This file contains functions for testing the async connection classes
+in the aio.py file.
+
+The file first connects to a simple PostgreSQL database for carrying out the tests.
+This database is cleaned up after testing so it can be reused.
+
+The test database needs to be created first with the CREATE DATABASE command;
+this is not done in the testing environment.
+"""
+
+import unittest
+import asyncio
+import os
+import biom
+import psycopg2
+import networkx as nx
+from masq.scripts.utils import ParentConnection
+from masq.scripts.aio import AsyncBiomConnection, AsyncIoConnection, AsyncSetConnection
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+testraw = """{
+     "id":  "test",
+     "format": "Biological Observation Matrix 1.0.0-dev",
+     "format_url": "http://biom-format.org",
+     "type": "OTU table",
+     "generated_by": "QIIME revision XYZ",
+     "date": "2011-12-19T19:00:00",
+     "rows":[
+        {"id":"GG_OTU_1", "metadata":{"taxonomy":["k__Bacteria", "p__Proteoba\
+cteria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriac\
+eae", "g__Escherichia", "s__"]}},
+        {"id":"GG_OTU_2", "metadata":{"taxonomy":["k__Bacteria", "p__Cyanobact\
+eria", "c__Nostocophycideae", "o__Nostocales", "f__Nostocaceae", "g__Dolichosp\
+ermum", "s__"]}},
+        {"id":"GG_OTU_3", "metadata":{"taxonomy":["k__Archaea", "p__Euryarchae\
+ota", "c__Methanomicrobia", "o__Methanosarcinales", "f__Methanosarcinaceae", "\
+g__Methanosarcina", "s__"]}},
+        {"id":"GG_OTU_4", "metadata":{"taxonomy":["k__Bacteria", "p__Firmicute\
+s", "c__Clostridia", "o__Halanaerobiales", "f__Halanaerobiaceae", "g__Halanaer\
+obium", "s__Halanaerobiumsaccharolyticum"]}},
+        {"id":"GG_OTU_5", "metadata":{"taxonomy":["k__Bacteria", "p__Proteobac\
+teria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriace\
+ae", "g__Escherichia", "s__"]}}
+        ],
+     "columns":[
+        {"id":"Sample1", "metadata":{
+                                "BarcodeSequence":"CGCTTATCGAGA",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample2", "metadata":{
+                                "BarcodeSequence":"CATACCAGTAGC",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample3", "metadata":{
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample4", "metadata":{
+                                "BarcodeSequence":"CTCTCGGCCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample5", "metadata":{
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample6", "metadata":{
+                                "BarcodeSequence":"CTAACTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}}
+        ],
+     "matrix_type": "sparse",
+     "matrix_element_type": "int",
+     "shape": [5, 6],
+     "data":[[0,2,1],
+             [1,0,5],
+             [1,1,1],
+             [1,3,2],
+             [1,4,3],
+             [1,5,1],
+             [2,2,1],
+             [2,3,4],
+             [2,5,2],
+             [3,0,2],
+             [3,1,1],
+             [3,2,1],
+             [3,5,1],
+             [4,1,1],
+             [4,2,1]
+            ]
+    }
+"""
+
+testbiom = biom.parse.parse_biom_table(testraw)
+testdict = dict.fromkeys(testbiom._observation_ids)
+
+# make toy network
+g1 = nx.Graph()
+nodes = ["GG_OTU_1", "GG_OTU_2", "GG_OTU_3", "GG_OTU_4", "GG_OTU_5"]
+g1.add_nodes_from(nodes)
+g1.add_edges_from([("GG_OTU_1", "GG_OTU_2"),
+                  ("GG_OTU_2", "GG_OTU_5"), ("GG_OTU_3", "GG_OTU_4")])
+g1["GG_OTU_1"]["GG_OTU_2"]['weight'] = 1.0
+g1["GG_OTU_2"]["GG_OTU_5"]['weight'] = 1.0
+g1["GG_OTU_3"]["GG_OTU_4"]['weight'] = -1.0
+
+g2 = g1.copy(as_view = False)
+g2.remove_edge("GG_OTU_3", "GG_OTU_4")
+g2.add_edge("GG_OTU_3", "GG_OTU_5", weight=-1.0)
+
+# check for edge weight
+g2.edges[("GG_OTU_1", "GG_OTU_2")]['weight'] = -1.0
+g1.add_edge("GG_OTU_5", "GG_OTU_3", weight=1.0)
+
+
+@unittest.skipIf(psycopg is None, "psycopg is not installed")
+class TestAio(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests async connection methods.
+    Warning: most of these functions are to interact with a local database named test.
+    Therefore, the presence of the necessary local files is a prerequisite.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # The class setup creates a config file
+        # this config file refers to the local test database
+        # if your test database has different config, change here
+        config = "[postgresql]\n" \
+                 "host=localhost\n" \
+                 "database=test\n" \
+                 "user=test\n" \
+                 "password=test\n"
+        file = open("database.ini", "w")
+        file.write(config)
+        file.close()
+        # clear database before usage
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        tables = ['bioms', 'sample', 'networks', 'taxonomy', 'counts', 'edges', 'meta']
+        for tab in tables:
+            try:
+                cur.execute(("DROP TABLE " + tab + ";"))
+            except psycopg2.Error:
+                pass
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("database.ini")
+        # clear database after usage
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        tables = ['bioms', 'sample', 'networks', 'taxonomy', 'counts', 'edges', 'meta']
+        for tab in tables:
+            try:
+                cur.execute(("DROP TABLE " + tab + ";"))
+            except psycopg2.Error:
+                pass
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    async def test_add_biom(self):
+        """
+        Tests if the async BIOM upload writes the count table.
+        :return:
+        """
+        ParentConnection().create_tables()
+        async with AsyncBiomConnection() as conn_object:
+            await conn_object.add_biom(testbiom, 'test')
+            result = await conn_object.query("SELECT COUNT(*) FROM counts;", fetch=True)
+        ParentConnection().delete_tables()
+        self.assertEqual(result[0][0], 30)
+
+    async def test_add_network_concurrent(self):
+        """
+        Tests if several networks can be uploaded at the same time
+        to list-partitioned tables.
+        :return:
+        """
+        ParentConnection().create_tables(partition='list')
+        async with AsyncBiomConnection() as conn_object:
+            await conn_object.add_biom(testbiom, 'test')
+        async with AsyncIoConnection(max_size=4) as conn_object:
+            uploads = await asyncio.gather(*[conn_object.add_network(network=g1, name='g' + str(i),
+                                                                     study='test') for i in range(8)])
+            networks = await conn_object.get_networks()
+        ParentConnection().delete_tables()
+        self.assertTrue(all(uploads))
+        self.assertEqual(len(networks), 8)
+
+    async def test_export_network(self):
+        """
+        Tests if a network is exported as a networkx object,
+        if rows are passed to the handler in batches,
+        and if the export ends when the handler does not read all rows.
+        :return:
+        """
+        ParentConnection().create_tables()
+        async with AsyncBiomConnection() as conn_object:
+            await conn_object.add_biom(testbiom, 'test')
+        async with AsyncIoConnection() as conn_object:
+            await conn_object.add_network(network=g1, name='g1', study='test')
+            network = await conn_object.export_network('g1')
+            rows = await conn_object.export_network('g1', handler=list, itersize=1)
+            first = await conn_object.export_network('g1', handler=next, itersize=1)
+        ParentConnection().delete_tables()
+        self.assertEqual(len(network.edges), 4)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(first[0], 'g1')
+
+    async def test_get_sets(self):
+        """
+        Tests if set queries can run at the same time.
+        :return:
+        """
+        ParentConnection().create_tables()
+        async with AsyncBiomConnection() as conn_object:
+            await conn_object.add_biom(testbiom, 'test')
+        async with AsyncIoConnection() as conn_object:
+            await conn_object.add_network(network=g1, name='g1', study='test')
+            await conn_object.add_network(network=g2, name='g2', study='test')
+        async with AsyncSetConnection() as conn_object:
+            sets = await asyncio.gather(conn_object.get_intersection(networks=['g1', 'g2'], number=2),
+                                        conn_object.get_union(networks=['g1', 'g2'], handler=list))
+        ParentConnection().delete_tables()
+        self.assertEqual(len(sets[0].edges), 1)
+        self.assertEqual(len(sets[1]), 4)
+
+    async def test_iter_query(self):
+        """
+        Tests if rows are streamed from a server-side cursor.
+        :return:
+        """
+        ParentConnection().create_tables()
+        async with AsyncBiomConnection() as conn_object:
+            await conn_object.add_biom(testbiom, 'test')
+            rows = [row async for row in conn_object.iter_query("SELECT * FROM counts WHERE taxon IN %s;",
+                                                                values=(('GG_OTU_1', 'GG_OTU_2'),),
+                                                                itersize=5)]
+        ParentConnection().delete_tables()
+        self.assertEqual(len(rows), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
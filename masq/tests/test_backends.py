@@ -0,0 +1,445 @@
+"""
+This file contains functions for testing the backends in the backends.py file.
+
+The tests run the connection classes on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file is removed after testing.
+"""
+
+import unittest
+import os
+import shutil
+import threading
+import biom
+import networkx as nx
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend, _qmark
+from masq.scripts.sq4biom import BiomConnection
+from masq.scripts.io import IoConnection
+from masq.scripts.netstats import SetConnection
+from masq.scripts.metastats import MetaConnection, start_metastats
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+testraw = """{
+     "id":null,
+     "format": "Biological Observation Matrix 1.0.0-dev",
+     "format_url": "http://biom-format.org",
+     "type": "OTU table",
+     "generated_by": "QIIME revision XYZ",
+     "date": "2011-12-19T19:00:00",
+     "rows":[
+        {"id":"GG_OTU_1", "metadata":{"taxonomy":["k__Bacteria", "p__Proteoba\
+cteria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriac\
+eae", "g__Escherichia", "s__"]}},
+        {"id":"GG_OTU_2", "metadata":{"taxonomy":["k__Bacteria", "p__Cyanobact\
+eria", "c__Nostocophycideae", "o__Nostocales", "f__Nostocaceae", "g__Dolichosp\
+ermum", "s__"]}},
+        {"id":"GG_OTU_3", "metadata":{"taxonomy":["k__Bacteria", "p__Firmicute\
+s", "c__Clostridia", "o__Halanaerobiales", "f__Punk", "\
+g_Anthrax", "s__"]}},
+        {"id":"GG_OTU_4", "metadata":{"taxonomy":["k__Bacteria", "p__Firmicute\
+s", "c__Clostridia", "o__Halanaerobiales", "f__Punk", "g__NOFX", "s__"]}},
+        {"id":"GG_OTU_5", "metadata":{"taxonomy":["k__Bacteria", "p__Proteobac\
+teria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriace\
+ae", "g__Escherichia", "s__"]}}, 
+        {"id":"GG_OTU_6", "metadata":{"taxonomy":["k__Bacteria", "p__Firmicute\
+s", "c__Clostridia", "o__Halanaerobiales", "f__Punk", "g__Misfits", "s__"]}}\
+        ],
+     "columns":[
+        {"id":"Sample1", "metadata":{
+                                "pH":"2.0",
+                                "BarcodeSequence":"CGCTTATCGAGA",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample2", "metadata":{
+                                "pH":"1.8",       
+                                "BarcodeSequence":"CATACCAGTAGC",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample3", "metadata":{
+                                "pH":"2.3",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample4", "metadata":{
+                                "pH":"2.1",        
+                                "BarcodeSequence":"CGCTTATCGAGA",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample5", "metadata":{
+                                "pH":"2.0",        
+                                "BarcodeSequence":"CATACCAGTAGC",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample6", "metadata":{
+                                "pH":"2.1",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample7", "metadata":{
+                                "pH":"1.9",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample8", "metadata":{
+                                "pH":"1.9",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},    
+        {"id":"Sample9", "metadata":{
+                                "pH":"1.8",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample10", "metadata":{
+                                "pH":"2.1",        
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},                                    
+        {"id":"Sample11", "metadata":{
+                                "pH":"6.8",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample12", "metadata":{
+                                "pH":"6.9",        
+                                "BarcodeSequence":"CTAACTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample13", "metadata":{
+                                "pH":"7.1",        
+                                "BarcodeSequence":"CTCTCGGCCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample14", "metadata":{
+                                "pH":"7.0",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample15", "metadata":{
+                                "pH":"6.8",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample16", "metadata":{
+                                "pH":"6.9",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample17", "metadata":{
+                                "pH":"6.7",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},   
+        {"id":"Sample18", "metadata":{
+                                "pH":"7.2",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample19", "metadata":{
+                                "pH":"6.8",        
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},                                                                                                                         
+        {"id":"Sample20", "metadata":{
+                                "pH":"7.0",        
+                                "BarcodeSequence":"CTAACTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}}
+        ],
+     "matrix_type": "sparse",
+     "matrix_element_type": "int",
+     "shape": [5, 20],
+     "data":[[0,10,5],
+             [0,11,5],
+             [0,12,6],
+             [0,13,5],
+             [0,14,5],
+             [0,15,5],
+             [0,16,6],
+             [0,17,5],
+             [0,18,5],
+             [0,19,6],
+             [0,9,6],
+             [1,0,5],
+             [1,1,1],
+             [1,3,2],
+             [1,4,3],
+             [1,8,5],
+             [1,10,1],
+             [1,11,2],
+             [1,2,3],
+             [1,14,5],
+             [1,17,1],
+             [1,12,2],
+             [1,19,1],
+             [2,2,1],
+             [2,3,4],
+             [2,5,2],
+             [2,6,1],
+             [2,8,4],
+             [2,10,2],
+             [2,14,4],
+             [2,16,2],
+             [3,0,2],
+             [3,1,1],
+             [3,2,1],
+             [3,5,1],
+             [3,7,2],
+             [3,12,1],
+             [3,15,2],
+             [3,7,1],
+             [3,10,1],
+             [3,11,1],
+             [4,1,1],
+             [4,2,1],
+             [4,4,1],
+             [4,14,1],
+             [4,6,1]
+            ]
+    }
+"""
+
+testbiom = biom.parse.parse_biom_table(testraw)
+testdict = dict.fromkeys(testbiom._observation_ids)
+
+# make toy network
+g = nx.Graph()
+nodes = ["GG_OTU_1", "GG_OTU_2", "GG_OTU_3", "GG_OTU_4", "GG_OTU_5"]
+g.add_nodes_from(nodes)
+g.add_edges_from([("GG_OTU_1", "GG_OTU_3"),
+                  ("GG_OTU_2", "GG_OTU_5"), ("GG_OTU_4", "GG_OTU_5"),
+                  ("GG_OTU_2", "GG_OTU_6")])
+g["GG_OTU_1"]["GG_OTU_3"]['weight'] = 1.0
+g["GG_OTU_2"]["GG_OTU_5"]['weight'] = 1.0
+g["GG_OTU_4"]["GG_OTU_5"]['weight'] = -1.0
+g["GG_OTU_2"]["GG_OTU_6"]['weight'] = -1.0
+
+
+class TestSqlite(unittest.TestCase):
+    """
+    Tests the connection classes on the SQLite backend.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # The class setup creates a config file
+        # this config file refers to a SQLite database file
+        config = "[sqlite]\n" \
+                 "database=masq_test.db\n"
+        file = open("database.ini", "w")
+        file.write(config)
+        file.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("database.ini")
+        conn = SqliteBackend.connections.pop("masq_test.db", None)
+        if conn:
+            conn.close()
+        if os.path.isfile("masq_test.db"):
+            os.remove("masq_test.db")
+
+    def setUp(self):
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=g, name='g', study='test')
+
+    def tearDown(self):
+        ParentConnection().delete_tables()
+
+    def test_ParentConnection(self):
+        """
+        Tests if a config file with a sqlite section selects the SQLite backend.
+        :return:
+        """
+        conn_object = ParentConnection()
+        self.assertEqual(conn_object.backend.name, 'sqlite')
+
+    def test_threads(self):
+        """
+        Tests if a thread waits for the transaction of another thread
+        on the shared connection, instead of committing it.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn = conn_object.backend.connect()
+        conn.execute("INSERT INTO bioms (studyID, tax_num, sample_num) VALUES ('a', 1, 1);")
+        thread = threading.Thread(target=conn_object.value_query,
+                                  args=("INSERT INTO bioms (studyID, tax_num, sample_num) "
+                                        "VALUES (%s, %s, %s);", ('b', 1, 1)))
+        thread.start()
+        thread.join(timeout=1)
+        waiting = thread.is_alive()
+        conn.rollback()
+        conn_object.backend.release(conn)
+        thread.join()
+        result = conn_object.query("SELECT studyID FROM bioms WHERE studyID IN ('a', 'b');", fetch=True)
+        self.assertTrue(waiting)
+        self.assertEqual(result, [('b',)])
+
+    def test_add_biom(self):
+        """
+        Tests if the count table is written to the SQLite database.
+        :return:
+        """
+        conn_object = BiomConnection()
+        result = conn_object.query("SELECT COUNT(*) FROM counts;", fetch=True)
+        self.assertEqual(result[0][0], testbiom.shape[0] * testbiom.shape[1])
+
+    def test_add_biom_bulk(self):
+        """
+        Tests if the staging tables are used to import a BIOM file.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.delete_study('test')
+        conn_object.add_biom(testbiom, 'bulk', bulk=True)
+        result = conn_object.value_query("SELECT COUNT(*) FROM counts WHERE studyID = %s;",
+                                         values=('bulk',), fetch=True)
+        self.assertEqual(result[0][0], testbiom.shape[0] * testbiom.shape[1])
+
+    def test_like_query(self):
+        """
+        Tests if escaped percent signs and quoted placeholders
+        are translated as psycopg2 would send them.
+        :return:
+        """
+        conn_object = ParentConnection()
+        result = conn_object.value_query("SELECT COUNT(*), '100%%', '%s' FROM taxonomy "
+                                         "WHERE taxon LIKE '%%OTU%%' AND studyID = %s;",
+                                         values=('test',), fetch=True)
+        self.assertEqual(result[0], (testbiom.shape[0], '100%', '%s'))
+        self.assertEqual(_qmark("SELECT '%s', '%%' FROM t WHERE a IN %s AND b = %s;", (('x', 'y'), 'z')),
+                         ("SELECT '%s', '%' FROM t WHERE a IN (?,?) AND b = ?;", ('x', 'y', 'z')))
+        self.assertEqual(_qmark("SELECT * FROM t WHERE a LIKE '%%';", None),
+                         ("SELECT * FROM t WHERE a LIKE '%%';", None))
+
+    def test_get_counts(self):
+        """
+        Tests if the count matrix is read back from the SQLite database.
+        :return:
+        """
+        conn_object = BiomConnection()
+        counts, taxa, samples = conn_object.get_counts('test')
+        self.assertEqual(counts.sum(), testbiom.matrix_data.sum())
+
+    def test_export_network(self):
+        """
+        Tests if the network is read back from the SQLite database.
+        :return:
+        """
+        conn_object = IoConnection()
+        network = conn_object.export_network('g')
+        self.assertEqual(len(network.edges), 4)
+
+    def test_export_adjacency_cache(self):
+        """
+        Tests if the cached adjacency matrix is validated on the SQLite database,
+        and replaced once the network changes.
+        :return:
+        """
+        conn_object = IoConnection()
+        conn_object.export_adjacency(names=['g'], cache='adjacency')
+        cached, labels = conn_object.export_adjacency(names=['g'], cache='adjacency')['g']
+        conn_object.value_query("DELETE FROM edges WHERE source=%s AND target=%s",
+                                values=("GG_OTU_1", "GG_OTU_3"))
+        changed, labels = conn_object.export_adjacency(names=['g'], cache='adjacency')['g']
+        shutil.rmtree('adjacency')
+        self.assertEqual(cached.nnz, 8)
+        self.assertEqual(changed.nnz, 6)
+
+    def test_get_intersection(self):
+        """
+        Tests if the intersection is computed on the SQLite database.
+        :return:
+        """
+        conn_object = IoConnection()
+        f = g.copy(as_view=False)
+        f.remove_edge("GG_OTU_1", "GG_OTU_3")
+        conn_object.add_network(network=f, name='f', study='test')
+        conn_object = SetConnection()
+        network = conn_object.get_intersection(networks=['g', 'f'], number=2, weight=True)
+        self.assertEqual(len(network.edges), 3)
+
+    def test_get_pairlist(self):
+        """
+        Tests if the pair list is returned correctly.
+        :return:
+        """
+        conn_object = MetaConnection()
+        pair = conn_object.get_pairlist(level='Family', weight=False, network='g')
+        self.assertCountEqual(pair[0], ['GG_OTU_1', 'GG_OTU_4'])
+
+    def test_start_metastats(self):
+        """
+        Tests if the network is agglomerated on the SQLite database.
+        :return:
+        """
+        start_metastats(level='Family', weight=False, networks=['g'])
+        conn_object = ParentConnection()
+        result = conn_object.value_query("SELECT node_num FROM networks "
+                                         "WHERE networkID = %s;", values=('Genus_g',), fetch=True)
+        self.assertEqual(result[0][0], 5)
+
+
+@unittest.skipIf(duckdb is None, "duckdb is not installed")
+class TestDuckdb(unittest.TestCase):
+    """
+    Tests the connection classes on an in-memory DuckDB backend.
+    """
+    def test_export_adjacency_cache(self):
+        """
+        Tests if the cached adjacency matrix is validated on the DuckDB database,
+        and replaced once the network changes.
+        :return:
+        """
+        conn_object = IoConnection(config=None, backend='duckdb')
+        conn_object.query("CREATE TABLE edges (networkID VARCHAR, source VARCHAR, "
+                          "target VARCHAR, weight DOUBLE);")
+        conn_object.value_query("INSERT INTO edges (networkID, source, target, weight) "
+                                "VALUES (%s, %s, %s, %s)",
+                                values=[('g', x[0], x[1], x[2]['weight']) for x in g.edges(data=True)])
+        conn_object.export_adjacency(names=['g'], cache='adjacency')
+        cached, labels = conn_object.export_adjacency(names=['g'], cache='adjacency')['g']
+        conn_object.value_query("DELETE FROM edges WHERE source=%s AND target=%s",
+                                values=("GG_OTU_1", "GG_OTU_3"))
+        changed, labels = conn_object.export_adjacency(names=['g'], cache='adjacency')['g']
+        shutil.rmtree('adjacency')
+        self.assertEqual(cached.nnz, 8)
+        self.assertEqual(changed.nnz, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
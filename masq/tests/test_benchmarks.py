@@ -0,0 +1,125 @@
+"""
+This file contains functions for testing the benchmark suite
+in the masq/benchmarks directory.
+
+The benchmarks run on an in-memory SQLite database,
+so they do not need a PostgreSQL server.
+"""
+
+import unittest
+import os
+import json
+from masq.scripts.backends import SqliteBackend
+from masq.benchmarks.generators import generate_taxonomy, generate_biom, generate_networks
+from masq.benchmarks import run
+from masq.benchmarks.compare import compare_runs, main
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestBenchmarks(unittest.TestCase):
+    """
+    Tests the synthetic data generators and the benchmark runner.
+    """
+    @classmethod
+    def setUpClass(cls):
+        config = "[sqlite]\n"
+        file = open("benchmark.ini", "w")
+        file.write(config)
+        file.close()
+        run.scales['test'] = {'taxa': 20, 'samples': 5, 'networks': 2, 'edges': 2}
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("benchmark.ini")
+        run.scales.pop('test')
+        conn = SqliteBackend.connections.pop(":memory:", None)
+        if conn:
+            conn.close()
+        for file in ["benchmark.json", "baseline.json", "candidate.json"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def test_generate_taxonomy(self):
+        """
+        Tests if each taxonomic level has fewer groups than the level below.
+        :return:
+        """
+        lineages = generate_taxonomy(100)
+        groups = [len(set(x[i] for x in lineages)) for i in range(7)]
+        self.assertEqual(groups[-1], 50)
+        self.assertEqual(groups, sorted(groups))
+
+    def test_generate_biom(self):
+        """
+        Tests if the BIOM table has the requested shape, sparsity and metadata.
+        :return:
+        """
+        table = generate_biom('test', taxa=50, samples=10, sparsity=0.8, metadata=3)
+        self.assertEqual(table.shape, (50, 10))
+        self.assertEqual(table.nnz, 100)
+        self.assertEqual(len(table.metadata(id='test_sample0', axis='sample')), 3)
+
+    def test_generate_networks(self):
+        """
+        Tests if networks of the same size that share edges are generated.
+        :return:
+        """
+        nodes = ['taxon' + str(i) for i in range(50)]
+        networks = generate_networks(nodes, number=2, edges=2, overlap=0.5)
+        self.assertEqual(networks[0].number_of_edges(), networks[1].number_of_edges())
+        shared = set(networks[0].edges).intersection(networks[1].edges)
+        self.assertGreater(len(shared), 0)
+        self.assertLess(len(shared), networks[0].number_of_edges())
+
+    def test_run_benchmarks(self):
+        """
+        Tests if the benchmarks are timed and written to a JSON file.
+        :return:
+        """
+        results = run.run_benchmarks(config='benchmark.ini', scale_names=['test'], repeats=2)
+        run.write_results(results, 'benchmark.json')
+        with open('benchmark.json', 'r') as file:
+            results = json.load(file)
+        operations = [x['operation'] for x in results['results']]
+        self.assertEqual(results['backend'], 'sqlite')
+        self.assertEqual(operations, ['import_biom', 'import_networks',
+                                      'extract_sets_intersection', 'extract_sets_difference',
+                                      'extract_sets_union', 'start_metastats'])
+        self.assertTrue(all(len(x['times']) == 2 for x in results['results']))
+        self.assertTrue(all(x['peak_memory'] > 0 for x in results['results']))
+
+    def test_compare_runs(self):
+        """
+        Tests if significant slowdowns and memory increases are flagged,
+        and if the gate exits with a non-zero status.
+        :return:
+        """
+        baseline = {'results': [{'operation': 'import_biom', 'scale': 'small',
+                                 'times': [1.0, 1.1, 0.9, 1.0], 'peak_memory': 1000},
+                                {'operation': 'start_metastats', 'scale': 'small',
+                                 'times': [2.0, 2.2, 1.8, 2.0], 'peak_memory': 1000}]}
+        candidate = {'results': [{'operation': 'import_biom', 'scale': 'small',
+                                  'times': [1.0, 1.2, 0.9, 1.1], 'peak_memory': 1500},
+                                 {'operation': 'start_metastats', 'scale': 'small',
+                                  'times': [3.0, 3.1, 2.9, 3.0], 'peak_memory': 1000}]}
+        comparisons = compare_runs(baseline, candidate, threshold=0.1)
+        regressions = [(x['operation'], x['metric']) for x in comparisons if x['regression']]
+        self.assertEqual(regressions, [('import_biom', 'peak_memory'),
+                                       ('start_metastats', 'time')])
+        for name, run_results in [('baseline.json', baseline), ('candidate.json', candidate)]:
+            with open(name, 'w') as file:
+                json.dump(run_results, file)
+        with self.assertRaises(SystemExit) as exit_code:
+            main(['baseline.json', 'candidate.json'])
+        self.assertEqual(exit_code.exception.code, 1)
+        main(['baseline.json', 'baseline.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
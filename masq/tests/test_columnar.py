@@ -0,0 +1,315 @@
+"""
+This file contains functions for testing functions
+and the ColumnarConnection class in the columnar.py file.
+
+The file first connects to a simple PostgreSQL database for carrying out the tests.
+This database is cleaned up after testing so it can be reused.
+
+The test database needs to be created first with the CREATE DATABASE command;
+this is not done in the testing environment.
+"""
+
+import unittest
+import os
+import threading
+from unittest import mock
+import biom
+import psycopg2
+import networkx as nx
+from masq.scripts.io import IoConnection
+from masq.scripts.sq4biom import BiomConnection
+from masq.scripts import columnar
+from masq.scripts.columnar import ColumnarConnection, export_parquet, import_parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+testraw = """{
+     "id":  "test",
+     "format": "Biological Observation Matrix 1.0.0-dev",
+     "format_url": "http://biom-format.org",
+     "type": "OTU table",
+     "generated_by": "QIIME revision XYZ",
+     "date": "2011-12-19T19:00:00",
+     "rows":[
+        {"id":"GG_OTU_1", "metadata":{"taxonomy":["k__Bacteria", "p__Proteoba\
+cteria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriac\
+eae", "g__Escherichia", "s__"]}},
+        {"id":"GG_OTU_2", "metadata":{"taxonomy":["k__Bacteria", "p__Cyanobact\
+eria", "c__Nostocophycideae", "o__Nostocales", "f__Nostocaceae", "g__Dolichosp\
+ermum", "s__"]}},
+        {"id":"GG_OTU_3", "metadata":{"taxonomy":["k__Archaea", "p__Euryarchae\
+ota", "c__Methanomicrobia", "o__Methanosarcinales", "f__Methanosarcinaceae", "\
+g__Methanosarcina", "s__"]}},
+        {"id":"GG_OTU_4", "metadata":{"taxonomy":["k__Bacteria", "p__Firmicute\
+s", "c__Clostridia", "o__Halanaerobiales", "f__Halanaerobiaceae", "g__Halanaer\
+obium", "s__Halanaerobiumsaccharolyticum"]}},
+        {"id":"GG_OTU_5", "metadata":{"taxonomy":["k__Bacteria", "p__Proteobac\
+teria", "c__Gammaproteobacteria", "o__Enterobacteriales", "f__Enterobacteriace\
+ae", "g__Escherichia", "s__"]}}
+        ],
+     "columns":[
+        {"id":"Sample1", "metadata":{
+                                "BarcodeSequence":"CGCTTATCGAGA",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample2", "metadata":{
+                                "BarcodeSequence":"CATACCAGTAGC",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample3", "metadata":{
+                                "BarcodeSequence":"CTCTCTACCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"gut",
+                                "Description":"human gut"}},
+        {"id":"Sample4", "metadata":{
+                                "BarcodeSequence":"CTCTCGGCCTGT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample5", "metadata":{
+                                "BarcodeSequence":"CTCTCTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}},
+        {"id":"Sample6", "metadata":{
+                                "BarcodeSequence":"CTAACTACCAAT",
+                                "LinkerPrimerSequence":"CATGCTGCCTCCCGTAGGAGT",
+                                "BODY_SITE":"skin",
+                                "Description":"human skin"}}
+        ],
+     "matrix_type": "sparse",
+     "matrix_element_type": "int",
+     "shape": [5, 6],
+     "data":[[0,2,1],
+             [1,0,5],
+             [1,1,1],
+             [1,3,2],
+             [1,4,3],
+             [1,5,1],
+             [2,2,1],
+             [2,3,4],
+             [2,5,2],
+             [3,0,2],
+             [3,1,1],
+             [3,2,1],
+             [3,5,1],
+             [4,1,1],
+             [4,2,1]
+            ]
+    }
+"""
+
+testbiom = biom.parse.parse_biom_table(testraw)
+testdict = dict.fromkeys(testbiom._observation_ids)
+
+# make toy network
+g = nx.Graph()
+nodes = ["GG_OTU_1", "GG_OTU_2", "GG_OTU_3", "GG_OTU_4", "GG_OTU_5"]
+g.add_nodes_from(nodes)
+g.add_edges_from([("GG_OTU_1", "GG_OTU_2"),
+                  ("GG_OTU_2", "GG_OTU_5"), ("GG_OTU_3", "GG_OTU_4")])
+g["GG_OTU_1"]["GG_OTU_2"]['weight'] = 1.0
+g["GG_OTU_2"]["GG_OTU_5"]['weight'] = 1.0
+g["GG_OTU_3"]["GG_OTU_4"]['weight'] = -1.0
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestColumnar(unittest.TestCase):
+    """
+    Tests columnar methods.
+    Warning: most of these functions are to interact with a local database named test.
+    Therefore, the presence of the necessary local files is a prerequisite.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # The class setup creates a config file
+        # this config file refers to the local test database
+        # if your test database has different config, change here
+        config = "[postgresql]\n" \
+                 "host=localhost\n" \
+                 "database=test\n" \
+                 "user=test\n" \
+                 "password=test\n"
+        file = open("database.ini", "w")
+        file.write(config)
+        file.close()
+        # clear database before usage
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        tables = ['bioms', 'sample', 'networks', 'taxonomy', 'counts', 'edges', 'meta']
+        for tab in tables:
+            try:
+                cur.execute(("DROP TABLE " + tab + ";"))
+            except psycopg2.Error:
+                pass
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("database.ini")
+        # clear database after usage
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        tables = ['bioms', 'sample', 'networks', 'taxonomy', 'counts', 'edges', 'meta']
+        for tab in tables:
+            try:
+                cur.execute(("DROP TABLE " + tab + ";"))
+            except psycopg2.Error:
+                pass
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def test_export_table(self):
+        """
+        Tests if the edges table is written to a Parquet file
+        with the columns from create_tables.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object = ColumnarConnection()
+        rows = conn_object.export_table('edges', 'edges.parquet')
+        conn_object.delete_tables()
+        table = pq.read_table('edges.parquet')
+        os.remove('edges.parquet')
+        self.assertEqual(rows, 3)
+        self.assertListEqual(table.column_names, ['networkID', 'source', 'target', 'weight'])
+        self.assertCountEqual(table.column('weight').to_pylist(), [1.0, 1.0, -1.0])
+
+    def test_export_empty_table(self):
+        """
+        Tests if an empty table is written to a Parquet file without rows,
+        and if an export that Arrow cannot read returns instead of waiting on COPY.
+        :return:
+        """
+        conn_object = ColumnarConnection()
+        conn_object.create_tables()
+        rows = conn_object.export_table('edges', 'edges.parquet')
+        table = pq.read_table('edges.parquet')
+        os.remove('edges.parquet')
+        self.assertEqual(rows, 0)
+        self.assertEqual(table.num_rows, 0)
+        conn_object = BiomConnection()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = ColumnarConnection()
+        result = list()
+        with mock.patch.object(columnar.pacsv, 'open_csv', side_effect=pa.ArrowInvalid('invalid')):
+            thread = threading.Thread(target=lambda: result.append(
+                conn_object.export_table('counts', 'counts.parquet')))
+            thread.start()
+            thread.join(60)
+        conn_object.delete_tables()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result, [0])
+        self.assertFalse(os.path.isfile('counts.parquet'))
+
+    def test_import_table(self):
+        """
+        Tests if the taxonomy table, including missing values,
+        is identical after exporting and importing it.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = ColumnarConnection()
+        conn_object.export_table('taxonomy', 'taxonomy.parquet')
+        original = conn_object.query("SELECT * FROM taxonomy;", fetch=True)
+        conn_object.query("DELETE FROM counts;")
+        conn_object.query("DELETE FROM taxonomy;")
+        rows = conn_object.import_table('taxonomy', 'taxonomy.parquet')
+        result = conn_object.query("SELECT * FROM taxonomy;", fetch=True)
+        conn_object.delete_tables()
+        os.remove('taxonomy.parquet')
+        self.assertEqual(rows, 5)
+        self.assertCountEqual(original, result)
+
+    def test_import_table_error(self):
+        """
+        Tests if a missing file, a missing column or a column that cannot be cast
+        are logged and rolled back, and if the connection is closed.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        pq.write_table(pa.table({'networkID': ['banana'], 'source': ['GG_OTU_1']}), 'missing.parquet')
+        pq.write_table(pa.table({'networkID': ['banana'], 'source': ['GG_OTU_1'],
+                                 'target': ['GG_OTU_3'], 'weight': ['strong']}), 'cast.parquet')
+        conn_object = ColumnarConnection()
+        connections = list()
+        original = psycopg2.connect
+
+        def connect(**config):
+            connections.append(original(**config))
+            return connections[-1]
+        with mock.patch.object(columnar.psycopg2, 'connect', side_effect=connect):
+            rows = [conn_object.import_table('edges', x)
+                    for x in ['none.parquet', 'missing.parquet', 'cast.parquet']]
+        edges = conn_object.query("SELECT * FROM edges;", fetch=True)
+        conn_object.delete_tables()
+        for file in ['missing.parquet', 'cast.parquet']:
+            os.remove(file)
+        self.assertEqual(rows, [0, 0, 0])
+        self.assertEqual(len(edges), 3)
+        self.assertTrue(all(x.closed for x in connections))
+
+    def test_export_import_parquet(self):
+        """
+        Tests if all tables can be restored from a Parquet snapshot
+        into a fresh database.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        bioms = conn_object.query("SELECT * FROM bioms;", fetch=True)
+        networks = conn_object.query("SELECT * FROM networks;", fetch=True)
+        export_parquet(os.getcwd())
+        conn_object.delete_tables()
+        conn_object.create_tables()
+        import_parquet(os.getcwd())
+        edges = conn_object.query("SELECT * FROM edges;", fetch=True)
+        counts = conn_object.query("SELECT * FROM counts;", fetch=True)
+        samples = conn_object.query("SELECT * FROM samples;", fetch=True)
+        restored_bioms = conn_object.query("SELECT * FROM bioms;", fetch=True)
+        restored_networks = conn_object.query("SELECT * FROM networks;", fetch=True)
+        conn_object.delete_tables()
+        for table in ['bioms', 'samples', 'networks', 'edges', 'counts', 'meta', 'taxonomy']:
+            os.remove(table + '.parquet')
+        self.assertEqual(len(edges), 3)
+        self.assertEqual(len(counts), 30)
+        self.assertEqual(len(samples), 6)
+        self.assertCountEqual(restored_bioms, bioms)
+        self.assertCountEqual(restored_networks, networks)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+This file contains functions for testing the query profile in the instrument.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file is removed after testing.
+"""
+
+import unittest
+import os
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts import instrument
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestInstrument(unittest.TestCase):
+    """
+    Tests the query profile.
+    """
+    @classmethod
+    def tearDownClass(cls):
+        conn = SqliteBackend.connections.pop("masq_profile.db", None)
+        if conn:
+            conn.close()
+        if os.path.isfile("masq_profile.db"):
+            os.remove("masq_profile.db")
+
+    def tearDown(self):
+        instrument.stop_profile()
+        instrument.stop_memory_profile()
+
+    def test_fingerprint(self):
+        """
+        Tests if queries that only differ in their values
+        have the same fingerprint.
+        :return:
+        """
+        first = instrument.fingerprint("SELECT * FROM edges WHERE networkID = 'g1' AND weight > 0.5;")
+        second = instrument.fingerprint("SELECT *  FROM edges\n WHERE networkID = 'g2' AND weight > 1;")
+        third = instrument.fingerprint("SELECT * FROM edges WHERE networkID IN (%s, %s) AND weight > %s;")
+        self.assertEqual(first, second)
+        self.assertEqual(first, "SELECT * FROM edges WHERE networkID = ? AND weight > ?;")
+        self.assertEqual(third, "SELECT * FROM edges WHERE networkID IN (...) AND weight > ?;")
+
+    def test_profile(self):
+        """
+        Tests if queries are aggregated per fingerprint,
+        with their row counts.
+        :return:
+        """
+        conn_object = ParentConnection(config=None, database="masq_profile.db", backend='sqlite')
+        conn_object.query("CREATE TABLE test (id INTEGER, name TEXT);")
+        profile = instrument.start_profile(slow=None)
+        conn_object.value_query("INSERT INTO test (id, name) VALUES (%s, %s);",
+                                values=[(1, 'a'), (2, 'b'), (3, 'c')])
+        conn_object.value_query("INSERT INTO test (id, name) VALUES (%s, %s);",
+                                values=(4, 'd'))
+        conn_object.query("SELECT * FROM test WHERE id > 1;", fetch=True)
+        list(conn_object.iter_query("SELECT * FROM test WHERE name != %s;", values=('a',)))
+        instrument.stop_profile()
+        conn_object.query("DROP TABLE test;")
+        summary = {x['fingerprint']: x for x in profile.summary()}
+        insert = summary["INSERT INTO test (id, name) VALUES (...);"]
+        self.assertEqual(insert['count'], 2)
+        self.assertEqual(insert['rows_affected'], 4)
+        self.assertEqual(sum(insert['histogram'].values()), 2)
+        self.assertEqual(summary["SELECT * FROM test WHERE id > ?;"]['rows_returned'], 3)
+        self.assertEqual(summary["SELECT * FROM test WHERE name != ?;"]['rows_returned'], 3)
+        self.assertNotIn("DROP TABLE test;", summary)
+
+    def test_slow_query(self):
+        """
+        Tests if queries above the threshold are logged.
+        :return:
+        """
+        profile = instrument.start_profile(slow=0.5)
+        with self.assertLogs('masq.scripts.instrument', level='WARNING') as logs:
+            profile.record("SELECT pg_sleep(1);", 1.0)
+        profile.record("SELECT 1;", 0.1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("SELECT pg_sleep(...);", logs.output[0])
+
+    def test_memory_profile(self):
+        """
+        Tests if the peak and retained memory of nested stages are recorded,
+        with the line that allocated the retained memory.
+        :return:
+        """
+        memory = instrument.start_memory_profile(top=1)
+        with instrument.stage('outer', 'test'):
+            with instrument.stage('inner'):
+                temporary = [str(x) for x in range(100000)]
+                del temporary
+            kept = [(x, x) for x in range(100000)]
+        instrument.stop_memory_profile()
+        inner, outer = memory.summary()
+        self.assertEqual(inner['name'], 'inner')
+        self.assertGreater(inner['peak'], 5e6)
+        self.assertLess(inner['retained'], 1e6)
+        self.assertEqual(outer['label'], 'test')
+        self.assertGreaterEqual(outer['peak'], inner['peak'])
+        self.assertGreater(outer['retained'], 5e6)
+        self.assertIn('test_instrument.py', outer['sites'][0][0])
+        self.assertEqual(len(kept), 100000)
+
+    def test_stage_disabled(self):
+        """
+        Tests if stages are not recorded when no memory profile is running.
+        :return:
+        """
+        memory = instrument.start_memory_profile()
+        instrument.stop_memory_profile()
+        with instrument.stage('outer'):
+            pass
+        self.assertEqual(memory.summary(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
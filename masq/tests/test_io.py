@@ -11,11 +11,12 @@ this is not done in the testing environment.
 
 import unittest
 import os
+import shutil
 import biom
 import psycopg2
 import networkx as nx
 from biom.cli.util import write_biom_table
-from masq.scripts.io import import_networks, IoConnection, _read_network_extension
+from masq.scripts.io import import_networks, IoConnection, _read_network_extension, _convert_adjacency
 from masq.scripts.sq4biom import BiomConnection
 
 
@@ -313,6 +314,32 @@ class TestIo(unittest.TestCase):
         conn_object.delete_tables()
         self.assertEqual(len(result), 3)
 
+    def test_add_network_bulk(self):
+        """
+        Tests if the network file is added
+        to the database through staging tables.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana', bulk=True)
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        cur.execute("SELECT * from edges;")
+        result = cur.fetchall()
+        cur.execute("SELECT * from networks;")
+        network = cur.fetchall()
+        cur.close()
+        conn.close()
+        conn_object.delete_tables()
+        self.assertEqual(len(result), 3)
+        self.assertEqual(network[0], ('banana', 'banana', 5, 3))
+
     def test_add_network_node(self):
         """
         Tests whether a row is added to the networks table.
@@ -412,6 +439,205 @@ class TestIo(unittest.TestCase):
         conn_object.delete_tables()
         self.assertEqual(len(network.edges), 3)
 
+    def test_export_network_handler(self):
+        """
+        Tests whether the edges can be streamed to a different handler.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        edges = conn_object.export_network(name='banana', handler=list, itersize=1)
+        conn_object.delete_tables()
+        self.assertCountEqual([edge[1:3] for edge in edges],
+                              [("GG_OTU_1", "GG_OTU_2"), ("GG_OTU_2", "GG_OTU_5"),
+                               ("GG_OTU_3", "GG_OTU_4")])
+
+    def test_write_network_graphml(self):
+        """
+        Tests whether the network can be streamed to a GraphML file.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object.write_network(name='banana', path='banana.graphml')
+        conn_object.delete_tables()
+        network = _read_network_extension('banana.graphml')
+        os.remove('banana.graphml')
+        self.assertEqual(len(network.edges), 3)
+        self.assertEqual(network.edges[("GG_OTU_3", "GG_OTU_4")]['weight'], -1.0)
+
+    def test_write_network_format(self):
+        """
+        Tests whether an unsupported extension is refused,
+        instead of reporting that a file was written.
+        :return:
+        """
+        conn_object = IoConnection()
+        with self.assertRaises(ValueError):
+            conn_object.write_network(name='banana', path='banana.foo')
+        self.assertFalse(os.path.isfile('banana.foo'))
+
+    def test_write_network_gml(self):
+        """
+        Tests whether the network can be streamed to a GML file.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object.write_network(name='banana', path='banana.gml')
+        conn_object.delete_tables()
+        network = _read_network_extension('banana.gml')
+        os.remove('banana.gml')
+        self.assertCountEqual(network.nodes, nodes)
+        self.assertEqual(network.edges[("GG_OTU_1", "GG_OTU_2")]['weight'], 1.0)
+
+    def test_write_network_edgelist(self):
+        """
+        Tests whether the network can be streamed to a weighted edge list.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object.write_network(name='banana', path='banana.txt')
+        conn_object.delete_tables()
+        network = _read_network_extension('banana.txt')
+        os.remove('banana.txt')
+        self.assertEqual(len(network.edges), 3)
+
+    def test_export_networks(self):
+        """
+        Tests whether several networks can be exported with one query.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        f = g.copy(as_view=False)
+        f.remove_edge("GG_OTU_1", "GG_OTU_2")
+        conn_object.add_network(f, 'apple', 'banana')
+        networks = conn_object.export_networks(names=['banana', 'apple'])
+        conn_object.delete_tables()
+        self.assertEqual(len(networks['banana'].edges), 3)
+        self.assertEqual(len(networks['apple'].edges), 2)
+
+    def test_export_networks_files(self):
+        """
+        Tests whether each network is written to a separate file.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object.add_network(g, 'apple', 'banana')
+        conn_object.export_networks(path=os.getcwd(), format='txt')
+        conn_object.delete_tables()
+        banana = _read_network_extension('banana.txt')
+        apple = _read_network_extension('apple.txt')
+        os.remove('banana.txt')
+        os.remove('apple.txt')
+        self.assertEqual(len(banana.edges), 3)
+        self.assertEqual(len(apple.edges), 3)
+
+    def test_export_networks_names(self):
+        """
+        Tests whether network names with slashes are written inside the folder,
+        and names that only differ in case get separate files.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, '../banana', 'banana')
+        conn_object.add_network(g, 'apple', 'banana')
+        conn_object.add_network(g, 'Apple', 'banana')
+        os.makedirs('networks', exist_ok=True)
+        networks = conn_object.export_networks(path='networks', format='txt')
+        conn_object.delete_tables()
+        files = os.listdir('networks')
+        shutil.rmtree('networks')
+        self.assertEqual(len(files), 3)
+        self.assertEqual(sorted(os.path.dirname(x) for x in networks.values()), ['networks'] * 3)
+        self.assertFalse(os.path.isfile('banana.txt'))
+
+    def test_export_networks_format(self):
+        """
+        Tests whether an unsupported file format is refused
+        before the networks are queried.
+        :return:
+        """
+        conn_object = IoConnection()
+        with self.assertRaises(ValueError):
+            conn_object.export_networks(names=['banana'], path=os.getcwd(), format='foo')
+
+    def test_export_adjacency(self):
+        """
+        Tests whether the network is exported as a symmetric adjacency matrix.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        matrix, labels = conn_object.export_adjacency(names=['banana'])['banana']
+        conn_object.delete_tables()
+        i = list(labels).index("GG_OTU_3")
+        j = list(labels).index("GG_OTU_4")
+        self.assertEqual(matrix.shape, (5, 5))
+        self.assertEqual(matrix.nnz, 6)
+        self.assertEqual(matrix[i, j], -1.0)
+        self.assertEqual(matrix[j, i], -1.0)
+
+    def test_convert_adjacency(self):
+        """
+        Tests whether a self-loop keeps its weight on the diagonal.
+        :return:
+        """
+        matrix, labels = _convert_adjacency([('banana', 'GG_OTU_1', 'GG_OTU_2', 0.5),
+                                             ('banana', 'GG_OTU_1', 'GG_OTU_1', 2.0)])
+        i = list(labels).index("GG_OTU_1")
+        j = list(labels).index("GG_OTU_2")
+        self.assertEqual(matrix[i, i], 2.0)
+        self.assertEqual(matrix[i, j], 0.5)
+        self.assertEqual(matrix[j, i], 0.5)
+
+    def test_export_adjacency_cache(self):
+        """
+        Tests whether the cached adjacency matrix is used,
+        and replaced once the network changes.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object = IoConnection()
+        conn_object.add_network(g, 'banana', 'banana')
+        conn_object.export_adjacency(names=['banana'], cache='adjacency')
+        cached, labels = conn_object.export_adjacency(names=['banana'], cache='adjacency')['banana']
+        conn_object.value_query("DELETE FROM edges WHERE source=%s", values=("GG_OTU_3",))
+        changed, labels = conn_object.export_adjacency(names=['banana'], cache='adjacency')['banana']
+        conn_object.delete_tables()
+        shutil.rmtree('adjacency')
+        self.assertEqual(cached.nnz, 6)
+        self.assertEqual(changed.nnz, 4)
+
     def test_read_network_extension(self):
         """
         Tests whether the network can be read from a file.
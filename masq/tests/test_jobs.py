@@ -0,0 +1,137 @@
+"""
+This file contains functions for testing the work queue in the jobs.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file is removed after testing.
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts import jobs
+from masq.scripts.jobs import JobConnection, run_worker
+from masq.benchmarks.generators import write_dataset
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestJobs(unittest.TestCase):
+    """
+    Tests the jobs table and workers.
+    """
+    @classmethod
+    def setUpClass(cls):
+        file = open("jobs.ini", "w")
+        file.write("[sqlite]\ndatabase = masq_jobs.db\n")
+        file.close()
+        cls.path = tempfile.mkdtemp()
+        cls.biom_path, cls.network_path = write_dataset(cls.path, 'test', taxa=20, samples=5,
+                                                        networks=2, edges=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        conn = SqliteBackend.connections.pop("masq_jobs.db", None)
+        if conn:
+            conn.close()
+        for file in ["jobs.ini", "masq_jobs.db"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def setUp(self):
+        self.conn = JobConnection(config="jobs.ini")
+        self.conn.delete_tables()
+        self.conn.create_tables()
+        self.conn.create_jobs()
+
+    def tearDown(self):
+        self.conn.delete_jobs()
+
+    def test_claim(self):
+        """
+        Tests if jobs are claimed in order, and only once.
+        :return:
+        """
+        first = self.conn.submit('import_biom', {'location': 'first.biom'})
+        second = self.conn.submit('import_biom', {'location': 'second.biom'})
+        job = self.conn.claim('worker1')
+        self.assertEqual(job['id'], first)
+        self.assertEqual(job['params'], {'location': 'first.biom'})
+        self.assertEqual(job['attempt'], 1)
+        self.assertEqual(self.conn.claim('worker2')['id'], second)
+        self.assertIsNone(self.conn.claim('worker3'))
+        self.assertTrue(self.conn.heartbeat(first, 'worker1'))
+        self.assertFalse(self.conn.heartbeat(first, 'worker2'))
+        with self.assertRaises(ValueError):
+            self.conn.submit('delete_tables')
+
+    def test_worker(self):
+        """
+        Tests if a worker runs BIOM and network imports.
+        :return:
+        """
+        self.conn.submit('import_biom', {'location': self.biom_path})
+        self.conn.submit('import_networks', {'location': self.network_path,
+                                             'sources': {'test_1': 'test', 'test_2': 'test'}})
+        counts = run_worker(config="jobs.ini", drain=True)
+        self.assertEqual(counts, {'done': 2, 'failed': 0})
+        self.assertEqual(sorted(ParentConnection(config="jobs.ini").get_networks()),
+                         ['test_1', 'test_2'])
+        self.assertEqual([x['status'] for x in self.conn.get_jobs()], ['done', 'done'])
+
+    def test_retry(self):
+        """
+        Tests if failed jobs are retried until they have used up their attempts.
+        :return:
+        """
+        self.conn.submit('export_biom', {'study': 'missing', 'path': self.path}, attempts=2)
+        counts = run_worker(config="jobs.ini", retry_delay=0, drain=True)
+        self.assertEqual(counts, {'done': 0, 'failed': 2})
+        job = self.conn.get_jobs(status='failed')[0]
+        self.assertEqual(job['attempts'], 2)
+        self.assertIsNotNone(job['error'])
+
+    def test_main_logger(self):
+        """
+        Tests if a job that raises fails,
+        also when the worker logger is not a child of the masq logger.
+        :return:
+        """
+        self.conn.submit('import_biom', {'location': os.path.join(self.path, 'missing.biom')},
+                         attempts=1)
+        with mock.patch.object(jobs, 'logger', logging.getLogger('__main__')):
+            counts = run_worker(config="jobs.ini", drain=True)
+        self.assertEqual(counts, {'done': 0, 'failed': 1})
+        self.assertIn('missing.biom', self.conn.get_jobs(status='failed')[0]['error'])
+
+    def test_stale(self):
+        """
+        Tests if jobs without a recent heartbeat are requeued.
+        :return:
+        """
+        job_id = self.conn.submit('import_biom', {'location': 'lost.biom'})
+        self.conn.claim('lost')
+        self.assertEqual(self.conn.requeue_stale(timeout=60), [])
+        self.conn.value_query("UPDATE jobs SET heartbeat = heartbeat - 120 WHERE jobID=%s;",
+                              values=(job_id,))
+        self.assertEqual(self.conn.requeue_stale(timeout=60), [job_id])
+        job = self.conn.get_jobs()[0]
+        self.assertEqual(job['status'], 'queued')
+        self.assertEqual(job['error'], 'Worker lost stopped sending heartbeats.')
+        self.conn.complete(job_id, 'lost')
+        self.assertEqual(self.conn.claim('worker1')['attempt'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
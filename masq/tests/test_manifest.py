@@ -0,0 +1,156 @@
+"""
+This file contains functions for testing the batch import in the manifest.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file and manifests are removed after testing.
+"""
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts.manifest import read_manifest, import_manifest, main
+from masq.main import main as masq_main
+from masq.benchmarks.generators import write_dataset
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestManifest(unittest.TestCase):
+    """
+    Tests reading and importing manifests.
+    """
+    @classmethod
+    def setUpClass(cls):
+        file = open("manifest.ini", "w")
+        file.write("[sqlite]\ndatabase = masq_manifest.db\n")
+        file.close()
+        cls.path = tempfile.mkdtemp()
+        write_dataset(cls.path, 'test', taxa=20, samples=5, networks=2, edges=2)
+        # a network of a study whose BIOM file cannot be read
+        with open(os.path.join(cls.path, 'broken.biom'), 'w') as file:
+            file.write('not a BIOM file')
+        shutil.copy(os.path.join(cls.path, 'networks', 'test_1.graphml'),
+                    os.path.join(cls.path, 'networks', 'broken_1.graphml'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        conn = SqliteBackend.connections.pop("masq_manifest.db", None)
+        if conn:
+            conn.close()
+        for file in ["manifest.ini", "masq_manifest.db"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def setUp(self):
+        conn_object = ParentConnection(config="manifest.ini")
+        conn_object.delete_tables()
+        conn_object.create_tables()
+
+    def write_manifest(self, filename, contents):
+        location = os.path.join(self.path, filename)
+        with open(location, 'w') as file:
+            file.write(contents)
+        return location
+
+    def test_read_manifest(self):
+        """
+        Tests if folders are expanded, and if names and studies
+        are taken from the mapping, the sources and the items.
+        :return:
+        """
+        location = self.write_manifest('project.yaml',
+                                       "mapping: {test: study}\n"
+                                       "sources: {test_1: study}\n"
+                                       "bioms:\n"
+                                       "  - test.biom\n"
+                                       "networks:\n"
+                                       "  - {path: networks/test_1.graphml}\n"
+                                       "  - {path: networks/test_2.graphml, name: g2, study: study, bulk: true}\n")
+        files = read_manifest(location)
+        self.assertEqual([(x['type'], x['name'], x['study'], x['bulk']) for x in files],
+                         [('biom', 'study', 'study', False),
+                          ('network', 'test_1', 'study', False),
+                          ('network', 'g2', 'study', True)])
+        self.assertEqual(files[0]['path'], os.path.join(self.path, 'test.biom'))
+        location = self.write_manifest('folder.json', json.dumps({'networks': ['networks']}))
+        self.assertEqual([x['name'] for x in read_manifest(location)],
+                         ['broken_1', 'test_1', 'test_2'])
+        location = self.write_manifest('duplicate.json', json.dumps(
+            {'bioms': ['test.biom', {'path': 'broken.biom', 'name': 'test'}]}))
+        with self.assertRaises(ValueError):
+            read_manifest(location)
+        location = self.write_manifest('missing.json', json.dumps({'bioms': ['missing.biom']}))
+        with self.assertRaises(ValueError):
+            read_manifest(location)
+
+    def test_import_manifest(self):
+        """
+        Tests if all files are imported with their studies,
+        if networks of a failed BIOM import are skipped,
+        and if the summary is written to the report.
+        :return:
+        """
+        location = self.write_manifest('import.json', json.dumps(
+            {'sources': {'test_1': 'test', 'test_2': 'test', 'broken_1': 'broken'},
+             'bioms': ['test.biom', 'broken.biom'],
+             'networks': ['networks/test_1.graphml', 'networks/test_2.graphml',
+                          'networks/broken_1.graphml']}))
+        report = os.path.join(self.path, 'report.json')
+        summary = import_manifest(location, config="manifest.ini", workers=2, report=report)
+        self.assertEqual(summary['counts']['biom'], {'done': 1, 'failed': 1, 'skipped': 0, 'queued': 0})
+        self.assertEqual(summary['counts']['network'], {'done': 2, 'failed': 0, 'skipped': 1, 'queued': 0})
+        statuses = {x['name']: x['status'] for x in summary['files']}
+        self.assertEqual(statuses['broken_1'], 'skipped')
+        self.assertGreater(len([x for x in summary['files'] if x['name'] == 'broken'][0]['errors']), 0)
+        conn_object = ParentConnection(config="manifest.ini")
+        self.assertEqual(sorted(conn_object.get_networks()), ['test_1', 'test_2'])
+        self.assertEqual(conn_object.query("SELECT studyID FROM networks;", fetch=True),
+                         [('test',), ('test',)])
+        with open(report, 'r') as file:
+            self.assertEqual(json.load(file)['counts'], summary['counts'])
+
+    def test_main_metrics(self):
+        """
+        Tests if the manifest command writes metrics and trace spans.
+        :return:
+        """
+        location = self.write_manifest('metrics.json', json.dumps(
+            {'sources': {'test_1': 'test'}, 'bioms': ['test.biom'],
+             'networks': ['networks/test_1.graphml']}))
+        prom = os.path.join(self.path, 'masq.prom')
+        trace = os.path.join(self.path, 'trace.jsonl')
+        main([location, '-c', 'manifest.ini', '-w', '2', '-met', prom, '-tr', trace])
+        with open(prom, 'r') as file:
+            text = file.read()
+        with open(trace, 'r') as file:
+            spans = [json.loads(x)['name'] for x in file]
+        self.assertIn('masq_files_total{type="biom"} 1.0', text)
+        self.assertIn('masq_files_total{type="network"} 1.0', text)
+        self.assertIn('import_manifest', spans)
+
+    def test_masq_subcommand(self):
+        """
+        Tests if masq manifest runs the manifest import.
+        :return:
+        """
+        location = self.write_manifest('subcommand.json', json.dumps({'bioms': ['test.biom']}))
+        masq_main(['manifest', location, '-c', 'manifest.ini', '-w', '1'])
+        conn_object = ParentConnection(config="manifest.ini")
+        self.assertEqual(conn_object.query("SELECT studyID FROM bioms;", fetch=True), [('test',)])
+        with self.assertRaises(SystemExit):
+            masq_main(['manifest', location, '-c', 'manifest.ini', '-w', 'four'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,12 +11,18 @@ this is not done in the testing environment.
 
 import unittest
 import os
+import threading
+from unittest import mock
 import biom
 import psycopg2
 import networkx as nx
 from masq.scripts.io import IoConnection
 from masq.scripts.sq4biom import BiomConnection
 from masq.scripts.metastats import start_metastats, MetaConnection
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
 from pandas.core.common import flatten
 
 
@@ -241,6 +247,14 @@ g["GG_OTU_2"]["GG_OTU_5"]['weight'] = 1.0
 g["GG_OTU_4"]["GG_OTU_5"]['weight'] = -1.0
 g["GG_OTU_2"]["GG_OTU_6"]['weight'] = -1.0
 
+# toy network with an edge between two taxa of the same family
+h = nx.Graph()
+h.add_edges_from([("GG_OTU_3", "GG_OTU_4"), ("GG_OTU_4", "GG_OTU_5"),
+                  ("GG_OTU_2", "GG_OTU_6")])
+h["GG_OTU_3"]["GG_OTU_4"]['weight'] = 1.0
+h["GG_OTU_4"]["GG_OTU_5"]['weight'] = -1.0
+h["GG_OTU_2"]["GG_OTU_6"]['weight'] = -1.0
+
 
 class TestMeta(unittest.TestCase):
     """
@@ -322,6 +336,53 @@ class TestMeta(unittest.TestCase):
         conn_object.delete_tables()
         self.assertEqual(result[0][0], 5)
 
+    @unittest.skipIf(duckdb is None, "duckdb is not installed")
+    def test_start_metastats_error(self):
+        """
+        Tests if the connection for prepared statements is closed
+        when agglomeration raises an error.
+        :return:
+        """
+        with mock.patch.object(MetaConnection, 'agglomerate_networks', side_effect=ValueError), \
+                mock.patch.object(MetaConnection, 'close') as close:
+            with self.assertRaises(ValueError):
+                start_metastats(level='Genus', networks=['g'])
+        close.assert_called_once()
+
+    def test_start_metastats_analytic(self):
+        """
+        Tests if pairs can be searched on the DuckDB mirror,
+        while the agglomerated network is written to PostgreSQL.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=g, name='g', study='test')
+        start_metastats(level='Family', weight=False, networks=['g'], analytic=True)
+        result = conn_object.value_query("SELECT node_num, edge_num FROM networks "
+                                         "WHERE networkID = %s;", values=('Family_g',), fetch=True)
+        conn_object.delete_tables()
+        self.assertEqual(result[0], (3, 3))
+
+    @unittest.skipIf(duckdb is None, "duckdb is not installed")
+    def test_get_pairlist_analytic(self):
+        """
+        Tests if the pair list is returned correctly from the DuckDB mirror.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=g, name='g', study='test')
+        conn_object = MetaConnection()
+        conn_object.attach_analytic(tables=['edges', 'taxonomy'])
+        pair = conn_object.get_pairlist(level='Family', weight=False, network='g')
+        conn_object.delete_tables()
+        self.assertCountEqual(pair[0], ['GG_OTU_1', 'GG_OTU_4'])
+
     def test_agglomerate_networks(self):
         """
         Tests if the agglomerate_networks function agglomerates the test file
@@ -480,6 +541,53 @@ class TestMeta(unittest.TestCase):
         removed = {"GG_OTU_1", "GG_OTU_2"}
         self.assertEqual(len(removed.intersection(result)), 0)
 
+    def test_get_pairlist_same_group(self):
+        """
+        Tests if an edge between two taxa of the same family is not returned as a pair,
+        since merging such a pair creates a new edge in the same family,
+        and agglomeration never ends.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=h, name='h', study='test')
+        conn_object = MetaConnection()
+        pair = conn_object.get_pairlist(level='Family', weight=False, network='h')
+        thread = threading.Thread(target=conn_object.agglomerate_networks,
+                                  kwargs={'level': 'Family', 'weight': False, 'networks': ['h']},
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+        finished = not thread.is_alive()
+        if finished:
+            conn_object.delete_tables()
+        self.assertEqual(pair, [])
+        self.assertTrue(finished)
+
+    def test_agglomerate_taxa_edges(self):
+        """
+        Tests if edges of merged taxa are moved to the new node,
+        and if an edge between two merged taxa becomes a self-loop of the new node.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=h, name='h', study='test')
+        conn_object = MetaConnection()
+        conn_object.agglomerate_taxa(['GG_OTU_3', 'GG_OTU_4', 'GG_OTU_6'], network='h', level='Family')
+        result = conn_object.value_query("SELECT source, target, weight "
+                                         "FROM edges WHERE networkid = %s;", values=('h',), fetch=True)
+        conn_object.delete_tables()
+        new = [x[0] for x in result if x[0] == x[1]]
+        self.assertEqual(len(new), 1)
+        self.assertCountEqual(result, [(new[0], new[0], 1.0),
+                                       (new[0], 'GG_OTU_5', -1.0),
+                                       (new[0], 'GG_OTU_2', -1.0)])
+
     def test_agglomerate_pair(self):
         """
         Tests whether two edges are merged into a single edge,
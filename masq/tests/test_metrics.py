@@ -0,0 +1,157 @@
+"""
+This file contains functions for testing the counters in the metrics.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file and metrics files are removed after testing.
+"""
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import threading
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts.sq4biom import import_biom
+from masq.scripts.io import import_networks
+from masq.scripts import metrics
+from masq.benchmarks.generators import write_dataset
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests the metrics counters and exports.
+    """
+    @classmethod
+    def setUpClass(cls):
+        file = open("metrics.ini", "w")
+        file.write("[sqlite]\ndatabase = masq_metrics.db\n")
+        file.close()
+        cls.path = tempfile.mkdtemp()
+        cls.biom_path, cls.network_path = write_dataset(cls.path, 'test', taxa=20, samples=5,
+                                                        networks=1, edges=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        conn = SqliteBackend.connections.pop("masq_metrics.db", None)
+        if conn:
+            conn.close()
+        for file in ["metrics.ini", "masq_metrics.db", "masq.prom", "masq.jsonl"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def setUp(self):
+        conn_object = ParentConnection(config="metrics.ini")
+        conn_object.delete_tables()
+        conn_object.create_tables()
+
+    def tearDown(self):
+        metrics.stop_metrics()
+
+    def test_disabled(self):
+        """
+        Tests if nothing is counted when no metrics are started.
+        :return:
+        """
+        self.assertIsNone(metrics._start())
+        metrics.add('masq_queries_total')
+        metrics._rows('edges', [(1,), (2,)], metrics._start())
+        self.assertIsNone(metrics.registry)
+
+    def test_import(self):
+        """
+        Tests if rows, files and bytes are counted for BIOM and network imports.
+        :return:
+        """
+        registry = metrics.start_metrics()
+        import_biom(location=self.biom_path, config="metrics.ini")
+        import_networks(location=os.path.join(self.network_path, 'test_1.graphml'),
+                        sources={'test_1': 'test'}, config="metrics.ini")
+        metrics.stop_metrics()
+        self.assertEqual(registry.get('masq_files_total', type='biom'), 1)
+        self.assertEqual(registry.get('masq_files_total', type='network'), 1)
+        self.assertEqual(registry.get('masq_bytes_read_total', type='biom'),
+                         os.path.getsize(self.biom_path))
+        self.assertEqual(registry.get('masq_rows_total', table='taxonomy'), 20)
+        self.assertEqual(registry.get('masq_rows_total', table='samples'), 5)
+        self.assertEqual(registry.get('masq_rows_total', table='networks'), 1)
+        self.assertGreater(registry.get('masq_rows_total', table='edges'), 0)
+        self.assertGreater(registry.get('masq_queries_total'), 0)
+        samples = [x for x in registry.samples() if x[0] == 'masq_rows_per_second']
+        self.assertEqual(len(samples), 7)
+
+    def test_prometheus(self):
+        """
+        Tests if the Prometheus textfile is rewritten with the counters.
+        :return:
+        """
+        metrics.start_metrics(path='masq.prom')
+        import_biom(location=self.biom_path, config="metrics.ini")
+        metrics.add('masq_agglomeration_iterations_total', network='g"1', step='pair')
+        metrics.stop_metrics()
+        with open('masq.prom', 'r') as file:
+            text = file.read()
+        self.assertIn('# TYPE masq_rows_total counter', text)
+        self.assertIn('# TYPE masq_rows_per_second gauge', text)
+        self.assertIn('masq_rows_total{table="taxonomy"} 20.0', text)
+        self.assertIn('masq_files_total{type="biom"} 1.0', text)
+        self.assertIn('masq_agglomeration_iterations_total{network="g\\"1",step="pair"} 1.0', text)
+
+    def test_jsonl(self):
+        """
+        Tests if a JSON line is appended for every export.
+        :return:
+        """
+        metrics.start_metrics(path='masq.jsonl', format='jsonl')
+        import_biom(location=self.biom_path, config="metrics.ini")
+        metrics.stop_metrics()
+        with open('masq.jsonl', 'r') as file:
+            lines = [json.loads(x) for x in file]
+        self.assertEqual(len(lines), 2)
+        files = [x for x in lines[-1]['metrics'] if x['name'] == 'masq_files_total']
+        self.assertEqual(files, [{'name': 'masq_files_total', 'labels': {'type': 'biom'}, 'value': 1}])
+
+    def test_export_threads(self):
+        """
+        Tests if exports from several threads
+        all replace the textfile and append complete JSON lines.
+        :return:
+        """
+        errors = list()
+
+        def export(registry):
+            try:
+                for i in range(20):
+                    registry.add('masq_files_total', 1, type='biom')
+                    registry.write()
+            except Exception as e:
+                errors.append(e)
+        for path, format in (('masq.prom', 'prometheus'), ('masq.jsonl', 'jsonl')):
+            registry = metrics.Metrics(path=path, format=format)
+            threads = [threading.Thread(target=export, args=(registry,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        with open('masq.prom', 'r') as file:
+            self.assertIn('masq_files_total{type="biom"} 160.0', file.read())
+        with open('masq.jsonl', 'r') as file:
+            lines = [json.loads(x) for x in file]
+        for file in ['masq.prom', 'masq.jsonl']:
+            os.remove(file)
+        self.assertEqual(len(lines), 160)
+
+
+if __name__ == '__main__':
+    unittest.main()
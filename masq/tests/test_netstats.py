@@ -17,6 +17,10 @@ import networkx as nx
 from masq.scripts.sq4biom import BiomConnection
 from masq.scripts.io import IoConnection
 from masq.scripts.netstats import SetConnection, _convert_network, extract_sets
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
 
 
 __author__ = 'Lisa Rottjers'
@@ -197,6 +201,15 @@ class TestNetstats(unittest.TestCase):
         os.remove("intersection.graphml")
         self.assertEqual(len(file.edges), 3)
 
+    def test_extract_sets_format(self):
+        """
+        Tests if an unsupported file format is refused.
+        :return:
+        """
+        with self.assertRaises(ValueError):
+            extract_sets(set='union', path=os.getcwd(), format='foo')
+        self.assertFalse(os.path.isfile("union.foo"))
+
     def test_get_intersection(self):
         """
         Tests if the import_network function reads the correct database file,
@@ -296,6 +309,42 @@ class TestNetstats(unittest.TestCase):
         conn_object.delete_tables()
         self.assertTrue(len(union_set.edges), 4)
 
+    def test_get_union_handler(self):
+        """
+        Tests if the rows of the union are passed to a different handler.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=g1, name='g1', study='test')
+        conn_object.add_network(network=g2, name='g2', study='test')
+        conn_object = SetConnection()
+        union_set = conn_object.get_union(networks=["g1", "g2"], handler=list)
+        conn_object.delete_tables()
+        self.assertEqual(len(union_set), 4)
+
+    @unittest.skipIf(duckdb is None, "duckdb is not installed")
+    def test_get_intersection_analytic(self):
+        """
+        Tests if the intersection is computed on the DuckDB mirror,
+        and matches the intersection computed by PostgreSQL.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'test')
+        conn_object = IoConnection()
+        conn_object.add_network(network=g1, name='g1', study='test')
+        conn_object.add_network(network=g2, name='g2', study='test')
+        conn_object = SetConnection()
+        pg_set = conn_object.get_intersection(networks=["g1", "g2"], number=2, weight=True)
+        conn_object.attach_analytic(tables=['edges'])
+        duck_set = conn_object.get_intersection(networks=["g1", "g2"], number=2, weight=True)
+        conn_object.delete_tables()
+        self.assertCountEqual(pg_set.edges, duck_set.edges)
+
     def test_aggr_networks(self):
         """
         Tests if network names are aggregated to an edge property
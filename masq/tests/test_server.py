@@ -0,0 +1,134 @@
+"""
+This file contains functions for testing the job queue and HTTP API
+in the server.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file is removed after testing.
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import logging
+from unittest import mock
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts import server as masq_server
+from masq.scripts.server import JobQueue, create_server, submit_job, get_job
+from masq.benchmarks.generators import write_dataset
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class TestServer(unittest.TestCase):
+    """
+    Tests the job queue and the HTTP API of the server.
+    """
+    @classmethod
+    def setUpClass(cls):
+        file = open("server.ini", "w")
+        file.write("[sqlite]\ndatabase = masq_server.db\n")
+        file.close()
+        cls.path = tempfile.mkdtemp()
+        cls.biom_path, cls.network_path = write_dataset(cls.path, 'test', taxa=20, samples=5,
+                                                        networks=2, edges=2)
+        conn_object = ParentConnection(config="server.ini")
+        conn_object.delete_tables()
+        conn_object.create_tables()
+        cls.queue = JobQueue(config="server.ini", workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.queue.shutdown()
+        shutil.rmtree(cls.path)
+        conn = SqliteBackend.connections.pop("masq_server.db", None)
+        if conn:
+            conn.close()
+        for file in ["server.ini", "masq_server.db"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def test_jobs(self):
+        """
+        Tests if jobs run in order with their progress,
+        and if failed jobs report their errors.
+        :return:
+        """
+        self.assertEqual(self.queue.workers, 1)
+        first = self.queue.submit('import_biom', {'location': self.biom_path})
+        second = self.queue.submit('import_networks', {'location': self.network_path,
+                                                       'sources': {'test_1': 'test',
+                                                                   'test_2': 'test'}})
+        failed = self.queue.submit('export_biom', {'study': 'test', 'path': self.path})
+        self.assertIn(first['status'], ['queued', 'running'])
+        first = self.queue.wait(first['id'], timeout=60)
+        second = self.queue.wait(second['id'], timeout=60)
+        failed = self.queue.wait(failed['id'], timeout=60)
+        self.assertEqual(first['status'], 'done')
+        self.assertEqual(first['progress'], 'Uploaded BIOM data for test.')
+        self.assertEqual(second['status'], 'done')
+        self.assertEqual(len(second['messages']), 2)
+        self.assertEqual(failed['status'], 'failed')
+        self.assertGreater(len(failed['errors']), 0)
+        networks = ParentConnection(config="server.ini").get_networks()
+        self.assertEqual(sorted(networks), ['test_1', 'test_2'])
+        self.assertEqual(self.queue.status()['jobs']['failed'], 1)
+
+    def test_invalid_jobs(self):
+        """
+        Tests if unknown job types, parameters and connection parameters are refused.
+        :return:
+        """
+        with self.assertRaises(ValueError):
+            self.queue.submit('delete_tables')
+        with self.assertRaises(ValueError):
+            self.queue.submit('import_biom', {'location': 'x', 'config': 'other.ini'})
+        with self.assertRaises(TypeError):
+            self.queue.submit('import_biom', {'folder': 'x'})
+
+    def test_main_logger(self):
+        """
+        Tests if a job that raises fails,
+        also when the server logger is not a child of the masq logger.
+        :return:
+        """
+        with mock.patch.object(masq_server, 'logger', logging.getLogger('__main__')):
+            job = self.queue.submit('import_biom', {'location': os.path.join(self.path, 'missing.biom')})
+            job = self.queue.wait(job['id'], timeout=60)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('missing.biom', job['errors'][-1])
+
+    def test_http(self):
+        """
+        Tests if jobs can be submitted and followed over HTTP.
+        :return:
+        """
+        server = create_server(self.queue, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://localhost:' + str(server.server_address[1])
+        try:
+            job = submit_job(url, 'export_networks', path=self.path)
+            self.queue.wait(job['id'], timeout=60)
+            job = get_job(url, job['id'])
+            self.assertEqual(job['type'], 'export_networks')
+            self.assertIn(job['id'], [x['id'] for x in get_job(url)])
+            with self.assertRaises(ValueError):
+                submit_job(url, 'import_biom', folder='x')
+            with self.assertRaises(ValueError):
+                get_job(url, 'missing')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,7 @@ import biom
 import psycopg2
 import networkx as nx
 from biom.cli.util import write_biom_table
-from masq.scripts.sq4biom import BiomConnection, import_biom
+from masq.scripts.sq4biom import BiomConnection, import_biom, _clean_taxonomy
 
 
 __author__ = 'Lisa Rottjers'
@@ -282,6 +282,125 @@ class TestBiom(unittest.TestCase):
         conn.close()
         conn_object.delete_tables()
 
+    def test_add_biom_bulk(self):
+        """
+        Tests if the BIOM file is imported through staging tables,
+        and if the staging tables are removed afterwards.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana', bulk=True)
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        cur.execute("SELECT * from counts;")
+        result = cur.fetchall()
+        cur.execute("SELECT * from information_schema.tables "
+                    "WHERE table_name LIKE 'staging_%';")
+        staging = cur.fetchall()
+        cur.close()
+        conn.close()
+        conn_object.delete_tables()
+        self.assertEqual(len(result), 30)
+        self.assertEqual(len(staging), 0)
+
+    def test_add_biom_bulk_error(self):
+        """
+        Tests if a failed bulk import leaves the tables untouched.
+        The second import clashes with the taxonomy of the first one.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana', bulk=True)
+        conn_object.add_biom(testbiom, 'apple', bulk=True)
+        conn = psycopg2.connect(**{"host": "localhost",
+                                   "database": "test",
+                                   "user": "test",
+                                   "password": "test"})
+        cur = conn.cursor()
+        cur.execute("SELECT studyID from bioms;")
+        result = cur.fetchall()
+        cur.execute("SELECT * from counts;")
+        counts = cur.fetchall()
+        cur.close()
+        conn.close()
+        conn_object.delete_tables()
+        self.assertEqual(result, [('banana',)])
+        self.assertEqual(len(counts), 30)
+
+    def test_get_counts(self):
+        """
+        Tests if the count matrix is returned as a sparse matrix
+        with the same values as the BIOM file.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        matrix, taxa, samples = conn_object.get_counts('banana')
+        conn_object.delete_tables()
+        self.assertEqual(matrix.shape, (5, 6))
+        self.assertEqual(matrix.nnz, 15)
+        self.assertEqual(matrix[list(taxa).index('GG_OTU_2'),
+                                list(samples).index('Sample1')], 5)
+
+    def test_get_counts_filter(self):
+        """
+        Tests if only the requested taxa and samples are returned.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        matrix, taxa, samples = conn_object.get_counts('banana', taxa=['GG_OTU_1', 'GG_OTU_4'],
+                                                       samples=['Sample3', 'Sample4'])
+        conn_object.delete_tables()
+        self.assertListEqual(list(taxa), ['GG_OTU_1', 'GG_OTU_4'])
+        self.assertListEqual(list(samples), ['Sample3', 'Sample4'])
+        self.assertListEqual(matrix.toarray().tolist(), [[1, 0], [1, 0]])
+
+    def test_export_biom(self):
+        """
+        Tests if the BIOM file written from the database
+        contains the same counts, taxonomy and sample metadata.
+        :return:
+        """
+        conn_object = BiomConnection()
+        conn_object.create_tables()
+        conn_object.add_biom(testbiom, 'banana')
+        conn_object.export_biom('banana', 'banana.biom')
+        conn_object.delete_tables()
+        biomtab = biom.load_table('banana.biom')
+        os.remove('banana.biom')
+        self.assertEqual(biomtab.get_value_by_ids('GG_OTU_2', 'Sample1'), 5)
+        self.assertEqual(biomtab.sum(), testbiom.sum())
+        self.assertListEqual(list(biomtab.metadata('GG_OTU_4', axis='observation')['taxonomy']),
+                             list(testbiom.metadata('GG_OTU_4', axis='observation')['taxonomy']))
+        self.assertEqual(biomtab.metadata('Sample4', axis='sample')['BODY_SITE'], 'skin')
+
+    def test_clean_taxonomy(self):
+        """
+        Tests if levels with only a prefix are removed,
+        if short lineages are padded,
+        and if identical lineages share one cleaned tuple.
+        :return:
+        """
+        lineages = _clean_taxonomy(testbiom.metadata(axis='observation'))
+        self.assertEqual(len(lineages), 5)
+        self.assertEqual(lineages[0], ('k__Bacteria', 'p__Proteobacteria', 'c__Gammaproteobacteria',
+                                       'o__Enterobacteriales', 'f__Enterobacteriaceae',
+                                       'g__Escherichia', None))
+        self.assertEqual(lineages[3][6], 's__Halanaerobiumsaccharolyticum')
+        self.assertIs(lineages[0], lineages[4])
+        self.assertEqual(_clean_taxonomy([{'taxonomy': ['k__Bacteria', '']},
+                                          {'taxonomy': ['k__Archaea', None, 'c__']}]),
+                         [('k__Bacteria', None, None, None, None, None, None),
+                          ('k__Archaea', None, None, None, None, None, None)])
+
     def test_add_summary(self):
         """
         Tests whether a row is added to the bioms table.
@@ -0,0 +1,154 @@
+"""
+This file contains functions for testing the spans in the tracing.py file.
+
+The tests run on an embedded SQLite database,
+so they do not need a PostgreSQL server.
+The database file and trace files are removed after testing.
+"""
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from masq.scripts.utils import ParentConnection
+from masq.scripts.backends import SqliteBackend
+from masq.scripts.sq4biom import import_biom
+from masq.scripts.io import import_networks
+from masq.scripts.metastats import start_metastats
+from masq.scripts import tracing
+from masq.benchmarks.generators import write_dataset
+
+
+__author__ = 'Lisa Rottjers'
+__maintainer__ = 'Lisa Rottjers'
+__email__ = 'lisa.rottjers@kuleuven.be'
+__status__ = 'Development'
+__license__ = 'Apache 2.0'
+
+
+class ListExporter:
+    """
+    Keeps finished spans in a list.
+    """
+    def __init__(self):
+        self.spans = list()
+        self.closed = False
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def shutdown(self):
+        self.closed = True
+
+
+class TestTracing(unittest.TestCase):
+    """
+    Tests the tracing spans and exporters.
+    """
+    @classmethod
+    def setUpClass(cls):
+        file = open("tracing.ini", "w")
+        file.write("[sqlite]\ndatabase = masq_tracing.db\n")
+        file.close()
+        cls.path = tempfile.mkdtemp()
+        cls.biom_path, cls.network_path = write_dataset(cls.path, 'test', taxa=20, samples=5,
+                                                        networks=1, edges=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        conn = SqliteBackend.connections.pop("masq_tracing.db", None)
+        if conn:
+            conn.close()
+        for file in ["tracing.ini", "masq_tracing.db", "masq_trace.jsonl"]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def setUp(self):
+        conn_object = ParentConnection(config="tracing.ini")
+        conn_object.delete_tables()
+        conn_object.create_tables()
+
+    def tearDown(self):
+        tracing.stop_tracing()
+
+    def test_disabled(self):
+        """
+        Tests if traced functions run unchanged when tracing is disabled.
+        :return:
+        """
+        @tracing.traced('double', rows='values')
+        def double(values):
+            return values * 2
+        self.assertEqual(double([1]), [1, 1])
+        with tracing.span('test', rows=[(1,)]) as span:
+            tracing.set_attribute('network', 'g1')
+        self.assertFalse(span)
+
+    def test_import_biom(self):
+        """
+        Tests if the BIOM import is recorded as a tree of spans
+        with study names and row counts.
+        :return:
+        """
+        exporter = ListExporter()
+        tracing.start_tracing(exporter=exporter)
+        import_biom(location=self.biom_path, config="tracing.ini")
+        tracing.stop_tracing()
+        self.assertTrue(exporter.closed)
+        spans = {x.name: x for x in exporter.spans}
+        self.assertEqual(exporter.spans[-1].name, 'import_biom')
+        self.assertEqual(spans['add_biom'].parent, spans['import_biom'])
+        self.assertEqual(spans['add_taxon'].parent, spans['add_biom'])
+        self.assertEqual(spans['add_observation'].trace_id, spans['import_biom'].trace_id)
+        self.assertEqual(spans['add_biom'].attributes, {'study': 'test', 'bulk': False,
+                                                        'taxa': 20, 'samples': 5})
+        self.assertEqual(spans['add_taxon'].attributes['rows'], 20)
+        self.assertTrue(all(x.end >= x.start for x in exporter.spans))
+
+    def test_agglomeration(self):
+        """
+        Tests if agglomeration iterations are recorded
+        as children of agglomerate_networks.
+        :return:
+        """
+        import_biom(location=self.biom_path, config="tracing.ini")
+        import_networks(location=os.path.join(self.network_path, 'test_1.graphml'),
+                        sources={'test_1': 'test'}, config="tracing.ini")
+        exporter = ListExporter()
+        tracing.start_tracing(exporter=exporter)
+        start_metastats('Genus', networks=['test_1'], config="tracing.ini")
+        tracing.stop_tracing()
+        pairs = [x for x in exporter.spans if x.name == 'get_pairlist']
+        self.assertGreater(len(pairs), 0)
+        self.assertEqual(pairs[0].parent.name, 'agglomerate_networks')
+        self.assertEqual(pairs[0].parent.parent.name, 'start_metastats')
+        self.assertEqual(pairs[-1].attributes['rows'], 0)
+        agglomerated = [x for x in exporter.spans if x.name == 'agglomerate_pair']
+        self.assertEqual(agglomerated[0].attributes['network'], 'Species_test_1')
+
+    def test_file_exporter(self):
+        """
+        Tests if spans are written as JSON lines, with errors.
+        :return:
+        """
+        tracing.start_tracing(path='masq_trace.jsonl')
+        with tracing.span('parent', network='g1'):
+            with self.assertRaises(ValueError):
+                with tracing.span('child', rows=[(1,), (2,)]):
+                    raise ValueError('wrong value')
+        tracing.stop_tracing()
+        with open('masq_trace.jsonl', 'r') as file:
+            spans = [json.loads(x) for x in file]
+        self.assertEqual([x['name'] for x in spans], ['child', 'parent'])
+        self.assertEqual(spans[0]['parent_id'], spans[1]['span_id'])
+        self.assertEqual(spans[0]['attributes'], {'rows': 2})
+        self.assertEqual(spans[0]['status'], 'error')
+        self.assertEqual(spans[0]['error'], 'ValueError: wrong value')
+        self.assertIsNone(spans[1]['parent_id'])
+        self.assertEqual(spans[1]['status'], 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
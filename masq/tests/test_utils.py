@@ -11,6 +11,7 @@ this is not done in the testing environment.
 
 import unittest
 import os
+from unittest import mock
 import biom
 import psycopg2
 import networkx as nx
@@ -183,6 +184,17 @@ class TestUtils(unittest.TestCase):
         read_config = conn.config
         self.assertTrue(test_config == read_config)
 
+    def test_get_version(self):
+        """
+        Tests if the database version can be retrieved,
+        and if no connection is needed to initialize the ParentConnection.
+        :return:
+        """
+        conn = ParentConnection(host='unreachable.invalid')
+        self.assertIsNone(conn.get_version())
+        conn = ParentConnection()
+        self.assertTrue(conn.get_version().startswith('PostgreSQL'))
+
     def test_create_tables(self):
         """
         Tests if the requested tables are created.
@@ -305,6 +317,120 @@ class TestUtils(unittest.TestCase):
         conn.close()
         conn_object.delete_tables()
 
+    def test_iter_query(self):
+        """
+        Tests whether the rows are streamed from a server-side cursor.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.create_tables()
+        biom_query = "INSERT INTO bioms (studyID,tax_num,sample_num) " \
+                     "VALUES (%s,%s,%s)"
+        conn_object.value_query(biom_query, values=[("test", 300, 200),
+                                                    ("test2", 400, 1500),
+                                                    ("test3", 10, 20)])
+        rows = conn_object.iter_query("SELECT studyID FROM bioms WHERE tax_num > %s "
+                                      "ORDER BY studyID;", values=(100,), itersize=1)
+        first = next(rows)
+        result = [first] + list(rows)
+        conn_object.delete_tables()
+        self.assertListEqual(result, [('test',), ('test2',)])
+
+    def test_prepared_query(self):
+        """
+        Tests whether prepared statements are reused,
+        and the least recently used statement is deallocated.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.statement_cache_size = 2
+        conn_object.create_tables()
+        biom_query = "INSERT INTO bioms (studyID,tax_num,sample_num) " \
+                     "VALUES (%s,%s,%s)"
+        select_query = "SELECT studyID FROM bioms WHERE tax_num > %s;"
+        count_query = "SELECT COUNT(*) FROM bioms WHERE sample_num > %s;"
+        conn_object.prepared_query(biom_query, values=[("test", 300, 200),
+                                                       ("test2", 400, 1500)])
+        conn_object.prepared_query(select_query, values=(350,), fetch=True)
+        result = conn_object.prepared_query(select_query, values=(350,), fetch=True)
+        conn_object.prepared_query(count_query, values=(0,), fetch=True)
+        statements = conn_object.prepared_query("SELECT COUNT(*) FROM pg_prepared_statements "
+                                                "WHERE name LIKE %s;", values=('masq_%',), fetch=True)
+        cached = list(conn_object.statements)
+        conn_object.close()
+        conn_object.delete_tables()
+        self.assertListEqual(result, [('test2',)])
+        self.assertNotIn(biom_query, cached)
+        self.assertEqual(statements[0][0], 2)
+
+    def test_prepared_query_error(self):
+        """
+        Tests whether a failed prepared statement returns no rows,
+        and is not kept in the statement cache.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.create_tables()
+        missing_query = "SELECT weight FROM missing WHERE source=%s;"
+        error_query = "SELECT tax_num / %s FROM bioms;"
+        conn_object.value_query("INSERT INTO bioms (studyID,tax_num,sample_num) "
+                                "VALUES (%s,%s,%s)", values=("test", 300, 200))
+        missing = conn_object.prepared_query(missing_query, values=('a',), fetch=True)
+        error = conn_object.prepared_query(error_query, values=(0,), fetch=True)
+        result = conn_object.prepared_query(error_query, values=(3,), fetch=True)
+        cached = list(conn_object.statements)
+        conn_object.close()
+        conn_object.delete_tables()
+        self.assertEqual(missing, [])
+        self.assertEqual(error, [])
+        self.assertEqual(result, [(100,)])
+        self.assertNotIn(missing_query, cached)
+        self.assertIn(error_query, cached)
+
+    def test_close_aborted(self):
+        """
+        Tests whether the prepared statement connection is released
+        when its transaction was aborted.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.prepared_query("SELECT %s;", values=(1,), fetch=True)
+        session = conn_object.session
+        c = session.cursor()
+        try:
+            c.execute("SELECT * FROM missing;")
+        except psycopg2.Error:
+            pass
+        conn_object.close()
+        self.assertIsNone(conn_object.session)
+        self.assertEqual(conn_object.statements, dict())
+        self.assertTrue(session.closed)
+
+    def test_release_dropped(self):
+        """
+        Tests whether a pooled connection that the server dropped
+        is closed instead of returned to the pool.
+        :return:
+        """
+        conn_object = ParentConnection()
+        backend = conn_object.backend
+        backend.open_pool(1)
+        try:
+            conn = backend.connect()
+            # the rollback only reaches the server in a transaction
+            conn.cursor().execute("SELECT 1;")
+            other = psycopg2.connect(**conn_object.config)
+            c = other.cursor()
+            c.execute("SELECT pg_terminate_backend(%s);", (conn.get_backend_pid(),))
+            c.close()
+            other.close()
+            backend.release(conn)
+            idle = list(backend.idle.get(backend.key, list()))
+        finally:
+            backend.close_pool()
+        self.assertTrue(conn.closed)
+        self.assertNotIn(conn, idle)
+
     def test_value_query_error(self):
         """
         Tests if the value query correctly reports an error
@@ -321,6 +447,109 @@ class TestUtils(unittest.TestCase):
                           ["test", 300, 200])
         conn_object.delete_tables()
 
+    def test_create_tables_list_partition(self):
+        """
+        Tests if a list-partitioned edges table gets
+        a separate partition for each network,
+        and if this partition is dropped when the network is deleted.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.create_tables(partition='list')
+        conn_object.value_query("INSERT INTO bioms (studyID,tax_num,sample_num) "
+                                "VALUES (%s,%s,%s)", values=("test", 300, 200))
+        conn_object.value_query("INSERT INTO networks (networkID,studyID,node_num,edge_num) "
+                                "VALUES (%s,%s,%s,%s)", values=("g", "test", 2, 1))
+        conn_object.add_partition('edges', 'g')
+        layout = conn_object.get_partition_layout('edges')
+        partitions = conn_object.query("SELECT c.relname FROM pg_inherits AS i "
+                                       "JOIN pg_class AS c ON i.inhrelid = c.oid "
+                                       "JOIN pg_class AS p ON i.inhparent = p.oid "
+                                       "WHERE p.relname = 'edges';", fetch=True)
+        conn_object.delete_network('g')
+        remaining = conn_object.query("SELECT c.relname FROM pg_inherits AS i "
+                                      "JOIN pg_class AS c ON i.inhrelid = c.oid "
+                                      "JOIN pg_class AS p ON i.inhparent = p.oid "
+                                      "WHERE p.relname = 'edges';", fetch=True)
+        conn_object.delete_tables()
+        self.assertEqual(layout, 'list')
+        self.assertEqual(len(partitions), 2)
+        self.assertEqual(remaining, [('edges_default',)])
+
+    def test_get_partition_layout_cache(self):
+        """
+        Tests if the partition layout is only queried once per connection object,
+        and looked up again after the tables are recreated.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.create_tables(partition='list')
+        with mock.patch.object(conn_object.backend, 'partition_layout',
+                               wraps=conn_object.backend.partition_layout) as lookup:
+            conn_object.add_partition('edges', 'g')
+            conn_object.add_partition('edges', 'f')
+            layout = conn_object.get_partition_layout('edges')
+            calls = lookup.call_count
+            conn_object.delete_tables()
+            conn_object.create_tables()
+            recreated = conn_object.get_partition_layout('edges')
+        conn_object.delete_tables()
+        self.assertEqual(layout, 'list')
+        self.assertEqual(calls, 1)
+        self.assertIsNone(recreated)
+
+    def test_create_tables_hash_partition(self):
+        """
+        Tests if the hash layout creates the requested number of partitions.
+        :return:
+        """
+        conn_object = ParentConnection()
+        conn_object.create_tables(partition='hash', partitions=4)
+        result = conn_object.query("SELECT c.relname FROM pg_inherits AS i "
+                                   "JOIN pg_class AS c ON i.inhrelid = c.oid "
+                                   "JOIN pg_class AS p ON i.inhparent = p.oid "
+                                   "WHERE p.relname = 'counts';", fetch=True)
+        layout = conn_object.get_partition_layout('counts')
+        conn_object.delete_tables()
+        self.assertEqual(layout, 'hash')
+        self.assertEqual(len(result), 4)
+
+    def test_lock(self):
+        """
+        Tests if advisory locks keep other sessions out while they are held,
+        if shared locks can be taken together,
+        and if a nested lock on the same resource does not wait for itself.
+        :return:
+        """
+        conn_object = ParentConnection()
+        other = psycopg2.connect(**conn_object.config)
+        other.autocommit = True
+        cur = other.cursor()
+        lock = "SELECT pg_try_advisory_lock(%s, hashtext(%s));"
+        unlock = "SELECT pg_advisory_unlock(%s, hashtext(%s));"
+        shared = "SELECT pg_try_advisory_lock_shared(%s, hashtext(%s));"
+        unlock_shared = "SELECT pg_advisory_unlock_shared(%s, hashtext(%s));"
+        with conn_object.lock(exclusive=[('network', 'g1')], shared=[('study', 'test')]):
+            with conn_object.lock(exclusive=[('network', 'g1')]):
+                self.assertIn(('network', 'g1'), conn_object.locks)
+            cur.execute(lock, (2, 'g1'))
+            network_locked = cur.fetchone()[0]
+            cur.execute(shared, (1, 'test'))
+            study_shared = cur.fetchone()[0]
+            cur.execute(unlock_shared, (1, 'test'))
+            cur.execute(lock, (1, 'test'))
+            study_locked = cur.fetchone()[0]
+        cur.execute(lock, (2, 'g1'))
+        released = cur.fetchone()[0]
+        cur.execute(unlock, (2, 'g1'))
+        cur.close()
+        other.close()
+        self.assertFalse(network_locked)
+        self.assertTrue(study_shared)
+        self.assertFalse(study_locked)
+        self.assertTrue(released)
+        self.assertEqual(conn_object.locks, set())
+
 
 if __name__ == '__main__':
     unittest.main()